@@ -6,7 +6,7 @@ import { createServer } from "http";
 import fs from "fs";
 import path from "path";
 import { fileURLToPath } from "url";
-import { execSync } from "child_process";
+import { execFileSync, execSync } from "child_process";
 import pg from "pg";
 
 const {
@@ -596,21 +596,88 @@ function broadcastPipelineMetrics(metrics) {
   });
 }
 
-// Helper to read queue file sizes
+// Helper to read queue depths. Queues live in .backlog/queues.db
+// (scripts/agents/queue_store.py); the .txt files are only inboxes it drains.
+// queue_store publishes each depth to .backlog/queue_depths/<queue>, which is
+// readable without SQLite; queue_store.py len is the fallback where python is.
 function getQueueStats() {
-  const readQueueSize = (filename) => {
-    const filepath = path.join(rootDir, ".backlog", filename);
-    if (!fs.existsSync(filepath)) return 0;
-    const content = fs.readFileSync(filepath, "utf8");
-    return content.trim().split("\n").filter(line => line.length > 0).length;
+  const backlogDir = path.join(rootDir, ".backlog");
+  const queueStore = path.join(rootDir, "scripts", "agents", "queue_store.py");
+  const readQueueSize = (name) => {
+    const depthFile = path.join(backlogDir, "queue_depths", name);
+    if (fs.existsSync(depthFile)) {
+      const depth = parseInt(fs.readFileSync(depthFile, "utf8"), 10);
+      if (!Number.isNaN(depth)) return depth;
+    }
+    if (fs.existsSync(queueStore)) {
+      try {
+        const out = execFileSync("python3", [queueStore, "len", "--file", path.join(backlogDir, `${name}.txt`)], {
+          encoding: "utf8",
+          timeout: 5000,
+          stdio: ["ignore", "pipe", "ignore"],
+        });
+        const depth = parseInt(out, 10);
+        if (!Number.isNaN(depth)) return depth;
+      } catch (err) {
+        // no python here: fall through to the inbox
+      }
+    }
+    const inbox = path.join(backlogDir, `${name}.txt`);
+    if (!fs.existsSync(inbox)) return 0;
+    return fs.readFileSync(inbox, "utf8").split("\n").filter(line => line.trim().length > 0).length;
   };
-  
+
+  const fetchInternal = readQueueSize("fetch_queue_internal");
+  const fetchExternal = readQueueSize("fetch_queue_external");
   return {
-    fetch_queue: readQueueSize("fetch_queue.txt"),
-    process_queue: readQueueSize("process_queue.txt"),
+    fetch_queue: fetchInternal + fetchExternal,
+    fetch_queue_internal: fetchInternal,
+    fetch_queue_external: fetchExternal,
+    process_queue: readQueueSize("process_queue"),
   };
 }
 
+// Seconds between API requests implied by the shared token bucket (API_RATE_PER_HOUR in agents.config)
+function getRateLimitDelay() {
+  const configFile = path.join(rootDir, "scripts", "config", "agents.config");
+  let ratePerHour = 1200;
+  try {
+    if (fs.existsSync(configFile)) {
+      const match = fs.readFileSync(configFile, "utf8").match(/^\s*API_RATE_PER_HOUR\s*=\s*"?(\d+(?:\.\d+)?)/m);
+      if (match) ratePerHour = parseFloat(match[1]);
+    }
+  } catch (err) {
+    console.warn("Could not read API_RATE_PER_HOUR:", err.message);
+  }
+  return ratePerHour > 0 ? 3600 / ratePerHour : 3.0;
+}
+
+// Per-stage latency from the pipeline metrics state files (scripts/agents/metrics.py)
+function getStageStats() {
+  const metricsDir = path.join(rootDir, ".backlog", "metrics");
+  const stages = {};
+  if (!fs.existsSync(metricsDir)) return stages;
+  for (const name of fs.readdirSync(metricsDir)) {
+    if (!name.endsWith(".json")) continue;
+    try {
+      const state = JSON.parse(fs.readFileSync(path.join(metricsDir, name), "utf8"));
+      const lastRun = state.last_run || {};
+      const perStage = {};
+      for (const [stage, brief] of Object.entries(lastRun.stages || {})) {
+        perStage[stage] = brief.sum;
+      }
+      stages[state.component || name.replace(/\.json$/, "")] = {
+        last_run_at: lastRun.ts || null,
+        last_run_seconds: lastRun.duration || 0,
+        stages: perStage,
+      };
+    } catch (err) {
+      console.warn(`Could not read stage metrics ${name}:`, err.message);
+    }
+  }
+  return stages;
+}
+
 // Helper to get active process count
 function getProcessStats() {
   try {
@@ -654,6 +721,7 @@ app.get("/api/pipeline/metrics", (req, res) => {
   try {
     const queues = getQueueStats();
     const processes = getProcessStats();
+    const rateLimitDelay = getRateLimitDelay();
     const now = Date.now();
     const elapsed = (now - lastFetchTime) / 1000; // seconds
     
@@ -661,8 +729,9 @@ app.get("/api/pipeline/metrics", (req, res) => {
       timestamp: new Date().toISOString(),
       queues,
       processes,
-      rate_limit_delay: 4.0,
-      estimated_throughput: queues.fetch_queue > 0 ? (60 / 4.0).toFixed(1) : 0,
+      stages: getStageStats(),
+      rate_limit_delay: Number(rateLimitDelay.toFixed(2)),
+      estimated_throughput: queues.fetch_queue > 0 ? (60 / rateLimitDelay).toFixed(1) : 0,
     });
   } catch (err) {
     console.error("[Pipeline Metrics] Error:", err);
@@ -674,14 +743,16 @@ app.get("/api/pipeline/metrics", (req, res) => {
 setInterval(() => {
   const queues = getQueueStats();
   const processes = getProcessStats();
+  const rateLimitDelay = getRateLimitDelay();
   const now = Date.now();
   const elapsed = (now - lastFetchTime) / 1000; // seconds
   
   broadcastPipelineMetrics({
     queues,
     processes,
-    rate_limit_delay: 4.0,
-    estimated_throughput: queues.fetch_queue > 0 ? (60 / 4.0).toFixed(1) : 0,
+    stages: getStageStats(),
+    rate_limit_delay: Number(rateLimitDelay.toFixed(2)),
+    estimated_throughput: queues.fetch_queue > 0 ? (60 / rateLimitDelay).toFixed(1) : 0,
   });
   
   lastFetchTime = now;
@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+"""
+Rate-limited asyncio client for the 42 API.
+
+backlog_worker.sh used to spawn one curl per request and sleep a fixed
+RATE_LIMIT_DELAY before each call (and again after each user), while
+global_rate_limiter.sh spaced fetchers with a flock'd whole-second timestamp
+and bc. Requests now go through this module:
+
+- TokenBucket: one bucket shared by every process on the host. Its state
+  (tokens, updated_at) lives in .backlog/rate_limit.bucket and is updated
+  under an exclusive flock on .backlog/rate_limit.lock (the lock file the
+  shell limiter already uses), with float precision. A caller reserves a
+  token and is told how long to wait for it; tokens may go negative, so
+  concurrent callers queue up behind each other at exactly 1/rate spacing
+  instead of polling. The lock is held only for the read-modify-write, and
+  the asyncio client takes it in an executor thread so a contended flock never
+  stalls the event loop (other requests keep streaming meanwhile).
+- Retry-After: a 429 puts the bucket in debt for the Retry-After window
+  (seconds or HTTP-date, RETRY_DELAY if absent), so every worker backs off,
+  not just the one that was throttled.
+- HttpPool: HTTP/1.1 keep-alive connections (asyncio streams + ssl) reused
+  across requests to the same host, gzip bodies, chunked or sized responses.
+- ApiClient.get_many(): up to `concurrency` requests in flight; the bucket
+  keeps the total under API_RATE_PER_HOUR (default 1200) across all workers.
+
+CLI (token from --token or API_TOKEN):
+  api_client.py get   [--status] [--label L] [--log FILE] URL
+                      body on stdout; --status appends "\\n<code>" (curl -w style,
+                      000 on network errors)
+  api_client.py fetch [--concurrency N] [--label L] [--log FILE]
+                      stdin: "URL<TAB>OUTFILE" lines; writes each body to OUTFILE
+                      and prints "<code><TAB>URL<TAB>OUTFILE" in input order
+  api_client.py serve [--concurrency N] [--label L] [--log FILE]
+                      resident mode for a worker's whole life (one keep-alive
+                      pool across all its requests): stdin "ID<TAB>URL<TAB>OUTFILE[<TAB>LABEL]"
+                      lines, each answered when done with "ID<TAB><code><TAB>URL<TAB>OUTFILE"
+                      (completion order; ID is echoed so callers can match replies)
+  api_client.py acquire                 block until one token is available
+  api_client.py bucket                  show the shared bucket state
+Common: [--rate-per-hour N] [--burst N] [--bucket PATH] [--retries N]
+        [--retry-delay S] [--timeout S]
+"""
+
+import argparse
+import asyncio
+import email.utils
+import fcntl
+import json
+import os
+import ssl
+import sys
+import time
+import zlib
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+ROOT = os.environ.get("ROOT_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+RATE_PER_HOUR = float(os.environ.get("API_RATE_PER_HOUR", "1200"))
+BURST = float(os.environ.get("API_RATE_BURST", "2"))
+RETRY_DELAY = 6.0
+CONNECT_TIMEOUT = 5.0
+USER_AGENT = "api42-backlog-worker"
+
+
+def default_bucket_path(root: str) -> str:
+    return os.environ.get("API_RATE_BUCKET") or os.path.join(root, ".backlog", "rate_limit.bucket")
+
+
+def default_lock_path(bucket_path: str) -> str:
+    return os.path.join(os.path.dirname(bucket_path), "rate_limit.lock")
+
+
+class TokenBucket:
+    """Token bucket shared across processes through a flock'd state file."""
+
+    def __init__(self, path: str, rate_per_hour: float = RATE_PER_HOUR, burst: float = BURST,
+                 lock_path: Optional[str] = None):
+        if rate_per_hour <= 0:
+            raise ValueError("rate_per_hour must be positive")
+        self.path = path
+        self.lock_path = lock_path or default_lock_path(path)
+        self.rate = rate_per_hour / 3600.0
+        self.burst = max(1.0, burst)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def _read(self) -> Dict[str, float]:
+        try:
+            with open(self.path, "r") as fh:
+                state = json.load(fh)
+            return {"tokens": float(state["tokens"]), "updated_at": float(state["updated_at"])}
+        except (OSError, ValueError, KeyError, TypeError):
+            return {"tokens": self.burst, "updated_at": time.time()}
+
+    def _write(self, state: Dict[str, float]) -> None:
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as fh:
+            json.dump(state, fh)
+        os.replace(tmp, self.path)
+
+    def _update(self, fn: Callable[[float, float], Tuple[float, float]]) -> float:
+        """Refill, apply fn(tokens, now) -> (tokens, result) under the lock, return result."""
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state = self._read()
+                now = time.time()
+                elapsed = max(0.0, now - state["updated_at"])
+                tokens = min(self.burst, state["tokens"] + elapsed * self.rate)
+                tokens, result = fn(tokens, now)
+                self._write({"tokens": tokens, "updated_at": now})
+                return result
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def reserve(self) -> float:
+        """Take one token; return the seconds to wait before using it."""
+        def take(tokens: float, now: float) -> Tuple[float, float]:
+            tokens -= 1.0
+            return tokens, max(0.0, -tokens / self.rate)
+        return self._update(take)
+
+    def backoff(self, seconds: float) -> None:
+        """Hold every caller off for `seconds` (Retry-After)."""
+        def debt(tokens: float, now: float) -> Tuple[float, float]:
+            return min(tokens, -seconds * self.rate), 0.0
+        self._update(debt)
+
+    def peek(self) -> Dict[str, float]:
+        state = self._read()
+        elapsed = max(0.0, time.time() - state["updated_at"])
+        tokens = min(self.burst, state["tokens"] + elapsed * self.rate)
+        return {"tokens": round(tokens, 3), "wait": round(max(0.0, (1.0 - tokens) / self.rate), 3),
+                "rate_per_hour": self.rate * 3600.0, "burst": self.burst}
+
+    def acquire(self) -> float:
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+def parse_retry_after(value: Optional[str], default: float = RETRY_DELAY) -> float:
+    if not value:
+        return default
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    return max(0.0, when.timestamp() - time.time())
+
+
+@dataclass
+class Response:
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+
+
+@dataclass
+class Result:
+    url: str
+    status: int = 0
+    body: bytes = b""
+    attempts: int = 0
+    error: Optional[str] = None
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+class _Connection:
+    __slots__ = ("reader", "writer")
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    def usable(self) -> bool:
+        return not self.reader.at_eof() and not self.writer.is_closing()
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class HttpPool:
+    """Minimal HTTP/1.1 GET client keeping idle keep-alive connections per host."""
+
+    def __init__(self, timeout: float = 20.0, connect_timeout: float = CONNECT_TIMEOUT):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._idle: Dict[Tuple[str, str, int], List[_Connection]] = {}
+        self._ssl: Optional[ssl.SSLContext] = None
+        self.opened = 0
+
+    async def _connect(self, key: Tuple[str, str, int]) -> _Connection:
+        scheme, host, port = key
+        ctx = None
+        if scheme == "https":
+            if self._ssl is None:
+                self._ssl = ssl.create_default_context()
+            ctx = self._ssl
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=ctx, server_hostname=host if ctx else None),
+            self.connect_timeout,
+        )
+        self.opened += 1
+        return _Connection(reader, writer)
+
+    async def get(self, url: str, headers: Dict[str, str]) -> Response:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"unsupported URL: {url}")
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        host = parts.hostname if parts.port is None else f"{parts.hostname}:{parts.port}"
+        lines = [f"GET {target} HTTP/1.1", f"Host: {host}", "Connection: keep-alive",
+                 "Accept-Encoding: gzip", f"User-Agent: {USER_AGENT}"]
+        lines.extend(f"{k}: {v}" for k, v in headers.items())
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+        idle = self._idle.setdefault(key, [])
+        while idle:
+            conn = idle.pop()
+            if not conn.usable():
+                conn.close()
+                continue
+            try:
+                return await asyncio.wait_for(self._exchange(key, conn, request), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # The server dropped an idle connection; retry on a fresh one.
+                conn.close()
+        conn = await self._connect(key)
+        return await asyncio.wait_for(self._exchange(key, conn, request), self.timeout)
+
+    async def _exchange(self, key: Tuple[str, str, int], conn: _Connection, request: bytes) -> Response:
+        try:
+            conn.writer.write(request)
+            await conn.writer.drain()
+            status_line = await conn.reader.readline()
+            if not status_line:
+                raise ConnectionResetError("connection closed before response")
+            version, status, _ = (status_line.decode("latin-1").rstrip("\r\n").split(" ", 2) + [""])[:3]
+            headers: Dict[str, str] = {}
+            while True:
+                line = await conn.reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            code = int(status)
+            keep_alive = headers.get("connection", "").lower() != "close" and version != "HTTP/1.0"
+            if code in (204, 304) or 100 <= code < 200:
+                body = b""
+            elif "chunked" in headers.get("transfer-encoding", "").lower():
+                body = await self._read_chunked(conn.reader)
+            elif "content-length" in headers:
+                body = await conn.reader.readexactly(int(headers["content-length"]))
+            else:
+                body = await conn.reader.read()
+                keep_alive = False
+        except BaseException:
+            conn.close()
+            raise
+        if keep_alive:
+            self._idle.setdefault(key, []).append(conn)
+        else:
+            conn.close()
+        if headers.get("content-encoding", "").lower() == "gzip":
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        return Response(code, headers, body)
+
+    @staticmethod
+    async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+        chunks: List[bytes] = []
+        while True:
+            size_line = await reader.readline()
+            size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+            if size == 0:
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+    async def close(self) -> None:
+        for conns in self._idle.values():
+            for conn in conns:
+                conn.close()
+        self._idle.clear()
+
+
+class ApiClient:
+    """Bearer-authenticated GETs through a shared TokenBucket and a keep-alive pool."""
+
+    def __init__(self, token: str, bucket: TokenBucket, concurrency: int = 4, timeout: float = 20.0,
+                 retries: int = 2, retry_delay: float = RETRY_DELAY,
+                 log: Optional[Callable[[str], None]] = None):
+        self.token = token
+        self.bucket = bucket
+        self.concurrency = max(1, concurrency)
+        self.retries = max(0, retries)
+        self.retry_delay = retry_delay
+        self.pool = HttpPool(timeout=timeout)
+        self.log = log or (lambda msg: None)
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def get(self, url: str, label: str = "") -> Result:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        loop = asyncio.get_running_loop()
+        label = label or url
+        result = Result(url)
+        headers = {"Authorization": f"Bearer {self.token}", "Accept": "application/json"}
+        while result.attempts <= self.retries:
+            result.attempts += 1
+            async with self._slots:
+                # reserve()/backoff() block on the bucket flock: keep them off the event loop
+                wait = await loop.run_in_executor(None, self.bucket.reserve)
+                if wait:
+                    await asyncio.sleep(wait)
+                try:
+                    resp = await self.pool.get(url, headers)
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, zlib.error) as exc:
+                    result.status, result.body, result.error = 0, b"", f"{type(exc).__name__}: {exc}"
+                    resp = None
+            if resp is None:
+                self.log(f"WARN {label} fetch failed ({result.error})")
+            else:
+                result.status, result.body, result.headers, result.error = resp.status, resp.body, resp.headers, None
+                if resp.status == 200:
+                    return result
+            if result.attempts > self.retries:
+                break
+            if result.status == 429:
+                delay = parse_retry_after(result.headers.get("retry-after"), self.retry_delay)
+                self.log(f"WARN {label} fetch returned HTTP 429 (rate limit), retrying in {delay:.1f}s...")
+                await loop.run_in_executor(None, self.bucket.backoff, delay)
+            elif result.status == 403:
+                self.log(f"WARN {label} fetch returned HTTP 403 (forbidden), backing off")
+                await asyncio.sleep(self.retry_delay)
+            elif result.status >= 500 or result.status == 0:
+                await asyncio.sleep(self.retry_delay)
+            else:
+                break
+        return result
+
+    async def get_many(self, urls: List[str], label: str = "") -> List[Result]:
+        return list(await asyncio.gather(*(self.get(url, f"{label} {url}".strip()) for url in urls)))
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+
+def make_logger(path: Optional[str]) -> Callable[[str], None]:
+    """Log lines in backlog_worker.sh's log_msg format."""
+    def log(msg: str) -> None:
+        line = f"[{time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}] {msg}\n"
+        if path:
+            with open(path, "a") as fh:
+                fh.write(line)
+        else:
+            sys.stderr.write(line)
+    return log
+
+
+def build_client(args: argparse.Namespace) -> ApiClient:
+    token = args.token or os.environ.get("API_TOKEN", "")
+    return ApiClient(token, make_bucket(args), concurrency=getattr(args, "concurrency", 1), timeout=args.timeout,
+                     retries=args.retries, retry_delay=args.retry_delay, log=make_logger(args.log))
+
+
+def make_bucket(args: argparse.Namespace) -> TokenBucket:
+    return TokenBucket(args.bucket or default_bucket_path(ROOT), args.rate_per_hour, args.burst)
+
+
+async def _cmd_get(args: argparse.Namespace) -> int:
+    client = build_client(args)
+    try:
+        result = await client.get(args.url, args.label)
+    finally:
+        await client.close()
+    out = sys.stdout.buffer
+    if result.status == 200 or args.status:
+        out.write(result.body)
+    if args.status:
+        out.write(f"\n{result.status:03d}".encode())
+    out.flush()
+    return 0 if result.status == 200 or args.status else 1
+
+
+async def _cmd_fetch(args: argparse.Namespace) -> int:
+    jobs: List[Tuple[str, str]] = []
+    for line in sys.stdin:
+        line = line.rstrip("\n")
+        if not line.strip():
+            continue
+        url, _, outfile = line.partition("\t")
+        jobs.append((url.strip(), outfile.strip()))
+    client = build_client(args)
+    try:
+        results = await client.get_many([url for url, _ in jobs], args.label)
+    finally:
+        await client.close()
+    for (url, outfile), result in zip(jobs, results):
+        if outfile and result.status == 200:
+            with open(outfile, "wb") as fh:
+                fh.write(result.body)
+        print(f"{result.status:03d}\t{url}\t{outfile}")
+    return 0
+
+
+async def _cmd_serve(args: argparse.Namespace) -> int:
+    loop = asyncio.get_running_loop()
+    stdin = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(stdin), sys.stdin)
+    client = build_client(args)
+    pending = set()
+
+    async def handle(req_id: str, url: str, outfile: str, label: str) -> None:
+        result = await client.get(url, label or args.label)
+        if outfile and result.status == 200:
+            try:
+                with open(outfile, "wb") as fh:
+                    fh.write(result.body)
+            except OSError:
+                # The caller gave up on this request and removed its directory.
+                result.status = 0
+        sys.stdout.write(f"{req_id}\t{result.status:03d}\t{url}\t{outfile}\n")
+        sys.stdout.flush()
+
+    try:
+        while True:
+            line = await stdin.readline()
+            if not line:
+                break
+            req_id, _, rest = line.decode().rstrip("\n").partition("\t")
+            url, _, rest = rest.partition("\t")
+            outfile, _, label = rest.partition("\t")
+            if not url.strip():
+                continue
+            task = asyncio.ensure_future(handle(req_id, url.strip(), outfile.strip(), label.strip()))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+    finally:
+        await client.close()
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rate-limited keep-alive client for the 42 API.")
+    parser.add_argument("--rate-per-hour", type=float, default=RATE_PER_HOUR, help="Global request budget (all workers)")
+    parser.add_argument("--burst", type=float, default=BURST, help="Bucket capacity")
+    parser.add_argument("--bucket", default=None, help="Bucket state file (default: .backlog/rate_limit.bucket)")
+    parser.add_argument("--token", default=None, help="Bearer token (default: $API_TOKEN)")
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--retry-delay", type=float, default=RETRY_DELAY, help="Backoff when no Retry-After is sent")
+    parser.add_argument("--timeout", type=float, default=20.0, help="Per-request timeout (seconds)")
+    parser.add_argument("--log", default=None, help="Append warnings here (default: stderr)")
+    parser.add_argument("--label", default="", help="Label used in warnings")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_get = sub.add_parser("get", help="GET one URL")
+    p_get.add_argument("--status", action="store_true", help="Append the HTTP status on a last line")
+    p_get.add_argument("url")
+    p_fetch = sub.add_parser("fetch", help="GET URL<TAB>OUTFILE lines from stdin concurrently")
+    p_fetch.add_argument("--concurrency", type=int, default=4)
+    p_serve = sub.add_parser("serve", help="Resident mode: tagged URL<TAB>OUTFILE requests on stdin")
+    p_serve.add_argument("--concurrency", type=int, default=4)
+    sub.add_parser("acquire", help="Wait for one token of the shared bucket")
+    sub.add_parser("bucket", help="Show the shared bucket state")
+    args = parser.parse_args()
+
+    if args.cmd == "get":
+        sys.exit(asyncio.run(_cmd_get(args)))
+    if args.cmd == "fetch":
+        sys.exit(asyncio.run(_cmd_fetch(args)))
+    if args.cmd == "serve":
+        sys.exit(asyncio.run(_cmd_serve(args)))
+    bucket = make_bucket(args)
+    if args.cmd == "acquire":
+        bucket.acquire()
+    else:
+        print(json.dumps(bucket.peek()))
+
+
+if __name__ == "__main__":
+    main()
@@ -28,26 +28,99 @@ fi
 if [[ -z "${RATE_LIMIT_DELAY:-}" && -f "$AGENTS_CONFIG" ]]; then
   RATE_LIMIT_DELAY=$(grep -E '^\s*RATE_LIMIT_DELAY=' "$AGENTS_CONFIG" | head -1 | cut -d= -f2 | tr -d '"')
 fi
-RATE_LIMIT_DELAY="${RATE_LIMIT_DELAY:-6}"  # seconds between API calls to stay under limits (1000 calls/hour = 3.6s min; 6s = 600 calls/hour)
+RATE_LIMIT_DELAY="${RATE_LIMIT_DELAY:-6}"  # retry backoff when a 429 carries no Retry-After
+# Global request budget shared with every fetcher (token bucket in .backlog/rate_limit.bucket)
+for key in API_RATE_PER_HOUR API_RATE_BURST API_CONCURRENCY; do
+  if [[ -z "${!key:-}" && -f "$AGENTS_CONFIG" ]]; then
+    printf -v "$key" '%s' "$(grep -E "^\s*${key}=" "$AGENTS_CONFIG" | head -1 | cut -d= -f2 | tr -d '"')"
+  fi
+done
+API_RATE_PER_HOUR="${API_RATE_PER_HOUR:-1200}"
+API_RATE_BURST="${API_RATE_BURST:-2}"
+API_CONCURRENCY="${API_CONCURRENCY:-3}"
+API_REPLY_TIMEOUT="${API_REPLY_TIMEOUT:-300}"  # give up on a request the service has not answered
+
+api_client() {
+  # Rate-limited keep-alive GETs (scripts/agents/api_client.py); warnings go to the worker log
+  API_TOKEN="$API_TOKEN" python3 "$API_CLIENT" --rate-per-hour "$API_RATE_PER_HOUR" --burst "$API_RATE_BURST" \
+    --retry-delay "$RATE_LIMIT_DELAY" --log "$LOG_FILE" "$@"
+}
+
+# One resident api_client per worker: every request of every user goes through
+# the same keep-alive pool instead of a new interpreter and TLS handshake.
+start_api_service() {
+  stop_api_service
+  coproc APISVC { api_client --retries 2 --timeout 20 serve --concurrency "$API_CONCURRENCY" 2>/dev/null; }
+  # Plain copies of the coproc fds: bash closes those in pipelines and $(...)
+  exec {API_SVC_IN}>&"${APISVC[1]}" {API_SVC_OUT}<&"${APISVC[0]}"
+  API_SERVICE_TOKEN="$API_TOKEN"
+}
+
+stop_api_service() {
+  if [[ -n "${API_SVC_IN:-}" ]]; then
+    exec {API_SVC_IN}>&- {API_SVC_OUT}<&-
+    API_SVC_IN="" API_SVC_OUT=""
+  fi
+  if [[ -n "${APISVC_PID:-}" ]]; then
+    kill "$APISVC_PID" 2>/dev/null || true
+    wait "$APISVC_PID" 2>/dev/null || true
+  fi
+  API_SERVICE_TOKEN=""
+}
+
+ensure_api_service() {
+  # (Re)start after a token refresh or if the service died
+  if [[ "${API_SERVICE_TOKEN:-}" != "$API_TOKEN" || -z "${APISVC_PID:-}" ]] || ! kill -0 "$APISVC_PID" 2>/dev/null; then
+    start_api_service
+  fi
+}
 
-rate_limit_pause() {
-  sleep "${RATE_LIMIT_DELAY}"
+api_fetch() {
+  # stdin: "URL<TAB>OUTFILE" lines; stdout: "<code><TAB>URL<TAB>OUTFILE" in input
+  # order (000 when unanswered). Requests are tagged so a late reply to an
+  # abandoned request is never taken for one of these.
+  local label="$1"
+  local -a urls=() files=() ids=()
+  local url outfile n=0 i
+  while IFS=$'\t' read -r url outfile; do
+    [[ -z "$url" ]] && continue
+    urls+=("$url"); files+=("$outfile"); ids+=("${EPOCHREALTIME/./}.$n")
+    n=$((n + 1))
+  done
+  if [[ -z "${API_SVC_IN:-}" || -z "${APISVC_PID:-}" ]] || ! kill -0 "$APISVC_PID" 2>/dev/null; then
+    # Service unavailable: one-shot client for this batch
+    for ((i = 0; i < n; i++)); do printf '%s\t%s\n' "${urls[i]}" "${files[i]}"; done |
+      api_client --label "$label" --retries 2 --timeout 20 fetch --concurrency "$API_CONCURRENCY" 2>/dev/null || true
+    return 0
+  fi
+  for ((i = 0; i < n; i++)); do
+    printf '%s\t%s\t%s\t%s\n' "${ids[i]}" "${urls[i]}" "${files[i]}" "$label"
+  done >&"$API_SVC_IN"
+  local -A codes=()
+  local reply rid rest remaining=$n
+  while (( remaining > 0 )) && IFS= read -r -t "$API_REPLY_TIMEOUT" reply <&"$API_SVC_OUT"; do
+    rid="${reply%%$'\t'*}"
+    rest="${reply#*$'\t'}"
+    for ((i = 0; i < n; i++)); do
+      if [[ "${ids[i]}" == "$rid" && -z "${codes[$rid]:-}" ]]; then
+        codes[$rid]="${rest%%$'\t'*}"
+        remaining=$((remaining - 1))
+      fi
+    done
+  done
+  for ((i = 0; i < n; i++)); do
+    printf '%s\t%s\t%s\n' "${codes[${ids[i]}]:-000}" "${urls[i]}" "${files[i]}"
+  done
 }
 
 pop_next_user_id() {
-  # Consume and remove the first ID from the backlog file under a lock
+  # Consume the first ID from the backlog queue (pending_users.txt is its inbox)
   touch "$BACKLOG_FILE"
-  local id=""
-  # Use fd 9 for locking this function only
-  exec 9<>"$BACKLOG_FILE" || return
-  flock -x 9
-  id=$(head -n1 "$BACKLOG_FILE")
-  if [[ -n "$id" ]]; then
-    tail -n +2 "$BACKLOG_FILE" > "${BACKLOG_FILE}.tmp" && mv "${BACKLOG_FILE}.tmp" "$BACKLOG_FILE"
-  fi
-  flock -u 9
-  exec 9>&-
-  echo "$id"
+  python3 "$QUEUE_STORE" pop --file "$BACKLOG_FILE" 2>/dev/null || true
+}
+
+backlog_size() {
+  python3 "$QUEUE_STORE" len --file "$BACKLOG_FILE" 2>/dev/null || echo 0
 }
 
 BACKLOG_DIR="$ROOT_DIR/.backlog"
@@ -61,6 +134,10 @@ EXPORTS_USERS="$ROOT_DIR/exports/09_users"
 EXPORTS_PROJECT_USERS="$ROOT_DIR/exports/10_projects_users"
 EXPORTS_ACHIEVEMENTS_USERS="$ROOT_DIR/exports/11_achievements_users"
 EXPORTS_COALITIONS_USERS="$ROOT_DIR/exports/12_coalitions_users"
+LOCATION_INDEX="$ROOT_DIR/scripts/agents/location_index.py"
+OBJECT_DIFF="$ROOT_DIR/scripts/agents/object_diff.py"
+QUEUE_STORE="$ROOT_DIR/scripts/agents/queue_store.py"
+API_CLIENT="$ROOT_DIR/scripts/agents/api_client.py"
 DRY_RUN="${DRY_RUN:-0}"
 
 # DB config
@@ -92,7 +169,7 @@ DB_PASSWORD="${DB_PASSWORD:-api42}"
 
 mkdir -p "$BACKLOG_DIR" "$LOG_DIR" "$EXPORTS_USERS" "$EXPORTS_PROJECT_USERS" "$EXPORTS_ACHIEVEMENTS_USERS" "$EXPORTS_COALITIONS_USERS"
 
-trap 'log_msg "Worker stopping"' EXIT
+trap 'stop_api_service; log_msg "Worker stopping"' EXIT
 
 log_msg() {
   echo "[$(date -u +'%Y-%m-%dT%H:%M:%SZ')] $*" >> "$LOG_FILE"
@@ -104,37 +181,22 @@ json_count() {
 
 fetch_user_json() {
   local user_id="$1"
-  local attempts=0
-  local max_attempts=2
-  while (( attempts <= max_attempts )); do
-    rate_limit_pause
-    local response
-    response=$(curl -s --connect-timeout 5 --max-time 15 -w "\n%{http_code}" -H "Authorization: Bearer $API_TOKEN" "$BASE_URL/users/$user_id" 2>/dev/null || true)
-    local status
-    status=$(echo "$response" | tail -n1)
-    local body
-    body=$(echo "$response" | head -n -1)
-    if [[ "$status" == "429" ]]; then
-      log_msg "WARN user $user_id fetch returned HTTP 429 (rate limit), retrying..."
-      attempts=$((attempts + 1))
-      sleep "$RATE_LIMIT_DELAY"
-      continue
-    elif [[ "$status" == "403" ]]; then
-      log_msg "WARN user $user_id fetch returned HTTP 403 (forbidden), backing off"
-      attempts=$((attempts + 1))
-      sleep "$RATE_LIMIT_DELAY"
-      continue
-    elif [[ "$status" != "200" ]]; then
-      log_msg "WARN user $user_id fetch returned HTTP $status"
-    elif echo "$body" | jq empty >/dev/null 2>&1; then
-      echo "$body"
-      return 0
-    else
-      log_msg "WARN user $user_id invalid JSON payload"
-    fi
-    attempts=$((attempts + 1))
-    [[ $attempts -le $max_attempts ]] && sleep "$RATE_LIMIT_DELAY"
-  done
+  # api_client retries 429 (honouring Retry-After) / 403 / 5xx itself and logs each retry
+  local tmp_file
+  tmp_file=$(mktemp)
+  local status
+  status=$(printf '%s\t%s\n' "$BASE_URL/users/$user_id" "$tmp_file" | api_fetch "user $user_id" | cut -f1)
+  local body
+  body=$(cat "$tmp_file" 2>/dev/null)
+  rm -f "$tmp_file"
+  if [[ "$status" != "200" ]]; then
+    log_msg "WARN user $user_id fetch returned HTTP $status"
+  elif echo "$body" | jq empty >/dev/null 2>&1; then
+    echo "$body"
+    return 0
+  else
+    log_msg "WARN user $user_id invalid JSON payload"
+  fi
   echo ""
 }
 
@@ -153,20 +215,10 @@ get_campus_from_json() {
   echo "$cid"
 }
 
-fetch_relation_json() {
-  local url="$1"
-  local label="$2"
-  # Curl with status appended on last line
-  local response
-  rate_limit_pause
-  response=$(curl -s --connect-timeout 5 --max-time 20 -w "\n%{http_code}" -H "Authorization: Bearer $API_TOKEN" "$url" 2>/dev/null || true)
-  local status
-  status=$(echo "$response" | tail -n1)
-  local body
-  body=$(echo "$response" | head -n -1)
-  if [[ "$status" == "429" ]]; then
-    log_msg "WARN $label fetch returned HTTP 429 (rate limit), retrying..."
-  fi
+relation_json_or_empty() {
+  local status="$1"
+  local body="$2"
+  local label="$3"
   if [[ "$status" != "200" ]]; then
     log_msg "WARN $label fetch returned HTTP $status"
     echo "[]"
@@ -181,6 +233,32 @@ fetch_relation_json() {
   echo "$body"
 }
 
+fetch_relations_json() {
+  # Fetch projects/achievements/coalitions of one user concurrently through the
+  # resident api_client; sets projects_json, achievements_json, coalitions_json.
+  local user_id="$1"
+  local tmp_dir
+  tmp_dir=$(mktemp -d)
+  local statuses
+  statuses=$(printf '%s\t%s\n' \
+    "$BASE_URL/users/$user_id/projects_users?per_page=100" "$tmp_dir/projects_users" \
+    "$BASE_URL/achievements_users?filter%5Buser_id%5D=$user_id&per_page=100" "$tmp_dir/achievements_users" \
+    "$BASE_URL/users/$user_id/coalitions_users?per_page=100" "$tmp_dir/coalitions_users" |
+    api_fetch "user $user_id")
+  local label status body
+  for label in projects_users achievements_users coalitions_users; do
+    status=$(echo "$statuses" | awk -F'\t' -v f="$tmp_dir/$label" '$3 == f { print $1 }')
+    body=""
+    [[ -f "$tmp_dir/$label" ]] && body=$(cat "$tmp_dir/$label")
+    case "$label" in
+      projects_users) projects_json=$(relation_json_or_empty "${status:-000}" "$body" "$label") ;;
+      achievements_users) achievements_json=$(relation_json_or_empty "${status:-000}" "$body" "$label") ;;
+      coalitions_users) coalitions_json=$(relation_json_or_empty "${status:-000}" "$body" "$label") ;;
+    esac
+  done
+  rm -rf "$tmp_dir"
+}
+
 upsert_user() {
   local user_json="$1"
   local user_id="$2"
@@ -513,11 +591,10 @@ EOSQL
 
 diff_user_changes() {
   local user_id="$1"
-  local campus_id="$2"
-  local new_json="$3"
-  local old_path="$EXPORTS_USERS/campus_${campus_id}/user_${user_id}.json"
+  local new_json="$2"
+  local old_json="$3"
 
-  if [[ ! -f "$old_path" ]]; then
+  if [[ -z "$old_json" ]]; then
     log_msg "DIFF user ${user_id}: new (no previous snapshot)"
     return
   fi
@@ -527,19 +604,11 @@ diff_user_changes() {
     return
   fi
 
-  local diff_keys
-  diff_keys=$(jq -r --slurp '
-    def scrub(u): u | del(.updated_at, .alumnized_at, .created_at, .anonymize_date, .data_erasure_date);
-    (.[0] // {}) as $old | (.[1] // {}) as $new
-    | ($old + $new) | keys[]
-    | select((($old[.] // null) != ($new[.] // null)))
-  ' "$old_path" <(printf '%s' "$new_json") | sort -u | paste -sd, -)
-
-  if [[ -n "$diff_keys" ]]; then
-    log_msg "DIFF user ${user_id}: changed fields=${diff_keys}"
-  else
-    log_msg "DIFF user ${user_id}: no changes"
-  fi
+  # Structural diff of the previous export against the new one: arrays matched
+  # by element id, so the summary names e.g. projects_users[3].status.
+  local summary
+  summary=$(python3 "$OBJECT_DIFF" diff --summary <(printf '%s' "$old_json") <(printf '%s' "$new_json") 2>/dev/null || true)
+  log_msg "DIFF user ${user_id}: ${summary:-skipped (diff failed)}"
 }
 
 get_db_user_fields() {
@@ -875,7 +944,8 @@ while true; do
     continue
   fi
 
-  if [ ! -s "$BACKLOG_FILE" ]; then
+  queue_size=$(backlog_size)
+  if [[ "$queue_size" -eq 0 ]]; then
     sleep 10
     continue
   fi
@@ -895,7 +965,8 @@ while true; do
     continue
   fi
 
-  queue_size=$(wc -l < "$BACKLOG_FILE" || echo 0)
+  ensure_api_service
+
   log_msg "Processing queue (current size: $queue_size)"
 
   COUNTER=0
@@ -985,7 +1056,7 @@ while true; do
     # Log comprehensive status with old snapshot for comparison
     log_comprehensive_status "$USER_ID" "$campus_from_user" "$user_json" "$old_snapshot_json"
 
-    diff_user_changes "$USER_ID" "$campus_from_user" "$user_json"
+    diff_user_changes "$USER_ID" "$user_json" "$old_snapshot_json"
     
     # Call log_db_delta if snapshot differs to detect location/wallet/cp changes
     if [[ "$has_prior_snapshot" == "true" && "$user_json" != "$old_snapshot_json" ]]; then
@@ -996,9 +1067,7 @@ while true; do
     # All users: basic user data only. Detailed relationships: CAMPUS_ID=12 only.
     if [[ "$campus_from_user" == "12" ]]; then
       log_msg "*** CAMPUS 12 DETECTED: Fetching detailed relations ***"
-      projects_json=$(fetch_relation_json "$BASE_URL/users/$USER_ID/projects_users?per_page=100" "projects_users")
-      achievements_json=$(fetch_relation_json "$BASE_URL/achievements_users?filter%5Buser_id%5D=$USER_ID&per_page=100" "achievements_users")
-      coalitions_json=$(fetch_relation_json "$BASE_URL/users/$USER_ID/coalitions_users?per_page=100" "coalitions_users")
+      fetch_relations_json "$USER_ID"
 
       count_proj=$(json_count "$projects_json")
       count_ach=$(json_count "$achievements_json")
@@ -1024,12 +1093,11 @@ while true; do
 
     # Persist raw JSON for traceability (basic user always)
     echo "$user_json" > "$EXPORTS_USERS/$campus_dir_suffix/user_${USER_ID}.json"
+    python3 "$LOCATION_INDEX" record --base "$EXPORTS_USERS" "$USER_ID" "${campus_dir_suffix#campus_}" 2>/dev/null || true
 
     # Visual separator for log readability
     log_msg "---"
-
-    # Rate limiting: pause between each user iteration
-    sleep "$RATE_LIMIT_DELAY"
+    # No pause here: every request waits on the shared token bucket
   done
 
   sleep 5
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Single-file baseline store for eventifier/detector snapshots.
+
+Replaces logs/.eventifier_baseline/user_<id>.json (one indented JSON file per
+user) with one SQLite WAL database holding the six SNAPSHOT_FIELDS per uid.
+Reads and writes are batched: get_many() fetches a whole cycle's baselines in a
+few IN (...) queries and put_many() commits a batch atomically, so a crashed
+cycle leaves either all or none of its baselines behind.
+
+The legacy directory (flat user_<id>.json or campus_<id>/user_<id>.json) is
+imported once per directory by ensure_migrated(); the files are left untouched.
+
+CLI:
+  baseline_store.py migrate [--db PATH] [--dir DIR ...]
+  baseline_store.py get [--db PATH] UID [UID...]
+  baseline_store.py stats [--db PATH]
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from detector_core import SNAPSHOT_FIELDS
+from sqlite_store import chunked, connect, placeholders, transaction
+
+ROOT = os.environ.get("ROOT_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+
+def default_db_path(root: str) -> str:
+    return os.environ.get("BASELINE_DB") or os.path.join(root, "logs", ".eventifier_baseline.db")
+
+
+LEGACY_DIR = os.path.join(ROOT, "logs", ".eventifier_baseline")
+DEFAULT_DB = default_db_path(ROOT)
+
+MIGRATE_BATCH = 5000
+
+# Columns are declared without a type so ints stay ints and floats stay floats,
+# exactly as the JSON baselines stored them.
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS baselines (
+    uid INTEGER PRIMARY KEY,
+    {", ".join(SNAPSHOT_FIELDS)},
+    stored_at REAL
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+_COLUMNS = ", ".join(SNAPSHOT_FIELDS)
+_UPSERT = (
+    f"INSERT OR REPLACE INTO baselines (uid, {_COLUMNS}, stored_at) "
+    f"VALUES ({placeholders(len(SNAPSHOT_FIELDS) + 2)})"
+)
+
+
+def _row_to_snapshot(row: Tuple) -> Dict[str, Any]:
+    return dict(zip(SNAPSHOT_FIELDS, row))
+
+
+class BaselineStore:
+    def __init__(self, path: str = DEFAULT_DB):
+        self.path = path
+        self.conn = connect(path)
+        self.conn.executescript(_SCHEMA)
+
+    def __enter__(self) -> "BaselineStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM baselines").fetchone()[0]
+
+    # -- reads -------------------------------------------------------------
+    def get(self, uid) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute(
+            f"SELECT {_COLUMNS} FROM baselines WHERE uid = ?", (int(uid),)
+        ).fetchone()
+        return _row_to_snapshot(row) if row else None
+
+    def get_many(self, uids: Iterable) -> Dict[str, Dict[str, Any]]:
+        """Return {str(uid): snapshot} for every uid that has a baseline."""
+        wanted = sorted({int(u) for u in uids})
+        out: Dict[str, Dict[str, Any]] = {}
+        for chunk in chunked(wanted):
+            cur = self.conn.execute(
+                f"SELECT uid, {_COLUMNS} FROM baselines WHERE uid IN ({placeholders(len(chunk))})",
+                chunk,
+            )
+            for row in cur:
+                out[str(row[0])] = _row_to_snapshot(row[1:])
+        return out
+
+    # -- writes ------------------------------------------------------------
+    def put_many(self, items: Iterable[Tuple[Any, Dict[str, Any]]]) -> int:
+        """Upsert (uid, snapshot) pairs in one atomic transaction."""
+        now = time.time()
+        rows = [
+            (int(uid), *(snap.get(field) for field in SNAPSHOT_FIELDS), now)
+            for uid, snap in items
+        ]
+        if not rows:
+            return 0
+        with transaction(self.conn) as conn:
+            conn.executemany(_UPSERT, rows)
+        return len(rows)
+
+    def put(self, uid, snapshot: Dict[str, Any]) -> None:
+        self.put_many([(uid, snapshot)])
+
+    # -- migration ---------------------------------------------------------
+    def ensure_migrated(self, legacy_dir: str = LEGACY_DIR) -> int:
+        """Import legacy per-user JSON baselines from legacy_dir exactly once."""
+        key = f"migrated:{os.path.abspath(legacy_dir)}"
+        if self.conn.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone():
+            return 0
+        imported = self.migrate_from_dir(legacy_dir) if os.path.isdir(legacy_dir) else 0
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            (key, json.dumps({"imported": imported, "at": time.time()})),
+        )
+        return imported
+
+    def migrate_from_dir(self, legacy_dir: str) -> int:
+        """Copy user_<id>.json baselines (flat or campus_<id>/ layout); existing rows win."""
+        batch: List[Tuple] = []
+        imported = 0
+        now = time.time()
+
+        def flush() -> None:
+            with transaction(self.conn) as conn:
+                conn.executemany(
+                    f"INSERT OR IGNORE INTO baselines (uid, {_COLUMNS}, stored_at) "
+                    f"VALUES ({placeholders(len(SNAPSHOT_FIELDS) + 2)})",
+                    batch,
+                )
+            batch.clear()
+
+        for path in _legacy_files(legacy_dir):
+            uid = os.path.basename(path)[5:-5]
+            try:
+                with open(path, "r") as f:
+                    snap = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                continue
+            if not isinstance(snap, dict):
+                continue
+            batch.append((int(uid), *(snap.get(field) for field in SNAPSHOT_FIELDS), now))
+            imported += 1
+            if len(batch) >= MIGRATE_BATCH:
+                flush()
+        if batch:
+            flush()
+        return imported
+
+
+def _legacy_files(legacy_dir: str) -> Iterable[str]:
+    with os.scandir(legacy_dir) as it:
+        entries = list(it)
+    for dent in entries:
+        name = dent.name
+        if dent.is_dir() and name.startswith("campus_"):
+            with os.scandir(dent.path) as sub:
+                for child in sub:
+                    if child.name.startswith("user_") and child.name.endswith(".json") and child.name[5:-5].isdigit():
+                        yield child.path
+        elif name.startswith("user_") and name.endswith(".json") and name[5:-5].isdigit():
+            yield dent.path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="SQLite baseline store (replaces per-user baseline JSON files).")
+    parser.add_argument("--db", default=DEFAULT_DB, help=f"Database path (default: {DEFAULT_DB})")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_mig = sub.add_parser("migrate", help="One-shot import of legacy baseline directories")
+    p_mig.add_argument("--dir", action="append", default=None, help=f"Legacy directory (default: {LEGACY_DIR})")
+    p_get = sub.add_parser("get")
+    p_get.add_argument("uids", nargs="+")
+    sub.add_parser("stats")
+    args = parser.parse_args()
+
+    with BaselineStore(args.db) as store:
+        if args.cmd == "migrate":
+            for legacy_dir in args.dir or [LEGACY_DIR]:
+                count = store.ensure_migrated(legacy_dir)
+                print(f"baseline_store: imported {count} baselines from {legacy_dir}")
+        elif args.cmd == "get":
+            print(json.dumps(store.get_many(args.uids), indent=2))
+        else:
+            print(json.dumps({"db": args.db, "baselines": len(store)}))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,9 +8,8 @@
 #   - Latest snapshot: .cache/raw_detect/users_latest.json (from detector)
 #   - Baseline: exports/09_users/campus_<id>/user_<id>.json (last fetched)
 # Outputs:
-#   - Rewrites queues in-place:
-#       .backlog/fetch_queue_internal.txt
-#       .backlog/fetch_queue_external.txt
+#   - Reorders/trims the fetch queues in .backlog/queues.db (queue_store.py;
+#     fetch_queue_internal.txt / fetch_queue_external.txt are their inboxes)
 #   - Appends dropped externals (location-only) to:
 #       .backlog/fetch_queue_external_dropped.txt
 
@@ -22,8 +21,6 @@ LOG_DIR="$ROOT_DIR/logs"
 LATEST_JSON="$ROOT_DIR/.cache/raw_detect/users_latest.json"
 INTERNAL_QUEUE="$BACKLOG_DIR/fetch_queue_internal.txt"
 EXTERNAL_QUEUE="$BACKLOG_DIR/fetch_queue_external.txt"
-INTERNAL_LOCK="${INTERNAL_QUEUE}.lock"
-EXTERNAL_LOCK="${EXTERNAL_QUEUE}.lock"
 DROPPED_FILE="$BACKLOG_DIR/fetch_queue_external_dropped.txt"
 EXPORT_BASE="$ROOT_DIR/exports/09_users"
 INTERNAL_CAMPUS_ID="${CAMPUS_ID:-21}"
@@ -59,15 +56,13 @@ if [[ ! -f "$LATEST_JSON" ]]; then
   exit 0
 fi
 
-exec 3>"$INTERNAL_LOCK"
-exec 4>"$EXTERNAL_LOCK"
-flock -x 3
-flock -x 4
-
-BACKLOG_NINT_THRESHOLD="$BACKLOG_NINT_THRESHOLD" BACKLOG_NEXT_THRESHOLD="$BACKLOG_NEXT_THRESHOLD" python3 - "$LATEST_JSON" "$EXPORT_BASE" "$INTERNAL_QUEUE" "$EXTERNAL_QUEUE" "$DROPPED_FILE" "$LOG_DIR/switcher.log" "$INTERNAL_CAMPUS_ID" <<'PY'
+AGENTS_DIR="$ROOT_DIR/scripts/agents" BACKLOG_NINT_THRESHOLD="$BACKLOG_NINT_THRESHOLD" BACKLOG_NEXT_THRESHOLD="$BACKLOG_NEXT_THRESHOLD" python3 - "$LATEST_JSON" "$EXPORT_BASE" "$INTERNAL_QUEUE" "$EXTERNAL_QUEUE" "$DROPPED_FILE" "$LOG_DIR/switcher.log" "$INTERNAL_CAMPUS_ID" <<'PY'
 import json, os, sys, time
 
 latest_json, export_base, internal_q, external_q, dropped_file, log_file, internal_campus = sys.argv[1:]
+sys.path.insert(0, os.environ["AGENTS_DIR"])
+from json_stream import iter_users, projection_fields
+from queue_store import QueueStore, default_db_path
 internal_campus = int(internal_campus)
 def env_int(name, default):
     try:
@@ -84,21 +79,14 @@ def log(msg):
         f.write(f"[{ts}] {msg}\n")
 
 def load_latest(path):
+    # Streamed and projected: only the compared scalars + campus hints are kept per user.
+    fields = projection_fields(["first_name", "last_name", "correction_point", "wallet", "location"])
     try:
-        with open(path) as f:
-            users = json.load(f)
-        return {str(u.get("id")): u for u in users if isinstance(u, dict) and u.get("id") is not None}
+        return {str(u.get("id")): u for u in iter_users(path, fields) if isinstance(u, dict) and u.get("id") is not None}
     except Exception as e:
         log(f"classify_fetch_queue: failed to load latest snapshot: {e}")
         return {}
 
-def read_queue(path):
-    try:
-        with open(path) as f:
-            return [line.strip() for line in f if line.strip().isdigit()]
-    except FileNotFoundError:
-        return []
-
 def get_campus(user):
     cu = user.get("campus_users") or []
     if cu:
@@ -132,8 +120,11 @@ def to_number(x):
         return None
 
 latest = load_latest(latest_json)
-internal_ids = read_queue(internal_q)
-external_ids = read_queue(external_q)
+queue_store = QueueStore(default_db_path(internal_q))
+internal_queue = queue_store.queue(internal_q)
+external_queue = queue_store.queue(external_q)
+internal_ids = list(internal_queue.uids())
+external_ids = list(external_queue.uids())
 
 internal_reached = len(internal_ids) >= backlog_nint_threshold
 drop_enabled = len(external_ids) >= backlog_next_threshold
@@ -158,45 +149,26 @@ def is_location_only(uid):
     loc_only = location_changed and not (wallet_changed or (cp_delta not in (None, 0)) or name_changed)
     return bool(loc_only), campus_id
 
-# Internal queue: stable partition (only when Nint reached).
+# Internal queue: stable partition (only when Nint reached) by moving the
+# location-only uids to the tail in their current order.
 if internal_reached:
-    internal_keep = []
-    internal_loc = []
-    seen = set()
-    for uid in internal_ids:
-        if uid in seen:
-            continue
-        seen.add(uid)
-        loc_only, _ = is_location_only(uid)
-        (internal_loc if loc_only else internal_keep).append(uid)
-    internal_ordered = internal_keep + internal_loc
-else:
-    internal_ordered = list(dict.fromkeys(internal_ids))
+    internal_queue.move_to_bottom(uid for uid in internal_ids if is_location_only(uid)[0])
 
 # External queue: keep order; drop location-only externals only when Next reached.
-external_ordered = []
+external_queue.remove_present_in(internal_queue)
+internal_set = set(internal_ids)
 dropped_ext = []
-seen_ext = set()
-internal_final = set(internal_ordered)
-for uid in external_ids:
-    if uid in internal_final:
-        continue
-    if uid in seen_ext:
-        continue
-    seen_ext.add(uid)
-    loc_only, campus_id = is_location_only(uid)
-    if drop_enabled and campus_id is not None and int(campus_id) != internal_campus and loc_only:
-        dropped_ext.append(uid)
-        continue
-    external_ordered.append(uid)
-
-with open(internal_q, "w") as f:
-    for uid in internal_ordered:
-        f.write(f"{uid}\n")
-
-with open(external_q, "w") as f:
-    for uid in external_ordered:
-        f.write(f"{uid}\n")
+if drop_enabled:
+    for uid in external_ids:
+        if uid in internal_set:
+            continue
+        loc_only, campus_id = is_location_only(uid)
+        if campus_id is not None and int(campus_id) != internal_campus and loc_only:
+            dropped_ext.append(uid)
+    dropped_ext = external_queue.remove(dropped_ext)
+internal_out = len(internal_queue)
+external_out = len(external_queue)
+queue_store.close()
 
 if dropped_ext:
     with open(dropped_file, "a") as f:
@@ -204,13 +176,8 @@ if dropped_ext:
             f.write(f"{uid}\n")
 
 log(
-    f"classify_fetch_queue: int_in={len(internal_ids)} int_out={len(internal_ordered)} "
-    f"ext_in={len(external_ids)} ext_out={len(external_ordered)} ext_dropped_location_only={len(dropped_ext)} "
+    f"classify_fetch_queue: int_in={len(internal_ids)} int_out={internal_out} "
+    f"ext_in={len(external_ids)} ext_out={external_out} ext_dropped_location_only={len(dropped_ext)} "
     f"nint={backlog_nint_threshold} next={backlog_next_threshold} drop_enabled={int(drop_enabled)}"
 )
 PY
-
-flock -u 4
-flock -u 3
-exec 4>&-
-exec 3>&-
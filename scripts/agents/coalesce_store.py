@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Per-user coalescing buffer between fingerprint detection and the fetch queues.
+
+With DETECTOR_COALESCE_SECONDS > 0 a detected change is not turned into
+events and a fetch right away. The user is held for that many seconds from
+their first change: further changes in the window only move the held "latest"
+state forward, while the baseline stays the state from before the first one.
+When the window expires the detector diffs baseline against latest once, so
+
+- a connect/disconnect flap or a location round trip nets to nothing
+  (latest hash == baseline hash): no event, no fetch
+- repeated wallet / correction point moves become one event with the total
+- whatever else changed is one event per type and at most one fetch
+
+Hash entries are still updated every cycle, so detection itself is unchanged;
+only what reaches events_queue.jsonl and the fetch queues is coalesced.
+
+Held users live in memory and in .backlog/detector_coalesce.db; commit()
+writes them with the detector's hash commit, so a restart resumes the open
+windows instead of losing their baselines.
+
+CLI:
+  coalesce_store.py list  [--db PATH]
+  coalesce_store.py stats [--db PATH]
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlite_store import chunked, connect, placeholders, transaction
+
+ROOT = os.environ.get("ROOT_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+
+def default_db_path(root: str) -> str:
+    return os.environ.get("COALESCE_DB") or os.path.join(root, ".backlog", "detector_coalesce.db")
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS held (
+    uid INTEGER PRIMARY KEY,
+    deadline REAL,
+    seq INTEGER,
+    state TEXT
+);
+"""
+
+
+class CoalesceStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = connect(path)
+        self.conn.executescript(_SCHEMA)
+        self._held: Dict[int, Dict[str, Any]] = {}
+        self._dirty: set = set()
+        self._flushed: set = set()
+        for uid, deadline, seq, state in self.conn.execute("SELECT uid, deadline, seq, state FROM held"):
+            entry = json.loads(state)
+            entry["deadline"], entry["seq"] = deadline, seq
+            self._held[uid] = entry
+        self._seq = max((e["seq"] for e in self._held.values()), default=0)
+
+    def __enter__(self) -> "CoalesceStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __len__(self) -> int:
+        return len(self._held)
+
+    def hold(self, outcome: Dict[str, Any], now: float, window: float) -> bool:
+        """Buffer a detect_user() outcome; True when it opened a new window for the user."""
+        key = int(outcome["uid"])
+        latest = dict(outcome["entry"]["snapshot"] or {}, updated_at=outcome.get("updated_at"))
+        held = self._held.get(key)
+        opened = held is None
+        if opened:
+            prev = outcome.get("prev") or {}
+            self._seq += 1
+            held = self._held[key] = {
+                "first_seen": now,
+                "deadline": now + window,
+                "seq": self._seq,
+                "base_hash": prev.get("hash"),
+                "base_snapshot": prev.get("snapshot"),
+                "changes": 0,
+                "raw_events": 0,
+                "raw_fetches": 0,
+            }
+        held.update({
+            "campus_id": outcome["campus_id"],
+            "fingerprint_key": outcome["fingerprint_key"],
+            "hash": outcome["entry"]["hash"],
+            "latest": latest,
+        })
+        held["changes"] += 1
+        held["raw_events"] += len(outcome["events"])
+        held["raw_fetches"] += 1 if outcome["priority"] > 0 else 0
+        self._dirty.add(key)
+        self._flushed.discard(key)
+        return opened
+
+    def due(self, now: float) -> List[Tuple[int, Dict[str, Any]]]:
+        """Pop the users whose window has expired, oldest deadline first."""
+        ready = sorted(((e["deadline"], e["seq"], uid) for uid, e in self._held.items() if e["deadline"] <= now))
+        out = []
+        for _, _, uid in ready:
+            out.append((uid, self._held.pop(uid)))
+            self._dirty.discard(uid)
+            self._flushed.add(uid)
+        return out
+
+    @property
+    def dirty(self) -> int:
+        return len(self._dirty) + len(self._flushed)
+
+    def commit(self) -> int:
+        """Write held users and drop flushed ones in one transaction."""
+        if not self._dirty and not self._flushed:
+            return 0
+        rows = []
+        for uid in self._dirty:
+            entry = self._held[uid]
+            state = {k: v for k, v in entry.items() if k not in ("deadline", "seq")}
+            rows.append((uid, entry["deadline"], entry["seq"], json.dumps(state, separators=(",", ":"))))
+        flushed = sorted(self._flushed)
+        with transaction(self.conn) as conn:
+            for chunk in chunked(flushed):
+                conn.execute(f"DELETE FROM held WHERE uid IN ({placeholders(len(chunk))})", chunk)
+            conn.executemany("INSERT OR REPLACE INTO held (uid, deadline, seq, state) VALUES (?, ?, ?, ?)", rows)
+        written = len(rows) + len(flushed)
+        self._dirty.clear()
+        self._flushed.clear()
+        return written
+
+    def get(self, uid) -> Optional[Dict[str, Any]]:
+        return self._held.get(int(uid))
+
+    def items(self):
+        return sorted(self._held.items(), key=lambda item: (item[1]["deadline"], item[1]["seq"]))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Detector coalescing buffer (held users per window).")
+    parser.add_argument("--db", default=default_db_path(ROOT), help="Database path (default: .backlog/detector_coalesce.db)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list", help="Held users, next deadline first")
+    sub.add_parser("stats")
+    args = parser.parse_args()
+
+    with CoalesceStore(args.db) as store:
+        now = time.time()
+        if args.cmd == "list":
+            for uid, entry in store.items():
+                print(json.dumps({
+                    "uid": uid,
+                    "due_in": round(entry["deadline"] - now, 1),
+                    "changes": entry["changes"],
+                    "raw_events": entry["raw_events"],
+                    "raw_fetches": entry["raw_fetches"],
+                    "net_zero": entry["hash"] == entry["base_hash"],
+                }))
+        else:
+            overdue = sum(1 for _, e in store.items() if e["deadline"] <= now)
+            print(json.dumps({"db": args.db, "held": len(store), "overdue": overdue}))
+
+
+if __name__ == "__main__":
+    main()
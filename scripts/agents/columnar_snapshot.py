@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Columnar sidecars for raw_detect snapshots and a vectorized population diff.
+
+A users_*.json snapshot is a JSON array that every consumer walks one dict at
+a time. The sidecar next to it (users_<stamp>.cols/) holds the fields
+build_event_changes() compares as one .npy file per column, sorted by uid,
+so np.load(mmap_mode="r") maps them without parsing anything:
+
+  uid.npy                          int64, sorted, unique (last duplicate wins)
+  wallet.npy / correction_point.npy  float64 (to_number), with *_set.npy bool masks
+  location.npy                     bool, normalize_location() is not None
+  location_value.npy               JSON of the normalized location (unicode)
+  <name>_hash.npy                  uint64 blake2b of the JSON value, for NAME_FIELDS
+  <name>.npy                       JSON of the value (unicode), read back only
+                                   for the rows that changed
+  meta.json                        source size/mtime, to detect a stale sidecar
+
+diff() joins two sidecars on uid (searchsorted over the sorted arrays) and
+computes every event mask for the whole population in a handful of array
+operations. SnapshotDiff.counts() stays in numpy; SnapshotDiff.changes()
+materializes the same {event: [changes]} dicts as build_event_changes() for
+the changed rows only. Users only in the new snapshot (new_seen) are reported
+as SnapshotDiff.added, users gone from it as .removed.
+
+Requires numpy; nothing else in the pipeline imports this module.
+
+CLI:
+  columnar_snapshot.py build SNAPSHOT.json... [--force]
+  columnar_snapshot.py build-all [--dir .cache/raw_detect] [--force]
+  columnar_snapshot.py diff [OLD NEW] [--events]   default: two newest users_*.json
+  columnar_snapshot.py verify [OLD NEW]            compare against build_event_changes()
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Tuple
+
+from detector_core import NAME_FIELDS, build_event_changes, normalize_location, to_number
+from json_stream import iter_users
+
+try:
+    import numpy as np
+except ImportError:  # optional: only this module needs it
+    np = None
+
+ROOT = os.environ.get("ROOT_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+FORMAT_VERSION = 1
+NUMBER_FIELDS = ("correction_point", "wallet")
+SOURCE_FIELDS = ["id", *NAME_FIELDS, *NUMBER_FIELDS, "location"]
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise RuntimeError("numpy is not installed (pip install numpy)")
+
+
+def default_raw_dir(root: str) -> str:
+    return os.environ.get("RAW_DETECT_DIR") or os.path.join(root, ".cache", "raw_detect")
+
+
+def sidecar_path(snapshot: str) -> str:
+    base = snapshot[:-5] if snapshot.endswith(".json") else snapshot
+    return base + ".cols"
+
+
+def snapshot_files(raw_dir: str) -> List[str]:
+    """users_<stamp>.json generations, oldest first (users_latest.json excluded)."""
+    files = glob.glob(os.path.join(raw_dir, "users_*.json"))
+    return sorted(f for f in files if os.path.basename(f) != "users_latest.json")
+
+
+def _encode(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def _hash(encoded: str) -> int:
+    return int.from_bytes(hashlib.blake2b(encoded.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _source_meta(snapshot: str) -> Dict[str, Any]:
+    st = os.stat(snapshot)
+    return {"version": FORMAT_VERSION, "source": os.path.basename(snapshot), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+# -- build --------------------------------------------------------------------
+def build_columns(users: Iterator[Dict[str, Any]]) -> Dict[str, Any]:
+    """Column arrays for a stream of user dicts."""
+    _require_numpy()
+    rows: Dict[int, Dict[str, Any]] = {}
+    for user in users:
+        if isinstance(user, dict) and isinstance(user.get("id"), int):
+            rows[user["id"]] = user
+    uids = sorted(rows)
+    ordered = [rows[uid] for uid in uids]
+    cols: Dict[str, Any] = {"uid": np.array(uids, dtype=np.int64)}
+    for field in NUMBER_FIELDS:
+        values = [to_number(u.get(field)) for u in ordered]
+        cols[f"{field}_set"] = np.array([v is not None for v in values], dtype=bool)
+        cols[field] = np.array([v if v is not None else np.nan for v in values], dtype=np.float64)
+    locations = [normalize_location(u.get("location")) for u in ordered]
+    cols["location"] = np.array([loc is not None for loc in locations], dtype=bool)
+    cols["location_value"] = np.array([_encode(loc) for loc in locations], dtype=np.str_)
+    for field in NAME_FIELDS:
+        encoded = [_encode(u.get(field)) for u in ordered]
+        cols[field] = np.array(encoded, dtype=np.str_)
+        cols[f"{field}_hash"] = np.array([_hash(e) for e in encoded], dtype=np.uint64)
+    return cols
+
+
+def build_sidecar(snapshot: str, force: bool = False) -> str:
+    """Write (or refresh a stale) sidecar for snapshot; returns its directory."""
+    _require_numpy()
+    out = sidecar_path(snapshot)
+    meta = _source_meta(snapshot)
+    if not force:
+        try:
+            with open(os.path.join(out, "meta.json"), "r") as f:
+                current = json.load(f)
+            if all(current.get(k) == v for k, v in meta.items()):
+                return out
+        except (OSError, ValueError):
+            pass
+    cols = build_columns(iter_users(snapshot, SOURCE_FIELDS))
+    tmp = f"{out}.tmp{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, array in cols.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), array)
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(dict(meta, users=int(cols["uid"].size)), f)
+    shutil.rmtree(out, ignore_errors=True)
+    os.replace(tmp, out)
+    return out
+
+
+class ColumnarSnapshot:
+    """Memory-mapped view of one sidecar directory."""
+
+    def __init__(self, path: str, mmap: bool = True):
+        _require_numpy()
+        self.path = path
+        mode = "r" if mmap else None
+        self.cols = {
+            name[:-4]: np.load(os.path.join(path, name), mmap_mode=mode)
+            for name in os.listdir(path)
+            if name.endswith(".npy")
+        }
+
+    @classmethod
+    def open(cls, source: str, build: bool = True) -> "ColumnarSnapshot":
+        """A snapshot .json (its sidecar, built if missing or stale) or a .cols directory."""
+        if os.path.isdir(source):
+            return cls(source)
+        return cls(build_sidecar(source) if build else sidecar_path(source))
+
+    def __getitem__(self, name: str) -> Any:
+        return self.cols[name]
+
+    def __len__(self) -> int:
+        return int(self.cols["uid"].size)
+
+
+# -- diff ---------------------------------------------------------------------
+class SnapshotDiff:
+    """Event masks over the uids present in both snapshots."""
+
+    def __init__(self, old: ColumnarSnapshot, new: ColumnarSnapshot, old_idx: Any, new_idx: Any, added: Any, removed: Any):
+        self.old, self.new = old, new
+        self.old_idx, self.new_idx = old_idx, new_idx
+        self.uid = new["uid"][new_idx]
+        self.added = added
+        self.removed = removed
+        self.masks: Dict[str, Any] = {}
+        self.data_masks = {
+            field: old[f"{field}_hash"][old_idx] != new[f"{field}_hash"][new_idx] for field in NAME_FIELDS
+        }
+        data = np.zeros(self.uid.size, dtype=bool)
+        for mask in self.data_masks.values():
+            data |= mask
+        self.masks["data"] = data
+
+        old_loc, new_loc = old["location"][old_idx], new["location"][new_idx]
+        self.masks["connection"] = ~old_loc & new_loc
+        self.masks["deconnection"] = old_loc & ~new_loc
+
+        old_cp, new_cp = old["correction_point"][old_idx], new["correction_point"][new_idx]
+        cp_set = old["correction_point_set"][old_idx] & new["correction_point_set"][new_idx]
+        with np.errstate(invalid="ignore"):
+            self.masks["evaluation"] = cp_set & (new_cp < old_cp)
+            self.masks["correction"] = cp_set & (new_cp > old_cp)
+
+        old_wallet, new_wallet = old["wallet"][old_idx], new["wallet"][new_idx]
+        wallet_set = old["wallet_set"][old_idx] & new["wallet_set"][new_idx]
+        self.masks["wallet"] = wallet_set & (old_wallet != new_wallet)
+
+    def changed(self) -> Any:
+        """Row positions (into self.uid) with at least one event."""
+        any_mask = np.zeros(self.uid.size, dtype=bool)
+        for mask in self.masks.values():
+            any_mask |= mask
+        return np.flatnonzero(any_mask)
+
+    def counts(self) -> Dict[str, int]:
+        """Users per event type, plus join sizes."""
+        counts = {event: int(np.count_nonzero(mask)) for event, mask in self.masks.items()}
+        counts["changed"] = int(self.changed().size)
+        counts["common"] = int(self.uid.size)
+        counts["added"] = int(self.added.size)
+        counts["removed"] = int(self.removed.size)
+        return counts
+
+    def changes(self) -> Iterator[Tuple[int, Dict[str, List[Dict[str, Any]]]]]:
+        """(uid, build_event_changes()-shaped dict) for every changed user, in uid order."""
+        old, new = self.old, self.new
+        for row in self.changed():
+            o, n = self.old_idx[row], self.new_idx[row]
+            events: Dict[str, List[Dict[str, Any]]] = {}
+            for field in NAME_FIELDS:
+                if self.data_masks[field][row]:
+                    events.setdefault("data", []).append(
+                        {"path": field, "old": json.loads(old[field][o]), "new": json.loads(new[field][n])}
+                    )
+            for event in ("connection", "deconnection"):
+                if self.masks[event][row]:
+                    events[event] = [{
+                        "path": "location",
+                        "old": json.loads(old["location_value"][o]),
+                        "new": json.loads(new["location_value"][n]),
+                    }]
+            for event in ("evaluation", "correction"):
+                if self.masks[event][row]:
+                    events[event] = [{
+                        "path": "correction_point",
+                        "old": float(old["correction_point"][o]),
+                        "new": float(new["correction_point"][n]),
+                    }]
+            if self.masks["wallet"][row]:
+                events["wallet"] = [{"path": "wallet", "old": float(old["wallet"][o]), "new": float(new["wallet"][n])}]
+            yield int(self.uid[row]), events
+
+
+def diff(old: ColumnarSnapshot, new: ColumnarSnapshot) -> SnapshotDiff:
+    """Join new onto old by uid (both sorted) and build the event masks."""
+    _require_numpy()
+    old_uid, new_uid = old["uid"], new["uid"]
+    if old_uid.size:
+        pos = np.searchsorted(old_uid, new_uid)
+        clipped = np.minimum(pos, old_uid.size - 1)
+        found = (pos < old_uid.size) & (old_uid[clipped] == new_uid)
+    else:
+        clipped = np.zeros(new_uid.size, dtype=np.int64)
+        found = np.zeros(new_uid.size, dtype=bool)
+    new_idx = np.flatnonzero(found)
+    old_idx = clipped[new_idx]
+    kept = np.zeros(old_uid.size, dtype=bool)
+    kept[old_idx] = True
+    return SnapshotDiff(old, new, old_idx, new_idx, new_uid[~found], old_uid[~kept])
+
+
+# -- CLI ----------------------------------------------------------------------
+def _pair(args: argparse.Namespace) -> Tuple[str, str]:
+    if args.old and args.new:
+        return args.old, args.new
+    files = snapshot_files(default_raw_dir(ROOT))
+    if len(files) < 2:
+        sys.exit("columnar_snapshot: need OLD and NEW (fewer than two users_*.json in raw_detect)")
+    return files[-2], files[-1]
+
+
+def _load_users(snapshot: str) -> Dict[int, Dict[str, Any]]:
+    return {u["id"]: u for u in iter_users(snapshot, SOURCE_FIELDS) if isinstance(u, dict) and isinstance(u.get("id"), int)}
+
+
+def cmd_diff(args: argparse.Namespace) -> None:
+    old_path, new_path = _pair(args)
+    started = time.perf_counter()
+    old, new = ColumnarSnapshot.open(old_path), ColumnarSnapshot.open(new_path)
+    loaded = time.perf_counter()
+    result = diff(old, new)
+    counts = result.counts()
+    done = time.perf_counter()
+    if args.events:
+        for uid, events in result.changes():
+            print(json.dumps({"user_id": uid, "events": events}))
+        return
+    counts["load_ms"] = round((loaded - started) * 1000, 2)
+    counts["diff_ms"] = round((done - loaded) * 1000, 2)
+    print(json.dumps(counts))
+
+
+def cmd_verify(args: argparse.Namespace) -> None:
+    old_path, new_path = _pair(args)
+    expected: Dict[int, Dict[str, Any]] = {}
+    old_users, new_users = _load_users(old_path), _load_users(new_path)
+    for uid, user in new_users.items():
+        if uid in old_users:
+            events = build_event_changes(old_users[uid], user)
+            if events:
+                expected[uid] = events
+    got = dict(diff(ColumnarSnapshot.open(old_path), ColumnarSnapshot.open(new_path)).changes())
+    # compared as JSON so a NaN wallet change (emitted by both) is equal to itself
+    mismatched = sorted(
+        uid for uid in set(expected) | set(got)
+        if json.dumps(expected.get(uid), sort_keys=True) != json.dumps(got.get(uid), sort_keys=True)
+    )
+    print(json.dumps({"checked": len(new_users), "changed": len(expected), "mismatched": len(mismatched), "sample": mismatched[:10]}))
+    if mismatched:
+        sys.exit(1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Columnar snapshot sidecars and vectorized diff.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_build = sub.add_parser("build", help="Build sidecars for snapshot files")
+    p_build.add_argument("snapshots", nargs="+")
+    p_build.add_argument("--force", action="store_true", help="Rebuild even if up to date")
+    p_all = sub.add_parser("build-all", help="Build missing/stale sidecars for every users_*.json")
+    p_all.add_argument("--dir", default=default_raw_dir(ROOT))
+    p_all.add_argument("--force", action="store_true", help="Rebuild even if up to date")
+    for name, help_text in (("diff", "Diff two snapshots"), ("verify", "Check diff against build_event_changes")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("old", nargs="?")
+        p.add_argument("new", nargs="?")
+        if name == "diff":
+            p.add_argument("--events", action="store_true", help="Print per-user changes as JSONL")
+    args = parser.parse_args()
+
+    try:
+        if args.cmd == "build":
+            for snapshot in args.snapshots:
+                print(build_sidecar(snapshot, args.force))
+        elif args.cmd == "build-all":
+            for snapshot in snapshot_files(args.dir):
+                print(build_sidecar(snapshot, args.force))
+        elif args.cmd == "diff":
+            cmd_diff(args)
+        else:
+            cmd_verify(args)
+    except RuntimeError as exc:
+        sys.exit(f"columnar_snapshot: {exc}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Memory-compact, lossless in-memory form of detector hash state.
+
+A detector_hashes entry as a Python dict (hex HMAC string, float timestamp,
+campus_id, fingerprint_key string, nested snapshot dict) costs well over a
+kilobyte per user, which is what HashStore's lookup cache held once a
+resident detector had seen (or --preload'ed) the population. CompactHashState
+keeps the same information in columns instead:
+
+- int uid -> row number (one dict, no per-row objects)
+- 32-byte binary digests in one bytearray
+- timestamp, wallet, correction_point in array('d'), campus_id in array('q'),
+  fingerprint_key as one byte, a per-row null bitmask for the None values
+- login, first_name, last_name and location as indexes into one interned
+  string pool (locations repeat across users; a rename leaves its old string
+  in the pool)
+
+get() rebuilds the legacy entry dict on demand, key order included, so
+json.dumps() of an entry is byte-identical to what went in. Entries that do
+not fit the columns (bare-hash legacy strings, non-hex hashes, int wallets,
+extra keys, ...) are kept as-is in a side dict, so every entry round-trips.
+Uids looked up and known to be absent are remembered as None, as the plain
+dict cache did.
+
+CLI:
+  compact_state.py verify  [--db PATH | --json PATH]   round-trip every entry
+  compact_state.py measure [--db PATH | --json PATH]   RSS of dict cache vs compact
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from detector_core import SNAPSHOT_FIELDS
+
+ROOT = os.environ.get("ROOT_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+ENTRY_KEYS = ["hash", "timestamp", "campus_id", "fingerprint_key", "snapshot"]
+FINGERPRINT_KEYS = ("internal", "external")
+STRING_FIELDS = ("login", "first_name", "last_name", "location")
+DIGEST_SIZE = 32
+INT64_MIN, INT64_MAX = -(1 << 63), (1 << 63) - 1
+
+# Null bitmask (one byte per row).
+_TS_NULL, _CAMPUS_NULL, _WALLET_NULL, _CP_NULL = 1, 2, 4, 8
+
+
+def _is_float_or_none(value: Any) -> bool:
+    return value is None or type(value) is float
+
+
+def _digest(value: Any) -> Optional[bytes]:
+    """32 raw bytes for a lowercase 64-char hex digest that hexes back identically."""
+    if type(value) is not str or len(value) != DIGEST_SIZE * 2:
+        return None
+    try:
+        raw = bytes.fromhex(value)
+    except ValueError:
+        return None
+    return raw if raw.hex() == value else None
+
+
+class CompactHashState:
+    """uid -> detector hash entry, stored column-wise."""
+
+    __slots__ = ("_rows", "_digests", "_ts", "_campus", "_fp_key", "_nulls", "_wallet", "_cp",
+                 "_strings", "_pool", "_pool_index", "_other")
+
+    def __init__(self, entries: Optional[Iterable[Tuple[Any, Any]]] = None):
+        self._rows: Dict[int, int] = {}
+        self._digests = bytearray()
+        self._ts = array("d")
+        self._campus = array("q")
+        self._fp_key = bytearray()
+        self._nulls = bytearray()
+        self._wallet = array("d")
+        self._cp = array("d")
+        self._strings = array("i")  # len(STRING_FIELDS) per row, -1 = None
+        self._pool: List[str] = []
+        self._pool_index: Dict[str, int] = {}
+        self._other: Dict[int, Any] = {}  # irregular entries and known-absent uids (None)
+        if entries is not None:
+            self.update(entries)
+
+    # -- mapping interface (what HashStore's cache uses) ---------------------
+    def __len__(self) -> int:
+        return len(self._rows) + len(self._other)
+
+    def __contains__(self, uid) -> bool:
+        return uid in self._rows or uid in self._other
+
+    def __iter__(self) -> Iterator[int]:
+        yield from self._rows
+        yield from self._other
+
+    def __getitem__(self, uid) -> Any:
+        row = self._rows.get(uid)
+        if row is not None:
+            return self._entry(row)
+        return self._other[uid]
+
+    def get(self, uid, default: Any = None) -> Any:
+        row = self._rows.get(uid)
+        if row is not None:
+            return self._entry(row)
+        return self._other.get(uid, default)
+
+    def head(self, uid) -> Tuple[Any, Any, Any]:
+        """(hash, campus_id, fingerprint_key) without rebuilding the entry; Nones when unknown."""
+        row = self._rows.get(uid)
+        if row is not None:
+            return (self._digests[row * DIGEST_SIZE:(row + 1) * DIGEST_SIZE].hex(),
+                    None if self._nulls[row] & _CAMPUS_NULL else self._campus[row],
+                    FINGERPRINT_KEYS[self._fp_key[row]])
+        entry = self._other.get(uid)
+        if isinstance(entry, dict):
+            return entry.get("hash"), entry.get("campus_id"), entry.get("fingerprint_key")
+        return entry, None, None
+
+    def __setitem__(self, uid, entry: Any) -> None:
+        key = int(uid)
+        packed = self._pack(entry)
+        if packed is None:
+            # Leaves the row (if any) unused; irregular entries are rare.
+            self._rows.pop(key, None)
+            self._other[key] = entry
+            return
+        self._other.pop(key, None)
+        row = self._rows.get(key)
+        if row is None:
+            row = self._rows[key] = len(self._ts)
+            self._append_row()
+        self._write_row(row, packed)
+
+    def update(self, entries: Any) -> None:
+        items = entries.items() if isinstance(entries, dict) else entries
+        for uid, entry in items:
+            self[uid] = entry
+
+    def keys(self):
+        return set(self._rows) | set(self._other)
+
+    @property
+    def compact_rows(self) -> int:
+        return len(self._rows)
+
+    # -- packing -------------------------------------------------------------
+    def _intern(self, value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        index = self._pool_index.get(value)
+        if index is None:
+            index = self._pool_index[value] = len(self._pool)
+            self._pool.append(value)
+        return index
+
+    def _pack(self, entry: Any) -> Optional[Tuple]:
+        """Column values for a regular entry, None when it has to be kept as-is."""
+        if type(entry) is not dict or list(entry) != ENTRY_KEYS:
+            return None
+        digest = _digest(entry["hash"])
+        fp_key = entry["fingerprint_key"]
+        campus_id = entry["campus_id"]
+        snapshot = entry["snapshot"]
+        if (digest is None or fp_key not in FINGERPRINT_KEYS or not _is_float_or_none(entry["timestamp"])
+                or not (campus_id is None or (type(campus_id) is int and INT64_MIN <= campus_id <= INT64_MAX))
+                or type(snapshot) is not dict or list(snapshot) != SNAPSHOT_FIELDS
+                or not _is_float_or_none(snapshot["wallet"]) or not _is_float_or_none(snapshot["correction_point"])
+                or any(not (snapshot[f] is None or type(snapshot[f]) is str) for f in STRING_FIELDS)):
+            return None
+        nulls = ((_TS_NULL if entry["timestamp"] is None else 0) | (_CAMPUS_NULL if campus_id is None else 0)
+                 | (_WALLET_NULL if snapshot["wallet"] is None else 0)
+                 | (_CP_NULL if snapshot["correction_point"] is None else 0))
+        return (digest, entry["timestamp"], campus_id, FINGERPRINT_KEYS.index(fp_key), nulls,
+                snapshot["wallet"], snapshot["correction_point"], [snapshot[f] for f in STRING_FIELDS])
+
+    def _append_row(self) -> None:
+        self._digests.extend(bytes(DIGEST_SIZE))
+        self._ts.append(0.0)
+        self._campus.append(0)
+        self._fp_key.append(0)
+        self._nulls.append(0)
+        self._wallet.append(0.0)
+        self._cp.append(0.0)
+        self._strings.extend([-1] * len(STRING_FIELDS))
+
+    def _write_row(self, row: int, packed: Tuple) -> None:
+        digest, ts, campus_id, fp_key, nulls, wallet, cp, strings = packed
+        self._digests[row * DIGEST_SIZE:(row + 1) * DIGEST_SIZE] = digest
+        self._ts[row] = 0.0 if ts is None else ts
+        self._campus[row] = 0 if campus_id is None else campus_id
+        self._fp_key[row] = fp_key
+        self._nulls[row] = nulls
+        self._wallet[row] = 0.0 if wallet is None else wallet
+        self._cp[row] = 0.0 if cp is None else cp
+        base = row * len(STRING_FIELDS)
+        for i, value in enumerate(strings):
+            self._strings[base + i] = self._intern(value)
+
+    def _entry(self, row: int) -> Dict[str, Any]:
+        nulls = self._nulls[row]
+        pool = self._pool
+        strings = self._strings
+        base = row * len(STRING_FIELDS)
+        login, first_name, last_name, location = strings[base], strings[base + 1], strings[base + 2], strings[base + 3]
+        return {
+            "hash": self._digests[row * DIGEST_SIZE:(row + 1) * DIGEST_SIZE].hex(),
+            "timestamp": None if nulls & _TS_NULL else self._ts[row],
+            "campus_id": None if nulls & _CAMPUS_NULL else self._campus[row],
+            "fingerprint_key": FINGERPRINT_KEYS[self._fp_key[row]],
+            "snapshot": {
+                "login": None if login < 0 else pool[login],
+                "first_name": None if first_name < 0 else pool[first_name],
+                "last_name": None if last_name < 0 else pool[last_name],
+                "correction_point": None if nulls & _CP_NULL else self._cp[row],
+                "wallet": None if nulls & _WALLET_NULL else self._wallet[row],
+                "location": None if location < 0 else pool[location],
+            },
+        }
+
+
+def rss_kib() -> int:
+    """Current resident set size (KiB; Linux /proc, else peak RSS)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _same(a: Any, b: Any) -> bool:
+    # json.dumps so NaN floats compare equal.
+    return json.dumps(a) == json.dumps(b)
+
+
+def _load_entries(args) -> Iterator[Tuple[int, Any]]:
+    if args.json:
+        with open(args.json) as f:
+            payload = json.load(f)
+        for uid, entry in payload.items():
+            if uid.isdigit():
+                yield int(uid), entry
+        return
+    from hash_store import HashStore
+    with HashStore(args.db) as store:
+        for uid, entry in store.items():
+            yield int(uid), entry
+
+
+def main() -> None:
+    from hash_store import default_db_path
+    parser = argparse.ArgumentParser(description="Compact in-memory detector hash state.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--db", default=default_db_path(ROOT), help="Hash store database (default: .backlog/detector_hashes.db)")
+    source.add_argument("--json", help="detector_hashes.json instead of the database")
+    parser.add_argument("cmd", choices=("verify", "measure"))
+    args = parser.parse_args()
+
+    if args.cmd == "verify":
+        state = CompactHashState()
+        count = mismatches = 0
+        for uid, entry in _load_entries(args):
+            state[uid] = entry
+            count += 1
+            if not _same(state[uid], entry):
+                mismatches += 1
+        print(json.dumps({"entries": count, "compact": state.compact_rows,
+                          "kept_as_is": count - state.compact_rows, "mismatches": mismatches}))
+        sys.exit(1 if mismatches else 0)
+
+    # Each representation is built from the same rows in a fresh child, so the
+    # numbers are not skewed by what the other one left on the heap.
+    results = {}
+    for name in ("dict", "compact"):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            rows = [(uid, json.dumps(entry)) for uid, entry in _load_entries(args)]
+            before = rss_kib()
+            cache: Any = {} if name == "dict" else CompactHashState()
+            for uid, raw in rows:
+                cache[uid] = json.loads(raw)
+            used = rss_kib() - before
+            os.write(write_fd, json.dumps({"entries": len(cache), "rss_kib": used}).encode())
+            os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as r:
+            results[name] = json.loads(r.read())
+        os.waitpid(pid, 0)
+    entries = results["dict"]["entries"] or 1
+    for stats in results.values():
+        stats["bytes_per_entry"] = round(stats["rss_kib"] * 1024 / entries)
+    if results["compact"]["rss_kib"] > 0:
+        results["ratio"] = round(results["dict"]["rss_kib"] / results["compact"]["rss_kib"], 1)
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+"""
+Batched Postgres upserter for process_queue.txt.
+
+upserter.sh popped one uid at a time and ran one psql per user, so connection
+setup dominated and capped DB throughput. This stage drains the queue in
+batches over one long-lived connection (reopened with backoff if it drops):
+
+- pop up to --batch uids (queue_store), read each cached snapshot
+  (exports/09_users via location_index) plus the relation exports written by
+  backlog_worker.sh (exports/10_projects_users, exports/11_achievements_users)
+- COPY the rows into session temp staging tables (ON COMMIT DELETE ROWS,
+  created once per connection)
+- one INSERT ... SELECT ... ON CONFLICT (id) DO UPDATE per table
+  (users, project_users, achievements_users; columns from data/schema.sql)
+- all of it in one transaction per batch. A batch that loses the connection
+  is rolled back and its uids go back on top of the queue, as does one that
+  fails on the schema (missing table, bad SQL) or is interrupted (SIGTERM
+  from restart/stop); one rejected for its data is retried user by user and
+  the offending users are dropped
+
+projects_users rows come from the relation export when present, otherwise
+from the snapshot's own projects_users[]. achievements_users needs the
+relation export (the user payload carries achievements, not their ids).
+After commit each user is announced to the API server (/api/user-updated), as
+upserter.sh did.
+
+Requires psycopg (3); upserter.sh falls back to its psql loop without it.
+Connection settings: DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME.
+
+With --log-file (upserter.sh passes logs/upserter.log, where it sends our
+stdout) the log is trimmed like the psql loop did: every LOG_TRIM_EVERY users
+a log past LOG_MAX_LINES is cut to its last LOG_KEEP_LINES, in place so the
+shell's >> redirect keeps appending to the same file.
+
+CLI:
+  db_upserter.py run  [--batch N] [--idle S] [--once] [--log-file FILE]
+                                                        drain process_queue.txt
+  db_upserter.py load UID [UID...]                      upsert these snapshots now
+  db_upserter.py rows UID [UID...]                      print staged rows (no DB)
+"""
+
+import argparse
+import http.client
+import json
+import os
+import signal
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from location_index import LocationIndex
+from metrics import Metrics
+from queue_store import PRIORITY_TOP, open_queue
+
+try:
+    import psycopg
+except ImportError:  # optional: upserter.sh keeps its psql loop without it
+    psycopg = None
+
+ROOT = os.environ.get("ROOT_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+BATCH_SIZE = 200
+IDLE_SLEEP = 2.0
+RECONNECT_MAX_DELAY = 60.0
+METRICS_FLUSH_SECONDS = 60.0
+LOG_TRIM_EVERY = 50
+LOG_MAX_LINES = 5500
+LOG_KEEP_LINES = 5000
+NOTIFY_HOST = os.environ.get("UPSERT_NOTIFY_HOST", "localhost")
+NOTIFY_PORT = int(os.environ.get("UPSERT_NOTIFY_PORT", "8000"))
+
+USER_COLUMNS = (
+    "id", "email", "login", "first_name", "last_name", "usual_full_name", "usual_first_name", "url", "phone",
+    "displayname", "kind", "image_link", "image_large", "image_medium", "image_small", "image_micro", "image",
+    "staff", "correction_point", "pool_month", "pool_year", "location", "wallet", "anonymize_date",
+    "data_erasure_date", "created_at", "updated_at", "alumnized_at", "alumni", "active", "campus_id",
+)
+PROJECT_USER_COLUMNS = (
+    "id", "project_id", "campus_id", "user_id", "user_login", "user_email", "final_mark", "status", "validated",
+    "created_at", "updated_at",
+)
+ACHIEVEMENT_USER_COLUMNS = (
+    "id", "achievement_id", "campus_id", "user_id", "user_login", "user_email", "created_at", "updated_at",
+)
+
+# table -> (staging table, columns); order is the write order inside a batch
+TABLES: Dict[str, Tuple[str, Sequence[str]]] = {
+    "users": ("users_stage", USER_COLUMNS),
+    "project_users": ("project_users_stage", PROJECT_USER_COLUMNS),
+    "achievements_users": ("achievements_users_stage", ACHIEVEMENT_USER_COLUMNS),
+}
+
+Rows = Dict[str, List[Tuple[Any, ...]]]
+
+
+def staging_ddl(table: str) -> str:
+    stage, _ = TABLES[table]
+    return f"CREATE TEMP TABLE IF NOT EXISTS {stage} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+
+
+def upsert_sql(table: str) -> str:
+    stage, columns = TABLES[table]
+    cols = ", ".join(columns)
+    updates = ",\n  ".join(f"{c} = EXCLUDED.{c}" for c in columns if c != "id")
+    return (
+        f"INSERT INTO {table} ({cols}, ingested_at)\n"
+        f"SELECT {cols}, NOW() FROM {stage}\n"
+        f"ON CONFLICT (id) DO UPDATE SET\n  {updates},\n  ingested_at = NOW()"
+    )
+
+
+def log(msg: str) -> None:
+    print(f"[{time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}] {msg}", flush=True)
+
+
+def trim_log(path: str, max_lines: int = LOG_MAX_LINES, keep_lines: int = LOG_KEEP_LINES) -> bool:
+    """Cut the log to its last keep_lines once it passes max_lines; True if it was trimmed.
+
+    Rewritten in place (same inode): an O_APPEND writer such as our own stdout
+    redirected with >> keeps writing at the new end.
+    """
+    try:
+        with open(path, "r+b") as fh:
+            lines = fh.readlines()
+            if len(lines) <= max_lines:
+                return False
+            fh.seek(0)
+            fh.writelines(lines[-keep_lines:])
+            fh.truncate()
+        return True
+    except OSError:
+        return False
+
+
+# -- snapshot -> rows -------------------------------------------------------
+def _text(value: Any) -> Optional[str]:
+    """Empty strings become NULL (timestamps, optional text)."""
+    if value is None or value == "":
+        return None
+    return str(value)
+
+
+def _flag(obj: Dict[str, Any], key: str) -> Optional[bool]:
+    # The API spells booleans "staff?", "alumni?", "active?", "validated?".
+    value = obj.get(f"{key}?", obj.get(key))
+    return None if value is None else bool(value)
+
+
+def _int(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def campus_of(user: Dict[str, Any]) -> int:
+    campus_users = user.get("campus_users") or []
+    for cu in campus_users:
+        if isinstance(cu, dict) and cu.get("is_primary") and cu.get("campus_id") is not None:
+            return int(cu["campus_id"])
+    for cu in campus_users:
+        if isinstance(cu, dict) and cu.get("campus_id") is not None:
+            return int(cu["campus_id"])
+    campus = user.get("campus") or []
+    if campus and isinstance(campus[0], dict) and campus[0].get("id") is not None:
+        return int(campus[0]["id"])
+    return 0
+
+
+def user_row(user: Dict[str, Any], campus_id: int) -> Tuple[Any, ...]:
+    image = user.get("image") if isinstance(user.get("image"), dict) else {}
+    versions = image.get("versions") or {}
+    return (
+        int(user["id"]), _text(user.get("email")), _text(user.get("login")), _text(user.get("first_name")),
+        _text(user.get("last_name")), _text(user.get("usual_full_name")), _text(user.get("usual_first_name")),
+        _text(user.get("url")), _text(user.get("phone")), _text(user.get("displayname")), _text(user.get("kind")),
+        _text(image.get("link")), _text(versions.get("large")), _text(versions.get("medium")),
+        _text(versions.get("small")), _text(versions.get("micro")), json.dumps(image) if image else None,
+        _flag(user, "staff"), _int(user.get("correction_point")), _text(user.get("pool_month")),
+        _text(user.get("pool_year")), _text(user.get("location")), _int(user.get("wallet")),
+        _text(user.get("anonymize_date")), _text(user.get("data_erasure_date")), _text(user.get("created_at")),
+        _text(user.get("updated_at")), _text(user.get("alumnized_at")), _flag(user, "alumni"),
+        _flag(user, "active"), campus_id,
+    )
+
+
+def project_user_rows(projects: Iterable[Any], user: Dict[str, Any], campus_id: int) -> List[Tuple[Any, ...]]:
+    rows = []
+    for pu in projects:
+        if not isinstance(pu, dict) or _int(pu.get("id")) is None:
+            continue
+        owner = pu.get("user") if isinstance(pu.get("user"), dict) else {}
+        project = pu.get("project") if isinstance(pu.get("project"), dict) else {}
+        rows.append((
+            int(pu["id"]), _int(project.get("id")) or 0, _int(pu.get("campus_id")) or campus_id,
+            _int(owner.get("id")) or int(user["id"]), _text(owner.get("login", user.get("login"))),
+            _text(owner.get("email", user.get("email"))), _int(pu.get("final_mark")), _text(pu.get("status")),
+            _flag(pu, "validated"), _text(pu.get("created_at")), _text(pu.get("updated_at")),
+        ))
+    return rows
+
+
+def achievement_user_rows(items: Iterable[Any], user: Dict[str, Any], campus_id: int) -> List[Tuple[Any, ...]]:
+    rows = []
+    for au in items:
+        if not isinstance(au, dict) or _int(au.get("id")) is None:
+            continue
+        owner = au.get("user") if isinstance(au.get("user"), dict) else {}
+        achievement = au.get("achievement") if isinstance(au.get("achievement"), dict) else {}
+        rows.append((
+            int(au["id"]), _int(achievement.get("id", au.get("achievement_id"))) or 0,
+            _int(au.get("campus_id")) or campus_id, _int(owner.get("id")) or int(user["id"]),
+            _text(owner.get("login", user.get("login"))), _text(owner.get("email", user.get("email"))),
+            _text(au.get("created_at")), _text(au.get("updated_at")),
+        ))
+    return rows
+
+
+def _read_json(path: str) -> Any:
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+class SnapshotReader:
+    """Cached snapshot + relation exports -> staged rows."""
+
+    def __init__(self, root: str = ROOT):
+        self.exports = os.path.join(root, "exports")
+        self.users_dir = os.path.join(self.exports, "09_users")
+        self.index = LocationIndex(self.users_dir).refresh()
+
+    def _relation(self, subdir: str, campus_id: int, uid: str) -> Optional[List[Any]]:
+        data = _read_json(os.path.join(self.exports, subdir, f"campus_{campus_id}", f"user_{uid}.json"))
+        return data if isinstance(data, list) else None
+
+    def rows_for(self, uids: Iterable[str]) -> Tuple[Rows, List[Dict[str, Any]], List[str]]:
+        """Rows per table (deduplicated by id, last wins), loaded users, uids without snapshot."""
+        tables: Dict[str, Dict[int, Tuple[Any, ...]]] = {name: {} for name in TABLES}
+        users: List[Dict[str, Any]] = []
+        missing: List[str] = []
+        for uid in uids:
+            path = self.index.path_for(uid)
+            user = _read_json(path) if path else None
+            if not isinstance(user, dict) or user.get("id") is None:
+                missing.append(uid)
+                continue
+            try:
+                campus_id = campus_of(user)
+                row = user_row(user, campus_id)
+                projects = self._relation("10_projects_users", campus_id, uid)
+                project_rows = project_user_rows(projects if projects is not None else user.get("projects_users") or [],
+                                                 user, campus_id)
+                achievement_rows = achievement_user_rows(self._relation("11_achievements_users", campus_id, uid) or [],
+                                                         user, campus_id)
+            except (ValueError, TypeError, KeyError, AttributeError) as exc:
+                # Same fate as a user the DB rejects: logged and dropped, not the whole batch.
+                log(f"⚠️  User {uid}: unusable snapshot ({type(exc).__name__}: {exc}); dropped")
+                continue
+            users.append(user)
+            tables["users"][row[0]] = row
+            for row in project_rows:
+                tables["project_users"][row[0]] = row
+            for row in achievement_rows:
+                tables["achievements_users"][row[0]] = row
+        return {name: list(rows.values()) for name, rows in tables.items()}, users, missing
+
+
+# -- database ---------------------------------------------------------------
+class BatchFailure(RuntimeError):
+    """The batch could not be written for reasons unrelated to its rows; requeue it."""
+
+
+def batch_failures() -> Tuple[type, ...]:
+    """Errors that requeue a whole batch: connection loss, schema / SQL problems."""
+    return (BatchFailure, psycopg.OperationalError, psycopg.ProgrammingError, psycopg.NotSupportedError)
+
+
+def connect_kwargs() -> Dict[str, Any]:
+    return {
+        "host": os.environ.get("DB_HOST", "localhost"),
+        "port": os.environ.get("DB_PORT", "5432"),
+        "user": os.environ.get("DB_USER", "api42"),
+        "password": os.environ.get("DB_PASSWORD", "api42"),
+        "dbname": os.environ.get("DB_NAME", "api42"),
+        "connect_timeout": 5,
+        "options": "-c statement_timeout=60000",
+    }
+
+
+class Upserter:
+    """One reused connection; write_batch() = COPY to staging + upserts in one transaction."""
+
+    def __init__(self, metrics: Metrics):
+        if psycopg is None:
+            raise RuntimeError("psycopg is not installed (pip install 'psycopg[binary]')")
+        self.metrics = metrics
+        self.conn = None
+        self._retry_delay = 1.0
+
+    def connection(self):
+        while self.conn is None or self.conn.closed:
+            try:
+                with self.metrics.timer("connect"):
+                    self.conn = psycopg.connect(**connect_kwargs())
+                    with self.conn.transaction():
+                        for table in TABLES:
+                            self.conn.execute(staging_ddl(table))
+                self._retry_delay = 1.0
+            except psycopg.OperationalError as exc:
+                self.close()
+                log(f"⚠️  DB connect failed ({exc}); retrying in {self._retry_delay:.0f}s")
+                time.sleep(self._retry_delay)
+                self._retry_delay = min(self._retry_delay * 2, RECONNECT_MAX_DELAY)
+            except BaseException as exc:
+                # Never keep a connection without its staging tables (e.g. the
+                # schema is not loaded yet and LIKE users fails).
+                self.close()
+                if isinstance(exc, psycopg.Error):
+                    raise BatchFailure(f"staging setup failed ({type(exc).__name__}: {exc})") from exc
+                raise
+        return self.conn
+
+    def write_batch(self, rows: Rows) -> Dict[str, int]:
+        conn = self.connection()
+        written: Dict[str, int] = {}
+        with conn.transaction():
+            with conn.cursor() as cur:
+                for table, (stage, columns) in TABLES.items():
+                    batch = rows.get(table) or []
+                    if not batch:
+                        continue
+                    with self.metrics.timer(f"copy_{table}"):
+                        with cur.copy(f"COPY {stage} ({', '.join(columns)}) FROM STDIN") as copy:
+                            for row in batch:
+                                copy.write_row(row)
+                    with self.metrics.timer(f"upsert_{table}"):
+                        cur.execute(upsert_sql(table))
+                    written[table] = cur.rowcount
+        return written
+
+    def close(self) -> None:
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+        self.conn = None
+
+
+class Notifier:
+    """Best-effort /api/user-updated posts over one keep-alive connection."""
+
+    def __init__(self, host: str = NOTIFY_HOST, port: int = NOTIFY_PORT):
+        self.host, self.port = host, port
+        self.conn: Optional[http.client.HTTPConnection] = None
+
+    def send(self, user: Dict[str, Any], campus_id: int) -> None:
+        payload = json.dumps({
+            "id": user.get("id"), "login": user.get("login") or "", "campus_id": campus_id,
+            "wallet": user.get("wallet") or 0, "correction_point": user.get("correction_point") or 0,
+            "location": user.get("location") or "", "change_type": "upserted",
+        })
+        for _ in range(2):
+            try:
+                if self.conn is None:
+                    self.conn = http.client.HTTPConnection(self.host, self.port, timeout=2)
+                self.conn.request("POST", "/api/user-updated", payload, {"Content-Type": "application/json"})
+                self.conn.getresponse().read()
+                return
+            except (OSError, http.client.HTTPException):
+                if self.conn is not None:
+                    self.conn.close()
+                self.conn = None
+
+
+def upsert_uids(uids: List[str], reader: SnapshotReader, upserter: Upserter, notifier: Optional[Notifier],
+                metrics: Metrics) -> Tuple[int, List[str]]:
+    """Write one batch; returns (users written, uids without snapshot). Raises on DB errors."""
+    with metrics.timer("load"):
+        rows, users, missing = reader.rows_for(uids)
+    for uid in missing:
+        log(f"⚠️  User {uid}: snapshot not found")
+    if not users:
+        return 0, missing
+    with metrics.timer("batch"):
+        written = upserter.write_batch(rows)
+    metrics.count("users", len(users))
+    metrics.count("project_users", written.get("project_users", 0))
+    metrics.count("achievements_users", written.get("achievements_users", 0))
+    if notifier is not None:
+        with metrics.timer("notify"):
+            for user in users:
+                notifier.send(user, campus_of(user))
+    return len(users), missing
+
+
+def upsert_or_isolate(uids: List[str], reader: SnapshotReader, upserter: Upserter, notifier: Optional[Notifier],
+                      metrics: Metrics) -> int:
+    """upsert_uids(); a batch rejected for its data is retried user by user and bad users dropped."""
+    try:
+        return upsert_uids(uids, reader, upserter, notifier, metrics)[0]
+    except batch_failures():
+        raise
+    except psycopg.Error as exc:
+        if len(uids) == 1:
+            metrics.count("dropped_users")
+            log(f"⚠️  User {uids[0]}: rejected by DB ({type(exc).__name__}: {exc}); dropped")
+            return 0
+        log(f"⚠️  Batch of {len(uids)} rejected ({type(exc).__name__}); retrying users one by one")
+        return sum(upsert_or_isolate([uid], reader, upserter, notifier, metrics) for uid in uids)
+
+
+def run(args: argparse.Namespace) -> None:
+    metrics = Metrics("db_upserter", ROOT)
+    store, queue = open_queue(os.path.join(ROOT, ".backlog", "process_queue.txt"))
+    reader = SnapshotReader(ROOT)
+    upserter = Upserter(metrics)
+    notifier = None if args.no_notify else Notifier()
+    total = 0
+    since_trim = 0
+    last_flush = time.monotonic()
+    # pop() removes a batch before it is written: until it is, the uids are
+    # in flight and go back on top of the queue if anything stops us.
+    inflight: List[str] = []
+    # SIGTERM (restart/stop) behaves like Ctrl-C so the in-flight batch is requeued.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    log(f"Upserter started (batched: up to {args.batch} users per transaction)")
+    try:
+        while True:
+            uids = inflight = queue.pop(args.batch)
+            if uids:
+                started = time.perf_counter()
+                try:
+                    count = upsert_or_isolate(uids, reader, upserter, notifier, metrics)
+                except batch_failures() as exc:
+                    queue.push(uids, PRIORITY_TOP)
+                    inflight = []
+                    metrics.count("failed_batches")
+                    log(f"⚠️  Batch of {len(uids)} failed ({exc}); requeued")
+                    upserter.close()
+                    time.sleep(args.idle)
+                    continue
+                inflight = []
+                total += count
+                since_trim += count
+                log(f"✓ Upserted {count} users in {time.perf_counter() - started:.2f}s (total: {total})")
+                if args.log_file and since_trim >= LOG_TRIM_EVERY:
+                    trim_log(args.log_file)
+                    since_trim = 0
+            elif args.once:
+                break
+            else:
+                time.sleep(args.idle)
+            if time.monotonic() - last_flush >= METRICS_FLUSH_SECONDS:
+                metrics.flush()
+                last_flush = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if inflight:
+            queue.push(inflight, PRIORITY_TOP)
+            log(f"⚠️  Stopping with {len(inflight)} users in flight; requeued")
+        metrics.flush()
+        upserter.close()
+        store.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Batched Postgres upserter for process_queue.txt.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_run = sub.add_parser("run", help="Drain process_queue.txt in batches")
+    p_run.add_argument("--batch", type=int, default=BATCH_SIZE, help=f"Users per transaction (default: {BATCH_SIZE})")
+    p_run.add_argument("--idle", type=float, default=IDLE_SLEEP, help="Sleep when the queue is empty")
+    p_run.add_argument("--once", action="store_true", help="Exit once the queue is empty")
+    p_run.add_argument("--no-notify", action="store_true", help="Do not POST /api/user-updated")
+    p_run.add_argument("--log-file", default=None, help="Log our stdout is appended to; trimmed periodically")
+    p_load = sub.add_parser("load", help="Upsert the given uids' snapshots in one transaction")
+    p_load.add_argument("uids", nargs="+")
+    p_rows = sub.add_parser("rows", help="Print the rows that would be staged (no DB access)")
+    p_rows.add_argument("uids", nargs="+")
+    args = parser.parse_args()
+
+    if args.cmd == "rows":
+        rows, _, missing = SnapshotReader(ROOT).rows_for(args.uids)
+        for table, (_, columns) in TABLES.items():
+            for row in rows[table]:
+                print(json.dumps({"table": table, **dict(zip(columns, row))}))
+        for uid in missing:
+            print(json.dumps({"missing": uid}))
+        return
+    if psycopg is None:
+        sys.exit("db_upserter.py: psycopg is not installed (pip install 'psycopg[binary]')")
+    if args.cmd == "run":
+        run(args)
+        return
+    metrics = Metrics("db_upserter", ROOT)
+    upserter = Upserter(metrics)
+    try:
+        count, missing = upsert_uids(args.uids, SnapshotReader(ROOT), upserter, None, metrics)
+    finally:
+        upserter.close()
+        metrics.flush()
+    print(json.dumps({"users": count, "missing": missing}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Shared detector core: fingerprinting, campus resolution, snapshots and diffs.
+
+Used by detector.sh (PYTHON_DETECTOR), eventifier.sh, detector_feed_events.py
+and events_logs_generator.py so the fingerprint and change rules live in one
+place.
+
+Fingerprints are HMAC-SHA256 over the canonical JSON of the configured fields
+(sorted keys, compact separators, location collapsed to a 0/1 connect flag).
+FingerprintEngine keys one HMAC per fingerprint key up front and .copy()s it per
+user, and serializes the canonical payload with an extractor compiled once per
+field list, so a batch pays neither key setup nor a per-user json.dumps of a
+temporary dict. Output is byte-identical to the historical fingerprint().
+"""
+
+import datetime
+import hashlib
+import hmac
+import json
+import os
+from json.encoder import encode_basestring_ascii
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+SNAPSHOT_FIELDS = ["login", "first_name", "last_name", "correction_point", "wallet", "location"]
+NAME_FIELDS = ("login", "first_name", "last_name")
+EVENT_ORDER = (
+    "data",
+    "connection",
+    "deconnection",
+    "evaluation",
+    "correction",
+    "wallet",
+)
+TRACKED_EVENTS = ["connection", "deconnection", "wallet", "correction", "evaluation", "data", "new_seen"]
+
+DEFAULT_HMAC_KEYS = {
+    "internal": "42network_internal_detection",
+    "external": "42network_external_detection",
+}
+
+
+# -- config -----------------------------------------------------------------
+def load_detector_config(root: str) -> Dict[str, Any]:
+    """Fingerprint fields and HMAC keys from scripts/config/detector_fields.json."""
+    config: Dict[str, Any] = {}
+    try:
+        with open(os.path.join(root, "scripts", "config", "detector_fields.json"), "r") as f:
+            config = json.load(f)
+    except Exception:
+        pass
+    internal_fields = config.get("internals", {}).get("fields", [])
+    external_fields = config.get("externals", {}).get("fields", [])
+    if not external_fields:
+        external_fields = internal_fields
+    hmac_keys = config.get("hmac_keys", {})
+    return {
+        "internal_fields": internal_fields,
+        "external_fields": external_fields,
+        "hmac_key_internal": hmac_keys.get("internal", DEFAULT_HMAC_KEYS["internal"]),
+        "hmac_key_external": hmac_keys.get("external", DEFAULT_HMAC_KEYS["external"]),
+    }
+
+
+# -- scalar helpers ---------------------------------------------------------
+def to_number(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_location(value: Any) -> Any:
+    if value in (None, ""):
+        return None
+    return value
+
+
+def get_campus_id(user: Dict[str, Any]) -> Any:
+    campus_users = user.get("campus_users")
+    if isinstance(campus_users, list) and campus_users:
+        for cu in campus_users:
+            if isinstance(cu, dict) and cu.get("is_primary"):
+                return cu.get("campus_id")
+        first = campus_users[0]
+        if isinstance(first, dict):
+            return first.get("campus_id")
+    campus_list = user.get("campus")
+    if isinstance(campus_list, list) and campus_list:
+        first = campus_list[0]
+        if isinstance(first, dict):
+            return first.get("id")
+    return None
+
+
+def resolve_campus_id(user: Dict[str, Any]) -> Any:
+    """get_campus_id() coerced to int when possible."""
+    raw = get_campus_id(user)
+    try:
+        return int(raw) if raw is not None else None
+    except Exception:
+        return raw
+
+
+def get_updated_timestamp(user: Dict[str, Any]) -> Optional[float]:
+    updated = user.get("updated_at")
+    if not updated:
+        return None
+    try:
+        dt = datetime.datetime.fromisoformat(updated.replace("Z", "+00:00"))
+        return dt.timestamp()
+    except Exception:
+        return None
+
+
+# -- fingerprints -----------------------------------------------------------
+_fallback_encoder = json.JSONEncoder(sort_keys=True, separators=(",", ":"))
+_INF = float("inf")
+
+
+def _encode_value(value: Any) -> str:
+    kind = type(value)
+    if kind is str:
+        return encode_basestring_ascii(value)
+    if value is None:
+        return "null"
+    if kind is int:
+        return int.__repr__(value)
+    if kind is float and value == value and value not in (_INF, -_INF):
+        return float.__repr__(value)
+    return _fallback_encoder.encode(value)
+
+
+def compile_extractor(fields: Sequence[str]) -> Callable[[Dict[str, Any]], bytes]:
+    """Build payload(user) -> canonical JSON bytes for the given field list.
+
+    Equivalent to json.dumps({k: v for present fields}, sort_keys=True,
+    separators=(",", ":")) with location mapped to 0/1, generated as straight
+    line code so the per-user cost is one membership test per field.
+    """
+    lines = ["def payload(user):", "    parts = []"]
+    for name in sorted(dict.fromkeys(fields)):
+        key = encode_basestring_ascii(name) + ":"
+        lines.append(f"    if {name!r} in user:")
+        if name == "location":
+            lines.append(
+                f"        parts.append({key + '0'!r} if user[{name!r}] in (None, '') else {key + '1'!r})"
+            )
+        else:
+            lines.append(f"        parts.append({key!r} + _encode_value(user[{name!r}]))")
+    lines.append("    return ('{' + ','.join(parts) + '}').encode()")
+    namespace: Dict[str, Any] = {"_encode_value": _encode_value}
+    exec("\n".join(lines), namespace)
+    return namespace["payload"]
+
+
+class Fingerprinter:
+    """Pre-keyed HMAC-SHA256 over one field list."""
+
+    __slots__ = ("fields", "payload", "_mac")
+
+    def __init__(self, fields: Sequence[str], hmac_key: str):
+        self.fields = list(fields)
+        self.payload = compile_extractor(self.fields)
+        self._mac = hmac.new(hmac_key.encode(), digestmod=hashlib.sha256)
+
+    def __call__(self, user: Dict[str, Any]) -> str:
+        mac = self._mac.copy()
+        mac.update(self.payload(user))
+        return mac.hexdigest()
+
+    def many(self, users: Iterable[Dict[str, Any]]) -> List[str]:
+        base = self._mac
+        payload = self.payload
+        out = []
+        for user in users:
+            mac = base.copy()
+            mac.update(payload(user))
+            out.append(mac.hexdigest())
+        return out
+
+
+class FingerprintEngine:
+    """Internal/external fingerprinters built once from the detector config."""
+
+    def __init__(self, config: Dict[str, Any]):
+        self.internal = Fingerprinter(config["internal_fields"], config["hmac_key_internal"])
+        self.external = Fingerprinter(config["external_fields"], config["hmac_key_external"])
+
+    @classmethod
+    def from_root(cls, root: str) -> "FingerprintEngine":
+        return cls(load_detector_config(root))
+
+    def for_key(self, fingerprint_key: str) -> Fingerprinter:
+        return self.internal if fingerprint_key == "internal" else self.external
+
+    def fingerprint(self, user: Dict[str, Any], fingerprint_key: str) -> str:
+        return self.for_key(fingerprint_key)(user)
+
+    def batch(self, items: Iterable[Tuple[Dict[str, Any], str]]) -> List[str]:
+        """Fingerprint (user, fingerprint_key) pairs in order."""
+        internal = self.internal
+        external = self.external
+        return [(internal if key == "internal" else external)(user) for user, key in items]
+
+
+_fingerprinters: Dict[Tuple[Tuple[str, ...], str], Fingerprinter] = {}
+
+
+def fingerprint(user: Dict[str, Any], fields: Sequence[str], hmac_key: str) -> str:
+    """Drop-in for the old per-call fingerprint(); reuses a cached Fingerprinter."""
+    cache_key = (tuple(fields), hmac_key)
+    fp = _fingerprinters.get(cache_key)
+    if fp is None:
+        fp = _fingerprinters[cache_key] = Fingerprinter(fields, hmac_key)
+    return fp(user)
+
+
+# -- snapshots and diffs ----------------------------------------------------
+def build_snapshot(user: Dict[str, Any]) -> Dict[str, Any]:
+    """Detector snapshot: numbers coerced to float, empty location -> None."""
+    snap = {}
+    for field in SNAPSHOT_FIELDS:
+        if field == "location":
+            snap[field] = normalize_location(user.get(field))
+        elif field in ("correction_point", "wallet"):
+            snap[field] = to_number(user.get(field))
+        else:
+            snap[field] = user.get(field)
+    return snap
+
+
+def raw_snapshot(user: Dict[str, Any]) -> Dict[str, Any]:
+    """Eventifier snapshot: values kept as exported, empty location -> None."""
+    return {
+        "login": user.get("login"),
+        "first_name": user.get("first_name"),
+        "last_name": user.get("last_name"),
+        "correction_point": user.get("correction_point"),
+        "wallet": user.get("wallet"),
+        "location": normalize_location(user.get("location")),
+    }
+
+
+def build_event_changes(baseline: Any, current: Any) -> Dict[str, List[Dict[str, Any]]]:
+    """Changes between two snapshots grouped by event type."""
+    events: Dict[str, List[Dict[str, Any]]] = {}
+    if not isinstance(baseline, dict) or not isinstance(current, dict):
+        return events
+
+    def add_change(event_type: str, change: Dict[str, Any]) -> None:
+        events.setdefault(event_type, []).append(change)
+
+    for key in NAME_FIELDS:
+        old = baseline.get(key)
+        new = current.get(key)
+        if old != new:
+            add_change("data", {"path": key, "old": old, "new": new})
+
+    old_loc = normalize_location(baseline.get("location"))
+    new_loc = normalize_location(current.get("location"))
+    if old_loc != new_loc:
+        change = {"path": "location", "old": old_loc, "new": new_loc}
+        if old_loc is None and new_loc is not None:
+            add_change("connection", change)
+        elif old_loc is not None and new_loc is None:
+            add_change("deconnection", change)
+
+    old_cp = to_number(baseline.get("correction_point"))
+    new_cp = to_number(current.get("correction_point"))
+    if old_cp is not None and new_cp is not None and old_cp != new_cp:
+        change = {"path": "correction_point", "old": old_cp, "new": new_cp}
+        delta = new_cp - old_cp
+        if delta < 0:
+            add_change("evaluation", change)
+        elif delta > 0:
+            add_change("correction", change)
+
+    old_wallet = to_number(baseline.get("wallet"))
+    new_wallet = to_number(current.get("wallet"))
+    if old_wallet is not None and new_wallet is not None and old_wallet != new_wallet:
+        add_change("wallet", {"path": "wallet", "old": old_wallet, "new": new_wallet})
+
+    return events
+
+
+def build_changes(old_snap: Dict[str, Any], new_snap: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """Flat change list plus event types in EVENT_ORDER (eventifier shape)."""
+    grouped = build_event_changes(old_snap, new_snap)
+    changes: List[Dict[str, Any]] = []
+    types: List[str] = []
+    for event_type in EVENT_ORDER:
+        if event_type in grouped:
+            changes.extend(grouped[event_type])
+            types.append(event_type)
+    return changes, types
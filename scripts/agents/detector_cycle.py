@@ -0,0 +1,722 @@
+#!/usr/bin/env python3
+"""
+One detector cycle over a window of users, shared by detector.sh and the
+resident detector_daemon.py.
+
+A Detector owns everything a cycle needs: detector/fetcher config, the
+fingerprint engine, the hash store (SQLite, with its per-uid entry cache),
+the fetch queues and the metrics recorder. run_cycle(window_path):
+
+- streams the window JSONL one projected user at a time, prefetching hash
+  entries per batch
+- compares fingerprints, builds new_seen / typed change events and the
+  per-bucket counters
+- pushes changed uids to the internal/external fetch queues by priority,
+  drops location-only external uids past BACKLOG_NEXT_THRESHOLD
+- updates the edge-triggered backlog level file, appends the events to
+  events_queue.jsonl under its flock
+- returns the summary dict that detector.sh turns into its log line
+
+With DETECTOR_SHARDS > 1 (agents.config or env) windows of at least
+DETECTOR_SHARD_MIN_BYTES are detected on a fork pool instead: users are
+partitioned by campus (DETECTOR_SHARD_BY=campus, the default) or by uid, each
+worker gets its shard's users with their hash entries, and the outcomes are
+applied in window order, so queues, events_queue.jsonl and hash entries come
+out as in a serial cycle. Window parsing, queue pushes and hash writes stay
+in the parent.
+
+With DETECTOR_COALESCE_SECONDS > 0, changed users are held in a per-user
+window instead (coalesce_store.py): hash entries still move every cycle,
+but events and fetches are emitted once per window from the net diff, so
+flaps and location round trips cost nothing and repeated wallet moves become
+one event. The result then carries a "coalesce" block with the saved counts.
+
+detector.sh builds a Detector, runs one cycle and commits. The daemon keeps
+one alive, so config, hash entries and queue handles stay loaded between
+cycles, and commits on its checkpoint schedule instead (commit=False).
+"""
+
+import heapq
+import json
+import multiprocessing
+import os
+import signal
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from detector_core import (
+    EVENT_ORDER,
+    SNAPSHOT_FIELDS,
+    TRACKED_EVENTS,
+    FingerprintEngine,
+    build_event_changes,
+    build_snapshot,
+    get_updated_timestamp,
+    load_detector_config,
+    normalize_location,
+    resolve_campus_id,
+    to_number,
+)
+from coalesce_store import CoalesceStore
+from coalesce_store import default_db_path as default_coalesce_db
+from hash_store import HashStore
+from json_stream import batched, iter_users, projection_fields
+from metrics import Metrics
+from queue_store import QueueStore, default_db_path
+
+HASH_PREFETCH = 1000
+DEFAULT_INTERNAL_CAMPUS_ID = 21
+DEFAULT_BACKLOG_NINT = 100
+DEFAULT_BACKLOG_NEXT = 500
+# Windows smaller than this stay serial: forking costs more than it saves.
+DEFAULT_SHARD_MIN_BYTES = 4 << 20
+
+
+def load_json(path, default):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except json.JSONDecodeError:
+        return default
+
+
+def write_json(path, payload):
+    with open(path, "w") as f:
+        json.dump(payload, f)
+
+
+def load_fetcher_config(root: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(root, "scripts", "config", "fetcher_fields.json"), "r") as f:
+            fetcher_config = json.load(f)
+    except Exception:
+        return {}
+    return fetcher_config if isinstance(fetcher_config, dict) else {}
+
+
+def _config_value(config_file: str, key: str) -> Optional[str]:
+    """First KEY=value of agents.config (detector.sh's grep | head -1 | cut)."""
+    try:
+        with open(config_file, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith(f"{key}="):
+                    value = line.split("=", 1)[1].split()
+                    return value[0] if value else None
+    except OSError:
+        pass
+    return None
+
+
+def _first_int(*values: Optional[str], default: int) -> int:
+    for value in values:
+        if value not in (None, ""):
+            try:
+                return int(value)
+            except ValueError:
+                return default
+    return default
+
+
+def load_thresholds(root: str, env=os.environ) -> Dict[str, int]:
+    """Backlog thresholds and internal campus with detector.sh's env > agents.config > default order."""
+    config_file = os.path.join(root, "scripts", "config", "agents.config")
+    cfg = {key: _config_value(config_file, key) for key in (
+        "BACKLOG_NINT_THRESHOLD", "BACKLOG_N1_THRESHOLD", "BACKLOG_NEXT_THRESHOLD", "BACKLOG_N2_THRESHOLD")}
+    return {
+        "nint": _first_int(env.get("BACKLOG_NINT_THRESHOLD"), env.get("BACKLOG_N1_THRESHOLD"),
+                           cfg["BACKLOG_NINT_THRESHOLD"], cfg["BACKLOG_N1_THRESHOLD"], default=DEFAULT_BACKLOG_NINT),
+        "next": _first_int(env.get("BACKLOG_NEXT_THRESHOLD"), env.get("BACKLOG_N2_THRESHOLD"),
+                           cfg["BACKLOG_NEXT_THRESHOLD"], cfg["BACKLOG_N2_THRESHOLD"], default=DEFAULT_BACKLOG_NEXT),
+        "internal_campus_id": _first_int(env.get("INTERNAL_CAMPUS_ID"), env.get("CAMPUS_ID"),
+                                         default=DEFAULT_INTERNAL_CAMPUS_ID),
+    }
+
+
+def load_sharding(root: str, env=os.environ) -> Dict[str, Any]:
+    """DETECTOR_SHARDS (0 = all cores, 1 = serial), DETECTOR_SHARD_BY and DETECTOR_SHARD_MIN_BYTES."""
+    config_file = os.path.join(root, "scripts", "config", "agents.config")
+    shards = _first_int(env.get("DETECTOR_SHARDS"), _config_value(config_file, "DETECTOR_SHARDS"), default=1)
+    if shards <= 0:
+        shards = os.cpu_count() or 1
+    by = env.get("DETECTOR_SHARD_BY") or _config_value(config_file, "DETECTOR_SHARD_BY") or "campus"
+    return {
+        "shards": shards,
+        "by": by if by in ("campus", "uid") else "campus",
+        "min_bytes": _first_int(env.get("DETECTOR_SHARD_MIN_BYTES"),
+                                _config_value(config_file, "DETECTOR_SHARD_MIN_BYTES"), default=DEFAULT_SHARD_MIN_BYTES),
+    }
+
+
+def load_coalesce_seconds(root: str, env=os.environ) -> int:
+    """DETECTOR_COALESCE_SECONDS (0 = emit every change as detected)."""
+    config_file = os.path.join(root, "scripts", "config", "agents.config")
+    seconds = _first_int(env.get("DETECTOR_COALESCE_SECONDS"),
+                         _config_value(config_file, "DETECTOR_COALESCE_SECONDS"), default=0)
+    return max(seconds, 0)
+
+
+def window_uid(user: Any) -> Any:
+    """The user's id, or None for entries the cycle counts as errors."""
+    if not isinstance(user, dict) or user.get("label") == "error":
+        return None
+    return user.get("id")
+
+
+class CycleTally:
+    """Per-cycle accumulators, fed with detect_user() outcomes in window order."""
+
+    def __init__(self):
+        self.detect_count = 0
+        self.fp_changes = 0
+        self.changed_internal: List[Dict[str, Any]] = []
+        self.changed_external: List[Dict[str, Any]] = []
+        self.events_payload: List[Any] = []  # event dicts, or JSON lines encoded by a shard worker
+        self.event_counts = {name: {"int": 0, "ext": 0} for name in TRACKED_EVENTS}
+        self.error_counts = {"int": 0, "ext": 0}
+        self.queue_updates_internal: List[Dict[str, Any]] = []
+        self.queue_updates_external: List[Dict[str, Any]] = []
+        self.skip_internal_count = 0
+        self.skip_external_count = 0
+        self.send_internal_uids = set()
+        self.send_external_uids = set()
+        # Coalescing window (only reported when enabled).
+        self.held = 0
+        self.flushed = 0
+        self.saved_events = 0
+        self.saved_fetches = 0
+
+    @staticmethod
+    def bucket_for(fp_key):
+        return "int" if fp_key == "internal" else "ext"
+
+    def bump_error(self, fp_key=None):
+        self.error_counts[self.bucket_for(fp_key)] += 1
+
+    def add(self, outcome: Dict[str, Any], observed: bool = True) -> None:
+        """Count, queue and emit an outcome; observed=False for a coalesced flush (already counted in fp)."""
+        fingerprint_key = outcome["fingerprint_key"]
+        internal = fingerprint_key == "internal"
+        uid_str = outcome["uid_str"]
+        (self.changed_internal if internal else self.changed_external).append({
+            "uid": uid_str,
+            "is_location_only": outcome["is_location_only"],
+            "campus_id": outcome["campus_id"]
+        })
+        bucket = self.bucket_for(fingerprint_key)
+        for ev in outcome["counted"]:
+            if ev in self.event_counts:
+                self.event_counts[ev][bucket] += 1
+        if outcome["error"]:
+            self.bump_error(fingerprint_key)
+        self.events_payload.extend(outcome["events"])
+        priority_value = outcome["priority"]
+        if priority_value <= 0:
+            if internal:
+                self.skip_internal_count += 1
+            else:
+                self.skip_external_count += 1
+        else:
+            (self.send_internal_uids if internal else self.send_external_uids).add(uid_str)
+            (self.queue_updates_internal if internal else self.queue_updates_external).append({
+                "uid": uid_str,
+                "is_location_only": outcome["is_location_only"],
+                "priority": priority_value
+            })
+        if observed:
+            self.fp_changes += 1
+
+
+def partition_shards(items: List[Any], shards: int, by: str, internal_campus_id: int) -> List[List[Any]]:
+    """Split (seq, user, entry) items into at most `shards` lists, each in window order.
+
+    by="campus" groups users by resolved campus (payload, else the hash entry,
+    else the internal campus) and packs the campus groups onto shards largest
+    first; by="uid" spreads by uid. A uid always lands on the shard where it
+    was first seen.
+    """
+    groups: Dict[Any, List[Any]] = {}
+    pinned: Dict[Any, Any] = {}
+    for item in items:
+        _, user, entry = item
+        uid = user.get("id")
+        key = pinned.get(uid)
+        if key is None:
+            if by == "uid":
+                key = hash(uid) % shards
+            else:
+                key = resolve_campus_id(user)
+                if key is None and isinstance(entry, dict):
+                    key = entry.get("campus_id")
+                if key is None:
+                    key = internal_campus_id
+            pinned[uid] = key
+        groups.setdefault(key, []).append(item)
+    loads = [0] * min(shards, len(groups) or 1)
+    assigned: List[List[List[Any]]] = [[] for _ in loads]
+    for group in sorted(groups.values(), key=len, reverse=True):
+        target = loads.index(min(loads))
+        assigned[target].append(group)
+        loads[target] += len(group)
+    return [list(heapq.merge(*parts, key=lambda item: item[0])) for parts in assigned if parts]
+
+
+# Set in the parent right before the fork: workers inherit the loaded config and
+# their shard's items copy-on-write, so only outcomes are pickled (back).
+_SHARD_DETECTOR: Optional["Detector"] = None
+_SHARD_ITEMS: List[List[Any]] = []
+
+
+def _shard_worker_init() -> None:
+    # Workers of a forked daemon must not inherit its flag-only SIGTERM/SIGHUP handlers.
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, signal.SIG_DFL)
+
+
+def _detect_shard(shard: int) -> List[Any]:
+    """Pool worker: (seq, outcome) for the changed users of one shard."""
+    detector = _SHARD_DETECTOR
+    items = _SHARD_ITEMS[shard]
+    updated: Dict[Any, Any] = {}
+    out = []
+    for seq, user, entry in items:
+        uid = user.get("id")
+        outcome = detector.detect_user(user, updated.get(uid, entry))
+        if outcome is not None:
+            updated[uid] = outcome["entry"]
+            # Encoded here: unpickling event dicts in the parent costs more than writing them.
+            outcome["events"] = [json.dumps(event) for event in outcome["events"]]
+            out.append((seq, outcome))
+    return out
+
+
+class Detector:
+    def __init__(self, root: str, paths: Optional[Dict[str, str]] = None, thresholds: Optional[Dict[str, int]] = None):
+        self.root = root
+        backlog = os.path.join(root, ".backlog")
+        self.paths = {
+            "hash_file": os.path.join(backlog, "detector_hashes.json"),
+            "hash_db": os.environ.get("HASH_DB") or os.path.join(backlog, "detector_hashes.db"),
+            "coalesce_db": default_coalesce_db(root),
+            "internal_queue": os.path.join(backlog, "fetch_queue_internal.txt"),
+            "external_queue": os.path.join(backlog, "fetch_queue_external.txt"),
+            "dropped_ext_file": os.path.join(backlog, "fetch_queue_external_dropped.txt"),
+            "level_file": os.path.join(backlog, "detector_backlog_level"),
+            "events_queue": os.path.join(backlog, "events_queue.jsonl"),
+            "events_queue_lock": os.path.join(backlog, "events_queue.lock"),
+        }
+        self.paths.update({k: v for k, v in (paths or {}).items() if v})
+        self._thresholds_override = thresholds
+        # Stage timings land in .backlog/metrics/detector.{json,prom} and logs/metrics.jsonl.
+        self.metrics = Metrics("detector", root)
+        self.fingerprint_timer = self.metrics.timer("fingerprint")
+        self.reload_config()
+        # Point lookups per window batch; only entries touched this cycle are written back.
+        # The cache is column-packed (compact_state.py) so a resident detector can hold the population.
+        self.hash_store = HashStore(self.paths["hash_db"], compact=True)
+        with self.metrics.timer("hash_migrate"):
+            self.hash_store.ensure_migrated(self.paths["hash_file"])
+        self.queue_store = QueueStore(default_db_path(self.paths["internal_queue"]))
+        self.internal_fetch_queue = self.queue_store.queue(self.paths["internal_queue"])
+        self.external_fetch_queue = self.queue_store.queue(self.paths["external_queue"])
+        self.coalesce_store: Optional[CoalesceStore] = None
+        self._cycle_now = time.time()
+
+    def reload_config(self) -> None:
+        """(Re)read detector_fields.json, fetcher_fields.json and the backlog thresholds."""
+        self.detector_config = load_detector_config(self.root)
+        self.fingerprints = FingerprintEngine(self.detector_config)
+        self.fetcher_config = load_fetcher_config(self.root)
+        self.thresholds = self._thresholds_override or load_thresholds(self.root)
+        self.internal_campus_id = self.thresholds["internal_campus_id"]
+        self.sharding = load_sharding(self.root)
+        self.coalesce_seconds = load_coalesce_seconds(self.root)
+        # Stream the window one projected user at a time (memory bounded by one user).
+        self.user_fields = projection_fields(
+            self.detector_config["internal_fields"], self.detector_config["external_fields"], SNAPSHOT_FIELDS)
+
+    def resolve_priority(self, fp_key, event_types):
+        mapping = self.fetcher_config.get(fp_key, {})
+        priority = 0
+        for event_type in event_types:
+            try:
+                value = int(mapping.get(event_type, None))
+            except (TypeError, ValueError):
+                value = None
+            if value is None:
+                value = 2
+            if value > priority:
+                priority = value
+        return max(priority, 0)
+
+    def _with_hash_prefetch(self, users: Iterable[Any]) -> Iterator[Any]:
+        for batch in batched(users, HASH_PREFETCH):
+            with self.metrics.timer("hash_lookup"):
+                self.hash_store.prefetch(u.get("id") for u in batch if isinstance(u, dict) and isinstance(u.get("id"), int))
+            yield from batch
+
+    def detect_user(self, user: Dict[str, Any], last_entry: Any) -> Optional[Dict[str, Any]]:
+        """Outcome for one valid window user against its hash entry; None when the fingerprint is unchanged."""
+        internal_campus_id = self.internal_campus_id
+        uid = user.get("id")
+
+        campus_id = resolve_campus_id(user)
+        if campus_id is None and isinstance(last_entry, dict):
+            campus_id = last_entry.get("campus_id")
+        if campus_id is None:
+            campus_id = internal_campus_id
+
+        new_ts = get_updated_timestamp(user)
+        last_hash_value = None
+        if isinstance(last_entry, dict):
+            last_hash_value = last_entry.get("hash")
+        elif isinstance(last_entry, str):
+            last_hash_value = last_entry
+
+        fingerprint_key = "internal" if campus_id == internal_campus_id else "external"
+        with self.fingerprint_timer:
+            fp = self.fingerprints.fingerprint(user, fingerprint_key)
+
+        if last_hash_value == fp:
+            return None
+
+        baseline = None
+        if isinstance(last_entry, dict):
+            baseline = last_entry.get("snapshot")
+        entry = {
+            "hash": fp,
+            "timestamp": new_ts,
+            "campus_id": campus_id,
+            "fingerprint_key": fingerprint_key,
+            "snapshot": build_snapshot(user)
+        }
+        outcome = self.build_outcome(uid, user, campus_id, fingerprint_key, baseline, entry)
+        # Pre-change state, for the coalescing buffer's net diff.
+        outcome["prev"] = {"hash": last_hash_value, "snapshot": baseline}
+        outcome["updated_at"] = user.get("updated_at")
+        return outcome
+
+    def build_outcome(self, uid: Any, current: Dict[str, Any], campus_id: Any, fingerprint_key: str,
+                      baseline: Optional[Dict[str, Any]], entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Events, fetch priority and hash entry for a change from baseline (None = first sight) to current."""
+        uid_str = str(uid)
+        location_changed = False
+        wallet_changed = False
+        name_changed = False
+        cp_delta = None
+        new_seen_event = False
+        if baseline is not None:
+            location_changed = normalize_location(baseline.get("location")) != normalize_location(current.get("location"))
+            wallet_changed = to_number(baseline.get("wallet")) != to_number(current.get("wallet"))
+            cp_old = to_number(baseline.get("correction_point"))
+            cp_new = to_number(current.get("correction_point"))
+            if cp_old is not None and cp_new is not None:
+                cp_delta = cp_new - cp_old
+            name_changed = any(baseline.get(k) != current.get(k) for k in ("login", "first_name", "last_name"))
+        else:
+            new_seen_event = True
+
+        is_location_only = bool(baseline is not None and location_changed and not (wallet_changed or name_changed or (cp_delta not in (None, 0))))
+
+        new_events = []
+        trigger_types = set()
+        counted = []
+        error = False
+        if new_seen_event:
+            new_events.append({
+                "user_id": int(uid),
+                "user_login": current.get("login"),
+                "campus_id": campus_id,
+                "updated_at": current.get("updated_at"),
+                "first_snapshot": True,
+                "types": ["new_seen"],
+                "changes": [],
+                "source": "detector",
+                "ts": int(time.time())
+            })
+            trigger_types.add("new_seen")
+            counted.append("new_seen")
+        else:
+            type_changes = build_event_changes(baseline, current) if baseline is not None else {}
+            if type_changes:
+                for event_type in EVENT_ORDER:
+                    if event_type in type_changes:
+                        change_list = type_changes[event_type]
+                        new_events.append({
+                            "user_id": int(uid),
+                            "user_login": current.get("login"),
+                            "campus_id": campus_id,
+                            "updated_at": current.get("updated_at"),
+                            "first_snapshot": False,
+                            "types": [event_type],
+                            "changes": change_list,
+                            "source": "detector",
+                            "ts": int(time.time())
+                        })
+                        trigger_types.add(event_type)
+                        counted.append(event_type)
+            if not new_events:
+                new_events.append({
+                    "user_id": int(uid),
+                    "user_login": current.get("login"),
+                    "campus_id": campus_id,
+                    "updated_at": current.get("updated_at"),
+                    "first_snapshot": False,
+                    "types": ["error"],
+                    "changes": [],
+                    "source": "detector",
+                    "ts": int(time.time())
+                })
+                trigger_types.add("error")
+                error = True
+
+        event_type_list = list(trigger_types) or ["error"]
+        return {
+            "uid": uid,
+            "uid_str": uid_str,
+            "campus_id": campus_id,
+            "fingerprint_key": fingerprint_key,
+            "is_location_only": is_location_only,
+            "events": new_events,
+            "counted": counted,
+            "error": error,
+            "priority": self.resolve_priority(fingerprint_key, event_type_list),
+            "entry": entry,
+        }
+
+    def _detect_serial(self, users: Iterable[Any], tally: "CycleTally") -> None:
+        hash_store = self.hash_store
+        for user in self._with_hash_prefetch(users):
+            tally.detect_count += 1
+            uid = window_uid(user)
+            if uid is None:
+                tally.bump_error()
+                continue
+            outcome = self.detect_user(user, hash_store.get(uid))
+            if outcome is not None:
+                self._apply(outcome, tally)
+                hash_store.set(uid, outcome["entry"])
+
+    def _detect_sharded(self, users: Iterable[Any], tally: "CycleTally") -> None:
+        """Partition the window into shards, detect each in a worker, apply outcomes in window order.
+
+        The parent reads every hash entry (its cache holds uncommitted daemon
+        state) and ships each shard its users with their entries; the worker
+        owns that shard's state for the cycle, so a uid seen twice in the
+        window sees its own earlier update. Outcomes come back tagged with the
+        window position and are applied exactly as the serial path would.
+        """
+        hash_store = self.hash_store
+        items: List[Any] = []
+        for user in self._with_hash_prefetch(users):
+            tally.detect_count += 1
+            uid = window_uid(user)
+            if uid is None:
+                tally.bump_error()
+                continue
+            items.append((len(items), user, hash_store.get(uid)))
+        shards = partition_shards(items, self.sharding["shards"], self.sharding["by"], self.internal_campus_id)
+        global _SHARD_DETECTOR, _SHARD_ITEMS
+        _SHARD_DETECTOR, _SHARD_ITEMS = self, shards
+        try:
+            with self.metrics.timer("shard_detect"):
+                with multiprocessing.get_context("fork").Pool(len(shards), initializer=_shard_worker_init) as pool:
+                    results = pool.map(_detect_shard, range(len(shards)), chunksize=1)
+        finally:
+            _SHARD_DETECTOR, _SHARD_ITEMS = None, []
+        for _, outcome in heapq.merge(*results, key=lambda pair: pair[0]):
+            self._apply(outcome, tally)
+            hash_store.set(outcome["uid"], outcome["entry"])
+        self.metrics.count("shards", len(shards))
+
+    def _coalescing(self) -> bool:
+        """Open the buffer when enabled, or when it still holds users from when it was."""
+        if self.coalesce_store is None and (self.coalesce_seconds > 0 or os.path.exists(self.paths["coalesce_db"])):
+            self.coalesce_store = CoalesceStore(self.paths["coalesce_db"])
+        store = self.coalesce_store
+        return store is not None and (self.coalesce_seconds > 0 or len(store) > 0)
+
+    def _apply(self, outcome: Dict[str, Any], tally: "CycleTally") -> None:
+        """Emit an outcome now, or hold it in its user's coalescing window."""
+        store = self.coalesce_store
+        if store is None or not (self.coalesce_seconds > 0 or store.get(outcome["uid"]) is not None):
+            tally.add(outcome)
+            return
+        if store.hold(outcome, self._cycle_now, self.coalesce_seconds):
+            tally.held += 1
+        tally.fp_changes += 1
+
+    def _flush_coalesced(self, tally: "CycleTally") -> None:
+        """Emit the net outcome of every expired window (all of them once coalescing is off)."""
+        now = self._cycle_now if self.coalesce_seconds > 0 else float("inf")
+        for uid, held in self.coalesce_store.due(now):
+            tally.flushed += 1
+            tally.saved_events += held["raw_events"]
+            tally.saved_fetches += held["raw_fetches"]
+            if held["hash"] == held["base_hash"]:
+                continue
+            entry = {"hash": held["hash"], "snapshot": held["latest"]}
+            outcome = self.build_outcome(uid, held["latest"], held["campus_id"], held["fingerprint_key"],
+                                         held["base_snapshot"], entry)
+            tally.add(outcome, observed=False)
+            tally.saved_events -= len(outcome["events"])
+            tally.saved_fetches -= 1 if outcome["priority"] > 0 else 0
+
+    def run_cycle(self, window_path: str, commit: bool = True) -> Dict[str, Any]:
+        metrics = self.metrics
+        tally = CycleTally()
+        dropped_ids: List[str] = []
+        coalescing = self._coalescing()
+        self._cycle_now = time.time()
+
+        metrics.add_bytes("json_load", read=os.path.getsize(window_path))
+        users = metrics.timed_iter("json_load", iter_users(window_path, self.user_fields))
+        shards = self.sharding["shards"]
+        if shards > 1 and os.path.getsize(window_path) >= self.sharding["min_bytes"]:
+            self._detect_sharded(users, tally)
+        else:
+            self._detect_serial(users, tally)
+        if coalescing:
+            with metrics.timer("coalesce_flush"):
+                self._flush_coalesced(tally)
+
+        changed_internal = tally.changed_internal
+        changed_external = tally.changed_external
+        events_payload = tally.events_payload
+        event_counts = tally.event_counts
+        error_counts = tally.error_counts
+        queue_updates_internal = tally.queue_updates_internal
+        queue_updates_external = tally.queue_updates_external
+        detect_count = tally.detect_count
+        fp_changes = tally.fp_changes
+
+        # Priority lanes: >=2 moves to the top, 1 appends, 0 skips (fetcher_fields.json).
+        with metrics.timer("queue_update"):
+            self.internal_fetch_queue.push_many((item["uid"], item["priority"]) for item in queue_updates_internal)
+            self.external_fetch_queue.push_many((item["uid"], item["priority"]) for item in queue_updates_external)
+            self.external_fetch_queue.remove_present_in(self.internal_fetch_queue)
+
+            drop_candidates = {item["uid"] for item in queue_updates_external if item["is_location_only"]}
+            internal_len = len(self.internal_fetch_queue)
+            external_len = len(self.external_fetch_queue)
+            if external_len >= self.thresholds["next"] and drop_candidates:
+                dropped_ids = self.external_fetch_queue.remove(drop_candidates)
+                external_len -= len(dropped_ids)
+
+        if dropped_ids:
+            with open(self.paths["dropped_ext_file"], "a") as f:
+                for uid in dropped_ids:
+                    f.write(f"{uid}\n")
+
+        level_file = self.paths["level_file"]
+        level_state = load_json(level_file, {"int": 0, "ext": 0}) or {"int": 0, "ext": 0}
+        warns = []
+        if internal_len >= self.thresholds["nint"]:
+            if not level_state.get("int"):
+                warns.append("Nint_backlog")
+            level_state["int"] = 1
+        else:
+            level_state["int"] = 0
+
+        if external_len >= self.thresholds["next"]:
+            if not level_state.get("ext"):
+                warns.append("Next_backlog")
+            level_state["ext"] = 1
+        else:
+            level_state["ext"] = 0
+
+        write_json(level_file, level_state)
+
+        if events_payload:
+            with open(self.paths["events_queue_lock"], "w") as lock_file:
+                try:
+                    metrics.flock(lock_file, "events_queue")
+                except Exception:
+                    pass
+                written = 0
+                with metrics.timer("events_append"), open(self.paths["events_queue"], "a") as eq:
+                    for event in events_payload:
+                        line = (event if isinstance(event, str) else json.dumps(event)) + "\n"
+                        eq.write(line)
+                        written += len(line)
+                metrics.add_bytes("events_append", written=written)
+
+        def count_pair(name):
+            data = event_counts.get(name, {"int": 0, "ext": 0})
+            return data.get("int", 0), data.get("ext", 0)
+
+        conn_int, conn_ext = count_pair("connection")
+        disc_int, disc_ext = count_pair("deconnection")
+        wallet_int, wallet_ext = count_pair("wallet")
+        corr_int, corr_ext = count_pair("correction")
+        eval_int, eval_ext = count_pair("evaluation")
+        data_int, data_ext = count_pair("data")
+        new_int, new_ext = count_pair("new_seen")
+
+        result = {
+            "detect": detect_count,
+            "fp": fp_changes,
+            "int": len(changed_internal),
+            "ext": len(changed_external),
+            "skip_internal": tally.skip_internal_count,
+            "skip_external": tally.skip_external_count,
+            "send_internal": len(tally.send_internal_uids),
+            "send_external": len(tally.send_external_uids),
+            "qint": internal_len,
+            "qext": external_len,
+            "drop": len(dropped_ids),
+            "warn": "+".join(warns),
+            "events": len(events_payload),
+            "events_connection_int": conn_int,
+            "events_connection_ext": conn_ext,
+            "events_deconnection_int": disc_int,
+            "events_deconnection_ext": disc_ext,
+            "events_wallet_int": wallet_int,
+            "events_wallet_ext": wallet_ext,
+            "events_correction_int": corr_int,
+            "events_correction_ext": corr_ext,
+            "events_evaluation_int": eval_int,
+            "events_evaluation_ext": eval_ext,
+            "events_data_int": data_int,
+            "events_data_ext": data_ext,
+            "events_new_seen_int": new_int,
+            "events_new_seen_ext": new_ext,
+            "events_error_int": error_counts.get("int", 0),
+            "events_error_ext": error_counts.get("ext", 0)
+        }
+        if coalescing:
+            result["coalesce"] = {
+                "held": tally.held,
+                "flushed": tally.flushed,
+                "pending": len(self.coalesce_store),
+                "saved_events": tally.saved_events,
+                "saved_fetches": tally.saved_fetches,
+            }
+            metrics.count("coalesce_held", tally.held)
+            metrics.count("coalesce_flushed", tally.flushed)
+            metrics.count("coalesce_saved_events", tally.saved_events)
+            metrics.count("coalesce_saved_fetches", tally.saved_fetches)
+
+        metrics.count("users", detect_count)
+        metrics.count("fingerprint_changes", fp_changes)
+        metrics.count("events", len(events_payload))
+        if commit:
+            self.commit()
+        return result
+
+    def commit(self) -> int:
+        """Persist dirty hash entries (one transaction), the coalescing buffer, and flush metrics."""
+        with self.metrics.timer("hash_commit"):
+            written = self.hash_store.commit()
+            if self.coalesce_store is not None:
+                self.coalesce_store.commit()
+        self.metrics.flush()
+        return written
+
+    def close(self) -> None:
+        self.queue_store.close()
+        self.hash_store.close()
+        if self.coalesce_store is not None:
+            self.coalesce_store.close()
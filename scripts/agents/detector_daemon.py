@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Resident detector: keeps one detector_cycle.Detector alive between cycles.
+
+detector.sh starts a fresh python3 every minute, which re-reads
+detector_fields.json / fetcher_fields.json, reopens the hash and queue
+stores and starts every hash lookup cold, so a cycle's cost follows the
+population rather than the window. The daemon pays that once:
+
+- config, the fingerprint engine and the fetch queue handles stay loaded;
+  hash entries stay in the store's compact cache once seen (--preload loads
+  all of them at startup, a few hundred bytes per user), so a cycle only
+  touches the users in its window
+- windows arrive over a local socket (.backlog/detector.sock; detector.sh
+  submits its fetched window there when the daemon is up) or as *.jsonl
+  files renamed into the drop directory (.backlog/detector_inbox/),
+  processed oldest name first and deleted afterwards. Cycles run one at a
+  time in arrival order.
+- checkpoints commit the dirty hash entries in one transaction and flush
+  metrics every --checkpoint-interval seconds, on SIGTERM/SIGINT (then exit)
+  and on request. Queue pushes and events_queue.jsonl appends are written
+  during the cycle as before, so a SIGKILL between checkpoints only costs
+  the hash updates since the last one: those users are re-detected (and
+  their events re-emitted) on the next cycle.
+- SIGHUP reloads detector_fields.json, fetcher_fields.json and the backlog
+  thresholds (agents.config / env).
+
+Socket protocol: one request line (CYCLE, STATUS or CHECKPOINT); CYCLE is
+followed by the window JSONL until the client shuts down its write side.
+The reply is one JSON line (the cycle result detector.sh logs, or status).
+
+CLI:
+  detector_daemon.py serve  [--socket PATH] [--inbox DIR] [--checkpoint-interval S] [--preload]
+  detector_daemon.py submit [--socket PATH] WINDOW.jsonl   cycle result JSON; exit 2 if no daemon
+  detector_daemon.py status [--socket PATH]
+  detector_daemon.py checkpoint [--socket PATH]
+"""
+
+import argparse
+import json
+import os
+import selectors
+import signal
+import socket
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from detector_cycle import Detector
+
+ROOT = os.environ.get("ROOT_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+CHECKPOINT_INTERVAL = 60.0
+POLL_INTERVAL = 1.0
+CLIENT_TIMEOUT = 30.0
+SUBMIT_TIMEOUT = 300.0
+EXIT_NO_DAEMON = 2
+
+
+def default_socket_path(root: str) -> str:
+    return os.environ.get("DETECTOR_SOCKET") or os.path.join(root, ".backlog", "detector.sock")
+
+
+def default_inbox_path(root: str) -> str:
+    return os.environ.get("DETECTOR_INBOX") or os.path.join(root, ".backlog", "detector_inbox")
+
+
+def log_line(result: Dict[str, Any]) -> str:
+    """detector.sh's cycle log line (without the timestamp/pid prefix)."""
+    def pair(name: str) -> str:
+        return f"({result.get(f'events_{name}_int', 0)}/{result.get(f'events_{name}_ext', 0)})"
+    line = (
+        f"detect={result.get('detect', 0)} fp={result.get('fp', 0)} events={result.get('events', 0)}"
+        f" send=({result.get('send_internal', 0)}/{result.get('send_external', 0)})"
+        f" skip=({result.get('skip_internal', 0)}/{result.get('skip_external', 0)})"
+        f" disconnection={pair('deconnection')} connection={pair('connection')}"
+        f" wallet={pair('wallet')} correction={pair('correction')}"
+        f" evaluation={pair('evaluation')} data={pair('data')}"
+        f" new_seen={pair('new_seen')} error={pair('error')}"
+    )
+    coalesce = result.get("coalesce")
+    if coalesce:
+        line += (f" coalesce=({coalesce['held']}/{coalesce['flushed']}/{coalesce['pending']})"
+                 f" saved=({coalesce['saved_events']}/{coalesce['saved_fetches']})")
+    if result.get("warn"):
+        line += f" WARN={result['warn']}"
+    return line
+
+
+class DetectorDaemon:
+    def __init__(self, root: str, socket_path: str, inbox: str, checkpoint_interval: float, preload: bool):
+        self.root = root
+        self.socket_path = socket_path
+        self.inbox = inbox
+        self.checkpoint_interval = checkpoint_interval
+        self.log_file = os.path.join(root, "logs", "detect_changes.log")
+        self.pid_file = os.path.join(root, ".backlog", "detector_daemon.pid")
+        self.detector = Detector(root)
+        if preload:
+            self.detector.hash_store.preload()
+        self.cycles = 0
+        self.started_at = time.time()
+        self.last_checkpoint = time.monotonic()
+        self.last_cycle: Optional[Dict[str, Any]] = None
+        self._stop = False
+        self._reload = False
+        self._server: Optional[socket.socket] = None
+
+    # -- lifecycle ---------------------------------------------------------
+    def log(self, msg: str) -> None:
+        stamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        with open(self.log_file, "a") as f:
+            f.write(f"[{stamp}] [pid={os.getpid()}] {msg}\n")
+
+    def _on_term(self, signum, frame) -> None:
+        self._stop = True
+
+    def _on_hup(self, signum, frame) -> None:
+        self._reload = True
+
+    def _bind(self) -> socket.socket:
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                raise SystemExit(f"detector_daemon: already running on {self.socket_path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(self.socket_path)
+            finally:
+                probe.close()
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        server.listen(8)
+        server.setblocking(False)
+        return server
+
+    def serve(self) -> None:
+        os.makedirs(self.inbox, exist_ok=True)
+        os.makedirs(os.path.dirname(self.log_file), exist_ok=True)
+        signal.signal(signal.SIGTERM, self._on_term)
+        signal.signal(signal.SIGINT, self._on_term)
+        signal.signal(signal.SIGHUP, self._on_hup)
+        self._server = self._bind()
+        with open(self.pid_file, "w") as f:
+            f.write(f"{os.getpid()}\n")
+        self.log(f"daemon started socket={self.socket_path} inbox={self.inbox} cached={self.detector.hash_store.cached}")
+        selector = selectors.DefaultSelector()
+        selector.register(self._server, selectors.EVENT_READ)
+        try:
+            while not self._stop:
+                if self._reload:
+                    self._reload = False
+                    self.detector.reload_config()
+                    self.log("config reloaded (SIGHUP)")
+                for _ in selector.select(POLL_INTERVAL):
+                    self._accept()
+                    if self._stop:
+                        break
+                if not self._stop:
+                    self._drain_inbox()
+                if time.monotonic() - self.last_checkpoint >= self.checkpoint_interval:
+                    self.checkpoint()
+        finally:
+            selector.close()
+            self._server.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            written = self.checkpoint()
+            self.detector.close()
+            if os.path.exists(self.pid_file):
+                os.unlink(self.pid_file)
+            self.log(f"daemon stopped cycles={self.cycles} final_checkpoint={written}")
+
+    def checkpoint(self) -> int:
+        written = self.detector.commit()
+        self.last_checkpoint = time.monotonic()
+        return written
+
+    # -- work --------------------------------------------------------------
+    def run_window(self, path: str) -> Dict[str, Any]:
+        result = self.detector.run_cycle(path, commit=False)
+        self.cycles += 1
+        self.last_cycle = result
+        return result
+
+    def _drain_inbox(self) -> None:
+        try:
+            names = sorted(n for n in os.listdir(self.inbox) if n.endswith(".jsonl"))
+        except FileNotFoundError:
+            return
+        for name in names:
+            if self._stop:
+                return
+            path = os.path.join(self.inbox, name)
+            try:
+                result = self.run_window(path)
+                self.log(log_line(result))
+            except Exception as exc:
+                self.log(f"ERROR: inbox window {name} failed ({type(exc).__name__}: {exc})")
+            finally:
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "uptime": round(time.time() - self.started_at, 1),
+            "cycles": self.cycles,
+            "cached_hashes": self.detector.hash_store.cached,
+            "dirty_hashes": self.detector.hash_store.dirty,
+            "since_checkpoint": round(time.monotonic() - self.last_checkpoint, 1),
+            "last_cycle": self.last_cycle,
+        }
+
+    def _accept(self) -> None:
+        try:
+            conn, _ = self._server.accept()
+        except BlockingIOError:
+            return
+        with conn:
+            conn.setblocking(True)
+            conn.settimeout(CLIENT_TIMEOUT)
+            try:
+                reply = self._handle(conn)
+            except Exception as exc:
+                reply = {"error": f"{type(exc).__name__}: {exc}"}
+            try:
+                conn.sendall((json.dumps(reply) + "\n").encode())
+            except OSError:
+                pass
+
+    def _handle(self, conn: socket.socket) -> Dict[str, Any]:
+        reader = conn.makefile("rb")
+        command = reader.readline().decode().strip().upper()
+        if command == "STATUS":
+            return self.status()
+        if command == "CHECKPOINT":
+            return {"checkpoint": self.checkpoint()}
+        if command != "CYCLE":
+            return {"error": f"unknown command {command!r}"}
+        fd, path = tempfile.mkstemp(prefix="detector_window_", suffix=".jsonl", dir=os.path.dirname(self.socket_path))
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = reader.read(1 << 16)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+            return self.run_window(path)
+        finally:
+            os.unlink(path)
+
+
+# -- client -----------------------------------------------------------------
+def request(socket_path: str, command: str, payload_path: Optional[str] = None) -> Dict[str, Any]:
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(SUBMIT_TIMEOUT)
+    try:
+        client.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        client.close()
+        sys.exit(EXIT_NO_DAEMON)
+    with client:
+        client.sendall(f"{command}\n".encode())
+        if payload_path:
+            with open(payload_path, "rb") as f:
+                client.sendfile(f)
+        client.shutdown(socket.SHUT_WR)
+        chunks: List[bytes] = []
+        while True:
+            chunk = client.recv(1 << 16)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    reply = json.loads(b"".join(chunks) or b"{}")
+    if "error" in reply:
+        sys.exit(f"detector_daemon: {reply['error']}")
+    return reply
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Resident detector daemon.")
+    parser.add_argument("--socket", default=default_socket_path(ROOT), help="Unix socket (default: .backlog/detector.sock)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_serve = sub.add_parser("serve", help="Run the daemon in the foreground")
+    p_serve.add_argument("--inbox", default=default_inbox_path(ROOT), help="Drop directory for *.jsonl windows")
+    p_serve.add_argument("--checkpoint-interval", type=float, default=CHECKPOINT_INTERVAL, help="Seconds between hash commits")
+    p_serve.add_argument("--preload", action="store_true", help="Load every hash entry at startup")
+    p_submit = sub.add_parser("submit", help="Run one cycle on a window JSONL file")
+    p_submit.add_argument("window")
+    sub.add_parser("status", help="Show daemon state")
+    sub.add_parser("checkpoint", help="Commit hash state now")
+    args = parser.parse_args()
+
+    if args.cmd == "serve":
+        DetectorDaemon(ROOT, args.socket, args.inbox, args.checkpoint_interval, args.preload).serve()
+    elif args.cmd == "submit":
+        print(json.dumps(request(args.socket, "CYCLE", args.window)))
+    else:
+        print(json.dumps(request(args.socket, args.cmd.upper()), indent=2 if args.cmd == "status" else None))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,75 +1,64 @@
+# detector_feed_events.py [--jobs N]
+#
+# Appends one events_logs.jsonl line per changed user of users_latest.json.
+# With --jobs N (or DETECTOR_FEED_JOBS; 0 = all cores) batches are processed by
+# a fork pool: each worker opens its own baseline store / legacy file index and
+# returns its batch's lines, which are written in input order, so the output is
+# identical to a serial run.
+
+import argparse
+import multiprocessing
 import os
 import json
-import hashlib
-import hmac
-import glob
-from datetime import datetime
+
+from baseline_store import BaselineStore, default_db_path
+from detector_core import (
+    SNAPSHOT_FIELDS,
+    FingerprintEngine,
+    get_updated_timestamp,
+    load_detector_config,
+    resolve_campus_id,
+)
+from json_stream import batched, iter_users, projection_fields
+from location_index import LocationIndex
+from metrics import Metrics
 
 ROOT = os.environ.get("ROOT_DIR", "/srv/42_Network/repo")
 BACKLOG = os.path.join(ROOT, ".backlog")
 BASELINE_DIR = os.path.join(ROOT, ".eventifier_baseline")
 EVENTS_LOG = os.path.join(BACKLOG, "events_logs.jsonl")
 USERS_LATEST = os.path.join(ROOT, ".cache/raw_detect/users_latest.json")
-CONFIG_FILE = os.path.join(ROOT, "scripts/config/detector_fields.json")
+BATCH_SIZE = 1000
 
 # Load config
-with open(CONFIG_FILE) as f:
-    config = json.load(f)
-internal_fields = config.get("internals", {}).get("fields", [])
-external_fields = config.get("externals", {}).get("fields", [])
-if not external_fields:
-    external_fields = internal_fields
-hmac_keys = config.get("hmac_keys", {})
-hmac_key_internal = hmac_keys.get("internal", "42network_internal_detection")
-hmac_key_external = hmac_keys.get("external", "42network_external_detection")
-
-# Load latest users
-with open(USERS_LATEST) as f:
-    users = json.load(f)
-
-def fingerprint(user, fields, hmac_key):
-    filtered = {}
-    for k in fields:
-        if k not in user:
-            continue
-        v = user.get(k)
-        if k == "location":
-            filtered[k] = 0 if v in (None, "") else 1
-        else:
-            filtered[k] = v
-    payload = json.dumps(filtered, sort_keys=True, separators=(",", ":"))
-    signature = hmac.new(hmac_key.encode(), payload.encode(), hashlib.sha256).hexdigest()
-    return signature
-
-def get_campus_id(user):
-    campus_users = user.get("campus_users", [])
-    if campus_users and isinstance(campus_users, list):
-        for cu in campus_users:
-            if isinstance(cu, dict) and cu.get("is_primary"):
-                return cu.get("campus_id")
-        if campus_users:
-            return campus_users[0].get("campus_id")
-    campus_list = user.get("campus", [])
-    if campus_list and isinstance(campus_list, list):
-        return campus_list[0].get("id")
-    return None
+detector_config = load_detector_config(ROOT)
+internal_fields = detector_config["internal_fields"]
+external_fields = detector_config["external_fields"]
+fingerprints = FingerprintEngine(detector_config)
+metrics = Metrics("detector_feed_events", ROOT)
+fingerprint_timer = metrics.timer("fingerprint")
 
-def to_number(x):
-    try:
-        return float(x)
-    except (TypeError, ValueError):
-        return None
+# Users are streamed from users_latest.json and projected to the compared fields.
+user_fields = projection_fields(internal_fields, external_fields, SNAPSHOT_FIELDS)
+baseline_index = None
+worker_store = None
 
-def load_baseline(user, campus_id):
+def load_baseline(user, campus_id, stored_baselines):
+    global baseline_index
     uid = user.get("id")
     if uid is None:
         return None
+    stored = stored_baselines.get(str(uid))
+    if stored is not None:
+        return stored
     path = None
     if campus_id is not None:
         path = os.path.join(BASELINE_DIR, f"campus_{campus_id}", f"user_{uid}.json")
-    if not path or not os.path.isfile(path):
-        matches = glob.glob(os.path.join(BASELINE_DIR, "campus_*", f"user_{uid}.json"))
-        path = matches[0] if matches else None
+    if (not path or not os.path.isfile(path)) and os.path.isdir(BASELINE_DIR):
+        # uid -> campus_<id>/user_<uid>.json index for users whose campus guess misses
+        if baseline_index is None:
+            baseline_index = LocationIndex(BASELINE_DIR).refresh()
+        path = baseline_index.path_for(uid)
     if not path or not os.path.isfile(path):
         return None
     try:
@@ -78,15 +67,9 @@ def load_baseline(user, campus_id):
     except Exception:
         return None
 
-def get_updated_timestamp(user):
-    updated = user.get("updated_at")
-    if not updated:
-        return None
-    try:
-        updated_dt = datetime.fromisoformat(updated.replace('Z', '+00:00'))
-        return int(updated_dt.timestamp())
-    except Exception:
-        return None
+def updated_ts(user):
+    ts = get_updated_timestamp(user)
+    return int(ts) if ts is not None else None
 
 def detect_events_and_changes(user, baseline):
     changes = []
@@ -106,42 +89,88 @@ def detect_events_and_changes(user, baseline):
                 events.append("name_change")
     return events, changes
 
-with open(EVENTS_LOG, "a") as evlog:
-    for u in users:
-        if u.get("label") == "error":
-            continue
-        uid = u.get("id")
-        if uid is None:
-            continue
-        campus_id_raw = get_campus_id(u)
-        try:
-            campus_id = int(campus_id_raw) if campus_id_raw is not None else None
-        except Exception:
-            campus_id = campus_id_raw
-        fingerprint_key = "internal" if campus_id == 21 else "external"
-        if fingerprint_key == "internal":
-            fingerprint_fields = internal_fields
-            hmac_key = hmac_key_internal
-        else:
-            fingerprint_fields = external_fields
-            hmac_key = hmac_key_external
-        fp = fingerprint(u, fingerprint_fields, hmac_key)
-        baseline = load_baseline(u, campus_id)
+def process_user(u, stored_baselines):
+    """The events_logs line for one user, or None."""
+    if not isinstance(u, dict) or u.get("label") == "error":
+        return None
+    uid = u.get("id")
+    if uid is None:
+        return None
+    campus_id = resolve_campus_id(u)
+    fingerprint_key = "internal" if campus_id == 21 else "external"
+    fingerprinter = fingerprints.for_key(fingerprint_key)
+    baseline = load_baseline(u, campus_id, stored_baselines)
+    with fingerprint_timer:
+        fp = fingerprinter(u)
         if baseline:
-            last_fp = fingerprint(baseline, fingerprint_fields, hmac_key)
+            last_fp = fingerprinter(baseline)
         else:
             last_fp = None
-        if fp != last_fp:
-            events, changes = detect_events_and_changes(u, baseline)
-            if events or changes:
-                event_obj = {
-                    "user_id": uid,
-                    "user_login": u.get("login"),
-                    "campus_id": campus_id,
-                    "updated_at": u.get("updated_at"),
-                    "events": events,
-                    "changes": changes,
-                    "internal_external": fingerprint_key,
-                    "ts": get_updated_timestamp(u)
-                }
-                evlog.write(json.dumps(event_obj, separators=(',', ':')) + "\n")
+    if fp != last_fp:
+        events, changes = detect_events_and_changes(u, baseline)
+        if events or changes:
+            event_obj = {
+                "user_id": uid,
+                "user_login": u.get("login"),
+                "campus_id": campus_id,
+                "updated_at": u.get("updated_at"),
+                "events": events,
+                "changes": changes,
+                "internal_external": fingerprint_key,
+                "ts": updated_ts(u)
+            }
+            return json.dumps(event_obj, separators=(',', ':')) + "\n"
+    return None
+
+def batch_ids(batch):
+    return (u.get("id") for u in batch if isinstance(u, dict) and isinstance(u.get("id"), int))
+
+def init_worker():
+    global worker_store
+    worker_store = BaselineStore(default_db_path(ROOT))
+
+def process_batch(batch):
+    """Pool worker: lines for one batch, read against the worker's own baseline store."""
+    stored_baselines = worker_store.get_many(batch_ids(batch))
+    return [line for line in (process_user(u, stored_baselines) for u in batch) if line]
+
+def write_lines(evlog, lines):
+    for line in lines:
+        evlog.write(line)
+        metrics.add_bytes("events_write", written=len(line))
+    metrics.count("events", len(lines))
+
+def count_users(batches):
+    for batch in batches:
+        metrics.count("users", len(batch))
+        yield batch
+
+def main():
+    parser = argparse.ArgumentParser(description="Append events_logs.jsonl lines for users_latest.json.")
+    parser.add_argument("--jobs", type=int, default=int(os.environ.get("DETECTOR_FEED_JOBS", "1")),
+                        help="Worker processes (0 = all cores, default: 1)")
+    args = parser.parse_args()
+    jobs = args.jobs or os.cpu_count() or 1
+
+    # Baselines come from the SQLite store in one batched read per BATCH_SIZE users;
+    # legacy files are imported once and only consulted for uids the store lacks.
+    with BaselineStore(default_db_path(ROOT)) as baseline_store, open(EVENTS_LOG, "a") as evlog:
+        with metrics.timer("baseline_migrate"):
+            baseline_store.ensure_migrated(BASELINE_DIR)
+        if os.path.isfile(USERS_LATEST):
+            metrics.add_bytes("json_load", read=os.path.getsize(USERS_LATEST))
+        users = metrics.timed_iter("json_load", iter_users(USERS_LATEST, user_fields))
+        if jobs > 1:
+            with multiprocessing.get_context("fork").Pool(jobs, initializer=init_worker) as pool:
+                for lines in metrics.timed_iter("batch_wait", pool.imap(process_batch, count_users(batched(users, BATCH_SIZE)))):
+                    write_lines(evlog, lines)
+        else:
+            for batch in batched(users, BATCH_SIZE):
+                with metrics.timer("baseline_read"):
+                    stored_baselines = baseline_store.get_many(batch_ids(batch))
+                write_lines(evlog, [line for line in (process_user(u, stored_baselines) for u in batch) if line])
+                metrics.count("users", len(batch))
+    metrics.flush()
+
+if __name__ == "__main__":
+    main()
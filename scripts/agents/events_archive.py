@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+"""
+Compacted, indexed archive of .backlog/events_queue.jsonl.
+
+The live queue is append-only and shared by detector.sh and eventifier.sh under
+events_queue.lock. compact rolls it into immutable segments under
+.backlog/events_archive/:
+
+  seg_<id>.jsonl.gz | .jsonl.xz  the raw lines, compressed in independent blocks
+                                 (~--block-bytes each; one gzip member / xz stream
+                                 per block, so `zcat` / `xzcat` still read the
+                                 whole file)
+  seg_<id>.idx                   SQLite index for that segment: block offsets,
+                                 plus user_id, campus_id, ts and event types per
+                                 record
+  manifest.json                  segments in order with record counts and ts range
+
+Rolling is a rename under events_queue.lock: the writers recreate the live file
+on their next append, and `classify_events.py --follow` finishes the old inode
+before it switches to the new one. The renamed file (pending_<id>.jsonl) is
+compressed and indexed outside the lock. A crashed compaction leaves the
+pending file behind, and the next run picks it up again.
+
+Queries check the manifest ts range first and then each segment's index. Only
+the blocks that hold matching records are decompressed. The live file is
+scanned as-is. Results come back in queue order: older segments first, then
+the live file.
+
+CLI:
+  events_archive.py compact [--codec gzip|lzma] [--block-bytes N] [--min-bytes N]
+  events_archive.py query [--user ID] [--campus ID] [--type T] [--since T] [--until T]
+                          [--no-live] [--limit N]
+  events_archive.py cat [--no-live]      every archived (then live) line, in order
+  events_archive.py tail [-n N]          the last N lines across archive and live queue
+  events_archive.py count                {"archived", "live", "total"} records
+  events_archive.py clear                empty the live queue and drop every segment
+  events_archive.py segments
+Times for --since/--until are epoch seconds or ISO dates (UTC), e.g. 2026-10-13.
+"""
+
+import argparse
+import fcntl
+import gzip
+import json
+import lzma
+import os
+import sqlite3
+import sys
+import time
+import zlib
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from metrics import Metrics
+
+ROOT = os.environ.get("ROOT_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+BLOCK_BYTES = 256 << 10
+CODECS = {"gzip": ".jsonl.gz", "lzma": ".jsonl.xz"}
+
+INDEX_SCHEMA = """
+CREATE TABLE blocks (block INTEGER PRIMARY KEY, offset INTEGER NOT NULL, length INTEGER NOT NULL,
+                     first_seq INTEGER NOT NULL, records INTEGER NOT NULL);
+CREATE TABLE records (seq INTEGER PRIMARY KEY, block INTEGER NOT NULL,
+                      user_id INTEGER, campus_id INTEGER, ts INTEGER);
+CREATE TABLE types (type TEXT NOT NULL, seq INTEGER NOT NULL, PRIMARY KEY (type, seq)) WITHOUT ROWID;
+"""
+INDEX_INDEXES = """
+CREATE INDEX records_user ON records (user_id, seq);
+CREATE INDEX records_campus_ts ON records (campus_id, ts);
+CREATE INDEX records_ts ON records (ts);
+"""
+
+
+def default_queue_path(root: str) -> str:
+    return os.environ.get("EVENTS_QUEUE") or os.path.join(root, ".backlog", "events_queue.jsonl")
+
+
+def default_archive_dir(root: str) -> str:
+    return os.environ.get("EVENTS_ARCHIVE_DIR") or os.path.join(root, ".backlog", "events_archive")
+
+
+def parse_time(value: str) -> int:
+    """Epoch seconds or an ISO date/datetime (naive = UTC)."""
+    try:
+        return int(float(value))
+    except ValueError:
+        pass
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def _int_or_none(value: Any) -> Optional[int]:
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def event_fields(event: Dict[str, Any]) -> Tuple[Optional[int], Optional[int], Optional[int], List[str]]:
+    """(user_id, campus_id, ts, types) as indexed for one event."""
+    types = event.get("types")
+    if not isinstance(types, list) or not types:
+        types = ["error"] if "error" in event else ["unknown"]
+    return (
+        _int_or_none(event.get("user_id")),
+        _int_or_none(event.get("campus_id")),
+        _int_or_none(event.get("ts")),
+        sorted({str(t) for t in types}),
+    )
+
+
+def index_fields(line: bytes) -> Tuple[Optional[int], Optional[int], Optional[int], List[str]]:
+    """event_fields() of one raw line; unparsable lines index as nulls."""
+    event = _parse(line)
+    if event is None:
+        return None, None, None, []
+    return event_fields(event)
+
+
+def _compress(codec: str, data: bytes) -> bytes:
+    if codec == "lzma":
+        return lzma.compress(data, preset=6)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == "lzma":
+        return lzma.decompress(data)
+    return zlib.decompress(data, wbits=31)
+
+
+def _parse(line: bytes) -> Optional[Dict[str, Any]]:
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None
+    return event if isinstance(event, dict) else None
+
+
+class EventArchive:
+    def __init__(self, root: str = ROOT, archive_dir: Optional[str] = None, queue_path: Optional[str] = None):
+        self.root = root
+        self.dir = archive_dir or default_archive_dir(root)
+        self.queue = queue_path or default_queue_path(root)
+        self.queue_lock = os.path.join(os.path.dirname(self.queue), "events_queue.lock")
+        self.manifest_path = os.path.join(self.dir, "manifest.json")
+
+    # -- manifest ------------------------------------------------------------
+    def segments(self) -> List[Dict[str, Any]]:
+        try:
+            with open(self.manifest_path, "r") as f:
+                return json.load(f).get("segments", [])
+        except (OSError, ValueError):
+            return []
+
+    def _save_segments(self, segments: List[Dict[str, Any]]) -> None:
+        tmp = f"{self.manifest_path}.tmp.{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump({"segments": segments}, f, indent=1)
+        os.replace(tmp, self.manifest_path)
+
+    def _pending(self) -> List[Tuple[int, str]]:
+        found = []
+        for name in os.listdir(self.dir):
+            if name.startswith("pending_") and name.endswith(".jsonl"):
+                found.append((int(name[len("pending_"):-len(".jsonl")]), os.path.join(self.dir, name)))
+        return sorted(found)
+
+    # -- compaction ----------------------------------------------------------
+    def compact(self, codec: str = "gzip", block_bytes: int = BLOCK_BYTES, min_bytes: int = 0,
+                metrics: Optional[Metrics] = None) -> List[Dict[str, Any]]:
+        """Roll the live queue (plus any leftover pending files) into new segments."""
+        metrics = metrics or Metrics("events_archive", self.root, enabled=False)
+        os.makedirs(self.dir, exist_ok=True)
+        with open(os.path.join(self.dir, "compact.lock"), "w") as compact_lock:
+            fcntl.flock(compact_lock, fcntl.LOCK_EX)
+            self._roll(min_bytes, metrics)
+            segments = self.segments()
+            known = {seg["id"] for seg in segments}
+            added = []
+            for seg_id, pending in self._pending():
+                if seg_id not in known:
+                    with metrics.timer("segment_write"):
+                        segment = self._write_segment(seg_id, pending, codec, block_bytes)
+                    metrics.add_bytes("segment_write", read=segment["raw_bytes"], written=segment["bytes"])
+                    metrics.count("records", segment["records"])
+                    segments.append(segment)
+                    added.append(segment)
+                    self._save_segments(segments)
+                os.unlink(pending)
+            return added
+
+    def _roll(self, min_bytes: int, metrics: Metrics) -> None:
+        """Rename the live queue to pending_<id>.jsonl under the writers' lock."""
+        with open(self.queue_lock, "w") as lock_file:
+            metrics.flock(lock_file, "events_queue")
+            try:
+                size = os.path.getsize(self.queue)
+            except FileNotFoundError:
+                return
+            if size == 0 or size < min_bytes:
+                return
+            ids = [seg["id"] for seg in self.segments()] + [seg_id for seg_id, _ in self._pending()]
+            os.rename(self.queue, os.path.join(self.dir, f"pending_{max(ids, default=0) + 1:06d}.jsonl"))
+            open(self.queue, "a").close()
+
+    def _write_segment(self, seg_id: int, pending: str, codec: str, block_bytes: int) -> Dict[str, Any]:
+        name = f"seg_{seg_id:06d}"
+        data_path = os.path.join(self.dir, name + CODECS[codec])
+        index_path = os.path.join(self.dir, name + ".idx")
+        tmp_data, tmp_index = data_path + ".tmp", index_path + ".tmp"
+        # leftovers of a crashed run, possibly with another codec
+        for path in [os.path.join(self.dir, name + ext + ".tmp") for ext in CODECS.values()] + [tmp_index]:
+            if os.path.exists(path):
+                os.unlink(path)
+        db = sqlite3.connect(tmp_index, isolation_level=None)
+        db.executescript(INDEX_SCHEMA)
+        db.execute("BEGIN")
+        seq = 0
+        raw_bytes = 0
+        min_ts: Optional[int] = None
+        max_ts: Optional[int] = None
+        block_lines: List[bytes] = []
+        block_size = 0
+        blocks = 0
+
+        with open(pending, "rb") as src, open(tmp_data, "wb") as out:
+            def flush_block() -> None:
+                nonlocal block_lines, block_size, blocks
+                if not block_lines:
+                    return
+                payload = _compress(codec, b"".join(block_lines))
+                db.execute(
+                    "INSERT INTO blocks VALUES (?, ?, ?, ?, ?)",
+                    (blocks, out.tell(), len(payload), seq - len(block_lines), len(block_lines)),
+                )
+                out.write(payload)
+                blocks += 1
+                block_lines, block_size = [], 0
+
+            for line in src:
+                if not line.strip():
+                    continue
+                if not line.endswith(b"\n"):
+                    line += b"\n"
+                user_id, campus_id, ts, types = index_fields(line)
+                db.execute("INSERT INTO records VALUES (?, ?, ?, ?, ?)", (seq, blocks, user_id, campus_id, ts))
+                db.executemany("INSERT INTO types VALUES (?, ?)", ((t, seq) for t in types))
+                if ts is not None:
+                    min_ts = ts if min_ts is None else min(min_ts, ts)
+                    max_ts = ts if max_ts is None else max(max_ts, ts)
+                block_lines.append(line)
+                block_size += len(line)
+                raw_bytes += len(line)
+                seq += 1
+                if block_size >= block_bytes:
+                    flush_block()
+            flush_block()
+            out.flush()
+            os.fsync(out.fileno())
+
+        db.execute("COMMIT")
+        db.executescript(INDEX_INDEXES)
+        db.close()
+        os.replace(tmp_data, data_path)
+        os.replace(tmp_index, index_path)
+        return {
+            "id": seg_id,
+            "file": os.path.basename(data_path),
+            "index": os.path.basename(index_path),
+            "codec": codec,
+            "records": seq,
+            "blocks": blocks,
+            "raw_bytes": raw_bytes,
+            "bytes": os.path.getsize(data_path),
+            "min_ts": min_ts,
+            "max_ts": max_ts,
+            "created_at": int(time.time()),
+        }
+
+    # -- reading -------------------------------------------------------------
+    def read_block(self, segment: Dict[str, Any], offset: int, length: int) -> List[bytes]:
+        return read_block_file(os.path.join(self.dir, segment["file"]), segment["codec"], offset, length)
+
+    def block_tasks(self) -> List[Tuple[str, str, int, int]]:
+        """(path, codec, offset, length) for every archived block, in queue order."""
+        tasks = []
+        for segment in self.segments():
+            db = self._open_index(segment)
+            try:
+                for offset, length in db.execute("SELECT offset, length FROM blocks ORDER BY block"):
+                    tasks.append((os.path.join(self.dir, segment["file"]), segment["codec"], offset, length))
+            finally:
+                db.close()
+        return tasks
+
+    def iter_lines(self, live: bool = True) -> Iterator[bytes]:
+        """Every archived line, then the live queue."""
+        for path, codec, offset, length in self.block_tasks():
+            yield from read_block_file(path, codec, offset, length)
+        if live:
+            yield from self._live_lines()
+
+    def _live_lines(self) -> Iterator[bytes]:
+        try:
+            with open(self.queue, "rb") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        yield line
+        except FileNotFoundError:
+            return
+
+    def tail(self, count: int) -> List[bytes]:
+        """The last `count` lines in queue order; reads archived blocks newest first, only as far as needed."""
+        if count <= 0:
+            return []
+        lines = list(self._live_lines())[-count:]
+        for segment in reversed(self.segments()):
+            if len(lines) >= count:
+                break
+            db = self._open_index(segment)
+            try:
+                blocks = db.execute("SELECT offset, length FROM blocks ORDER BY block DESC").fetchall()
+            finally:
+                db.close()
+            for offset, length in blocks:
+                if len(lines) >= count:
+                    break
+                lines = self.read_block(segment, offset, length) + lines
+        return lines[-count:]
+
+    def counts(self) -> Dict[str, int]:
+        """Record counts: archived (manifest), live (lines in the queue file) and their sum."""
+        archived = sum(int(seg.get("records") or 0) for seg in self.segments())
+        live = 0
+        try:
+            with open(self.queue, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    live += chunk.count(b"\n")
+        except FileNotFoundError:
+            pass
+        return {"archived": archived, "live": live, "total": archived + live}
+
+    def clear(self) -> int:
+        """Truncate the live queue and delete every segment; returns the segments dropped."""
+        os.makedirs(self.dir, exist_ok=True)
+        with open(os.path.join(self.dir, "compact.lock"), "w") as compact_lock:
+            fcntl.flock(compact_lock, fcntl.LOCK_EX)
+            with open(self.queue_lock, "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                open(self.queue, "w").close()
+                dropped = len(self.segments())
+                # Manifest first: a reader never sees a segment whose files are gone.
+                self._save_segments([])
+                for name in os.listdir(self.dir):
+                    if name.startswith(("seg_", "pending_")):
+                        os.unlink(os.path.join(self.dir, name))
+        return dropped
+
+    def _open_index(self, segment: Dict[str, Any]) -> sqlite3.Connection:
+        path = os.path.join(self.dir, segment["index"])
+        return sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True)
+
+    def query(self, user_id: Optional[int] = None, campus_id: Optional[int] = None, event_type: Optional[str] = None,
+              since: Optional[int] = None, until: Optional[int] = None, live: bool = True,
+              limit: int = 0) -> Iterator[Dict[str, Any]]:
+        """Matching events in queue order; until is exclusive."""
+        where, params = [], []
+        for column, value in (("r.user_id", user_id), ("r.campus_id", campus_id)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            where.append("r.ts >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("r.ts < ?")
+            params.append(until)
+        join = ""
+        if event_type is not None:
+            join = "JOIN types t ON t.seq = r.seq AND t.type = ?"
+            params.insert(0, event_type)
+        sql = f"SELECT r.block, r.seq - b.first_seq FROM records r JOIN blocks b ON b.block = r.block {join}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY r.seq"
+
+        emitted = 0
+        for segment in self.segments():
+            if since is not None and segment.get("max_ts") is not None and segment["max_ts"] < since:
+                continue
+            if until is not None and segment.get("min_ts") is not None and segment["min_ts"] >= until:
+                continue
+            db = self._open_index(segment)
+            try:
+                hits: Dict[int, List[int]] = defaultdict(list)
+                for block, pos in db.execute(sql, params):
+                    hits[block].append(pos)
+                spans = dict(
+                    (block, (offset, length))
+                    for block, offset, length in db.execute("SELECT block, offset, length FROM blocks")
+                    if block in hits
+                )
+            finally:
+                db.close()
+            for block in sorted(hits):
+                lines = self.read_block(segment, *spans[block])
+                for pos in hits[block]:
+                    event = _parse(lines[pos])
+                    if event is None:
+                        continue
+                    yield event
+                    emitted += 1
+                    if limit and emitted >= limit:
+                        return
+        if not live:
+            return
+        for line in self._live_lines():
+            event = _parse(line)
+            if event is None or not matches(event, user_id, campus_id, event_type, since, until):
+                continue
+            yield event
+            emitted += 1
+            if limit and emitted >= limit:
+                return
+
+
+def read_block_file(path: str, codec: str, offset: int, length: int) -> List[bytes]:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    return _decompress(codec, data).splitlines()
+
+
+def matches(event: Dict[str, Any], user_id: Optional[int], campus_id: Optional[int], event_type: Optional[str],
+            since: Optional[int], until: Optional[int]) -> bool:
+    """Same predicate as the index query, for lines not indexed yet."""
+    line_user, line_campus, ts, types = event_fields(event)
+    if user_id is not None and line_user != user_id:
+        return False
+    if campus_id is not None and line_campus != campus_id:
+        return False
+    if event_type is not None and event_type not in types:
+        return False
+    if since is not None and (ts is None or ts < since):
+        return False
+    if until is not None and (ts is None or ts >= until):
+        return False
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compacted, indexed archive of events_queue.jsonl.")
+    parser.add_argument("--dir", default=None, help="Archive directory (default: .backlog/events_archive)")
+    parser.add_argument("--queue", default=None, help="Live queue (default: .backlog/events_queue.jsonl)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_compact = sub.add_parser("compact", help="Roll the live queue into a new segment")
+    p_compact.add_argument("--codec", choices=sorted(CODECS), default=os.environ.get("EVENTS_ARCHIVE_CODEC", "gzip"))
+    p_compact.add_argument("--block-bytes", type=int, default=BLOCK_BYTES, help="Uncompressed bytes per block")
+    p_compact.add_argument("--min-bytes", type=int, default=0, help="Skip when the live queue is smaller")
+    p_query = sub.add_parser("query", help="Print matching events as JSONL")
+    p_query.add_argument("--user", type=int, default=None)
+    p_query.add_argument("--campus", type=int, default=None)
+    p_query.add_argument("--type", default=None, help="Event type (connection, evaluation, ...)")
+    p_query.add_argument("--since", type=parse_time, default=None)
+    p_query.add_argument("--until", type=parse_time, default=None, help="Exclusive upper bound")
+    p_query.add_argument("--no-live", action="store_true", help="Archived segments only")
+    p_query.add_argument("--limit", type=int, default=0)
+    p_cat = sub.add_parser("cat", help="Print every archived line, then the live queue")
+    p_cat.add_argument("--no-live", action="store_true", help="Archived segments only")
+    p_tail = sub.add_parser("tail", help="Print the last N lines (archive, then live queue)")
+    p_tail.add_argument("-n", "--lines", type=int, default=50)
+    sub.add_parser("count", help="Archived, live and total record counts")
+    sub.add_parser("clear", help="Empty the live queue and delete every archived segment")
+    sub.add_parser("segments", help="Show the manifest")
+    args = parser.parse_args()
+
+    archive = EventArchive(ROOT, args.dir, args.queue)
+    if args.cmd == "compact":
+        metrics = Metrics("events_archive", ROOT)
+        try:
+            for segment in archive.compact(args.codec, args.block_bytes, args.min_bytes, metrics):
+                print(json.dumps(segment))
+        finally:
+            metrics.flush()
+    elif args.cmd == "query":
+        for event in archive.query(args.user, args.campus, args.type, args.since, args.until,
+                                   not args.no_live, args.limit):
+            sys.stdout.write(json.dumps(event) + "\n")
+    elif args.cmd == "cat":
+        out = sys.stdout.buffer
+        for line in archive.iter_lines(not args.no_live):
+            out.write(line + b"\n")
+    elif args.cmd == "tail":
+        out = sys.stdout.buffer
+        for line in archive.tail(args.lines):
+            out.write(line + b"\n")
+    elif args.cmd == "count":
+        print(json.dumps(archive.counts()))
+    elif args.cmd == "clear":
+        print(json.dumps({"segments_dropped": archive.clear()}))
+    else:
+        print(json.dumps(archive.segments(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,36 @@
 #!/usr/bin/env python3
 # events_logs_generator.py
 # Generate events_logs.jsonl from detector output, splitting by event type, internal/external, and handling new_seen events.
+#
+# Usage: events_logs_generator.py [--incremental] [--watermark PATH]
+#
+# Default mode rewrites events_logs.jsonl / rejected_moves.log for every user
+# in the latest users_*.json. --incremental (or EVENTS_LOGS_INCREMENTAL=1)
+# only processes users whose updated_at is past the persisted watermark
+# (.backlog/events_logs.watermark) and appends to both files; users without a
+# parseable updated_at are skipped in that mode. Both modes advance the
+# watermark, so a full run can be followed by incremental ones without
+# duplicates. Without a watermark the incremental run behaves like a full one.
+#
+# The snapshot is streamed (json_stream.iter_users) in batches of BATCH_SIZE:
+# users at or below the watermark are dropped as they are read, and baselines
+# and hashes are fetched per batch, so memory does not grow with the snapshot.
 
+import argparse
+import itertools
 import os
 import json
 import sys
-from datetime import datetime
+import time
+
+from baseline_store import BaselineStore, default_db_path
+from detector_core import get_campus_id, get_updated_timestamp
+from hash_store import HashStore
+from hash_store import default_db_path as default_hash_db_path
+from json_stream import batched, iter_users
+from metrics import Metrics
+
+BATCH_SIZE = 1000
 
 def load_json(path, default=None):
     try:
@@ -14,7 +39,100 @@ def load_json(path, default=None):
     except Exception:
         return default
 
+def default_watermark_path(root):
+    return os.environ.get('EVENTS_LOGS_WATERMARK') or os.path.join(root, '.backlog', 'events_logs.watermark')
+
+def load_watermark(path):
+    """(updated_at timestamp, ids already logged at exactly that timestamp) or None."""
+    state = load_json(path)
+    if not isinstance(state, dict) or not isinstance(state.get('updated_at'), (int, float)):
+        return None
+    return float(state['updated_at']), set(state.get('ids') or [])
+
+def save_watermark(path, mark, ids):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'updated_at': mark, 'ids': sorted(ids)}, f)
+    os.replace(tmp, path)
+
+def select_newer(users, watermark):
+    """Users past the watermark; ties on the watermark itself are resolved by id."""
+    mark, seen = watermark
+    selected = []
+    for user in users:
+        ts = get_updated_timestamp(user)
+        if ts is None or ts < mark:
+            continue
+        if ts == mark and user.get('id') in seen:
+            continue
+        selected.append(user)
+    return selected
+
+def advance_watermark(users, watermark):
+    mark, ids = watermark if watermark else (None, set())
+    for user in users:
+        ts = get_updated_timestamp(user)
+        if ts is None or not isinstance(user.get('id'), int):
+            continue
+        if mark is None or ts > mark:
+            mark, ids = ts, {user['id']}
+        elif ts == mark:
+            ids.add(user['id'])
+    return mark, ids
+
+def diff_user(user, baseline):
+    """(events, changes, move_rejected) for one user against its baseline; no baseline is new_seen."""
+    events = []
+    changes = []
+    move_rejected = False
+    if not baseline:
+        events.append('new_seen')
+    else:
+        # Only compare detector scalar fields (SNAPSHOT_FIELDS)
+        loc_old = baseline.get('location')
+        loc_new = user.get('location')
+        # Filter out location-to-location moves (moves: location1 -> location2)
+        if loc_old != loc_new:
+            if loc_old is None and loc_new:
+                changes.append({'field': 'location', 'old': loc_old, 'new': loc_new})
+                events.append('connection')
+            elif loc_old and loc_new is None:
+                changes.append({'field': 'location', 'old': loc_old, 'new': loc_new})
+                events.append('deconnection')
+            elif loc_old and loc_new:
+                # moves (location1 -> location2) are excluded from logs
+                move_rejected = True
+        cp_old = baseline.get('correction_point')
+        cp_new = user.get('correction_point')
+        if cp_old is not None and cp_new is not None and cp_old != cp_new:
+            changes.append({'field': 'correction_point', 'old': cp_old, 'new': cp_new})
+            delta = cp_new - cp_old
+            if delta < 0:
+                events.append('evaluation')
+            elif delta > 0:
+                events.append('correction')
+        wallet_old = baseline.get('wallet')
+        wallet_new = user.get('wallet')
+        if wallet_old != wallet_new:
+            changes.append({'field': 'wallet', 'old': wallet_old, 'new': wallet_new})
+            events.append('wallet')
+        for k in ('login', 'first_name', 'last_name'):
+            if baseline.get(k) != user.get(k):
+                changes.append({'field': k, 'old': baseline.get(k), 'new': user.get(k)})
+                events.append('data')
+                break
+        # If there are changes but no known event, fallback to 'data' (never empty, never error/unknown_change)
+        if not events and changes:
+            events.append('data')
+    return events, changes, move_rejected
+
 def main():
+    parser = argparse.ArgumentParser(description='Generate .backlog/events_logs.jsonl from the latest users snapshot.')
+    parser.add_argument('--incremental', action='store_true', default=os.environ.get('EVENTS_LOGS_INCREMENTAL') == '1',
+                        help='Only process users updated past the watermark and append')
+    parser.add_argument('--watermark', default=None, help='Watermark file (default: .backlog/events_logs.watermark)')
+    args = parser.parse_args()
+
     # Paths (adjust as needed)
 
     baseline_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../logs/.eventifier_baseline'))
@@ -25,109 +143,97 @@ def main():
     user_files = sorted(glob.glob(os.path.join(raw_detect_dir, 'users_*.json')))
     users_json = user_files[-1] if user_files else None
     output_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../.backlog/events_logs.jsonl'))
+    root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
+    rejected_path = os.path.join(root_dir, '.backlog', 'rejected_moves.log')
+    watermark_path = args.watermark or default_watermark_path(root_dir)
+    metrics = Metrics('events_logs_generator', root_dir)
 
-    # Load detector hashes and latest users
-    hashes = load_json(detector_json, {})
-    users = load_json(users_json, []) if users_json else []
-    if not users:
+    # Stream the latest users; an empty or unreadable snapshot leaves the outputs alone
+    users = iter_users(users_json) if users_json and os.path.isfile(users_json) else iter(())
+    try:
+        with metrics.timer('json_load'):
+            first = next(users, None)
+    except (OSError, ValueError):
+        first = None
+    if first is None:
         print('No users found.')
         return
+    metrics.add_bytes('json_load', read=os.path.getsize(users_json))
+    users = metrics.timed_iter('json_load', itertools.chain([first], users))
 
-    # Only compare these scalar fields (from detector_fields.json)
-    detector_fields = [
-        'login', 'first_name', 'last_name', 'correction_point', 'wallet', 'location'
-    ]
+    watermark = load_watermark(watermark_path) if args.incremental else None
+    append = watermark is not None
+    # Advanced batch by batch; a copy, so select_newer keeps the ids of the stored watermark
+    next_mark = (watermark[0], set(watermark[1])) if append else None
 
     rejected_moves = []
-    with open(output_path, 'w') as out:
-        for user in users:
-            uid = user.get('id')
-            if uid is None:
+    written = 0
+    processed = 0
+    run_ts = int(time.time())
+    with BaselineStore(default_db_path(root_dir)) as store, \
+            HashStore(default_hash_db_path(root_dir)) as hash_store, \
+            open(output_path, 'a' if append else 'w') as out:
+        with metrics.timer('baseline_migrate'):
+            store.ensure_migrated(baseline_dir)
+        with metrics.timer('hash_migrate'):
+            hash_store.ensure_migrated(detector_json)
+        for batch in batched((u for u in users if isinstance(u, dict)), BATCH_SIZE):
+            selected = select_newer(batch, watermark) if append else batch
+            metrics.count('users_skipped', len(batch) - len(selected))
+            next_mark = advance_watermark(selected, next_mark)
+            if not selected:
                 continue
-            uid_str = str(uid)
-            campus_id = None
-            # Try to get campus_id from user or hash
-            if 'campus_users' in user and user['campus_users']:
-                for cu in user['campus_users']:
-                    if cu.get('is_primary'):
-                        campus_id = cu.get('campus_id')
-                        break
-                if not campus_id:
-                    campus_id = user['campus_users'][0].get('campus_id')
-            if not campus_id and 'campus' in user and user['campus']:
-                campus_id = user['campus'][0].get('id')
-            if not campus_id and uid_str in hashes:
-                campus_id = hashes[uid_str].get('campus_id')
-            # Baseline path
-            baseline_path = os.path.join(baseline_dir, f'user_{uid}.json')
-            baseline = load_json(baseline_path, None)
-            # Event detection
-            events = []
-            changes = []
-            move_rejected = False
-            if not baseline:
-                events.append('new_seen')
-            else:
-                # Only compare detector scalar fields
-                loc_old = baseline.get('location')
-                loc_new = user.get('location')
-                # Filter out location-to-location moves (moves: location1 -> location2)
-                if loc_old != loc_new:
-                    if loc_old is None and loc_new:
-                        changes.append({'field': 'location', 'old': loc_old, 'new': loc_new})
-                        events.append('connection')
-                    elif loc_old and loc_new is None:
-                        changes.append({'field': 'location', 'old': loc_old, 'new': loc_new})
-                        events.append('deconnection')
-                    elif loc_old and loc_new:
-                        # moves (location1 -> location2) are excluded from logs
-                        move_rejected = True
-                cp_old = baseline.get('correction_point')
-                cp_new = user.get('correction_point')
-                if cp_old is not None and cp_new is not None and cp_old != cp_new:
-                    changes.append({'field': 'correction_point', 'old': cp_old, 'new': cp_new})
-                    delta = cp_new - cp_old
-                    if delta < 0:
-                        events.append('evaluation')
-                    elif delta > 0:
-                        events.append('correction')
-                wallet_old = baseline.get('wallet')
-                wallet_new = user.get('wallet')
-                if wallet_old != wallet_new:
-                    changes.append({'field': 'wallet', 'old': wallet_old, 'new': wallet_new})
-                    events.append('wallet')
-                for k in ('login', 'first_name', 'last_name'):
-                    if baseline.get(k) != user.get(k):
-                        changes.append({'field': k, 'old': baseline.get(k), 'new': user.get(k)})
-                        events.append('data')
-                        break
-                # If there are changes but no known event, fallback to 'data' (never empty, never error/unknown_change)
-                if not events and changes:
-                    events.append('data')
-            # Always use the official event list, never emit empty events
-            if not events:
-                continue  # skip writing this log entry
-            # Internal/external
-            fingerprint_key = hashes.get(uid_str, {}).get('fingerprint_key', 'unknown')
-            # Compose log entry
-            log_entry = {
-                'user_id': uid,
-                'user_login': user.get('login'),
-                'campus_id': campus_id,
-                'updated_at': user.get('updated_at'),
-                'events': events,
-                'changes': changes,
-                'internal_external': fingerprint_key,
-                'ts': int(datetime.utcnow().timestamp())
-            }
-            out.write(json.dumps(log_entry) + '\n')
-            if move_rejected:
-                rejected_moves.append(uid)
+            ids = [u.get('id') for u in selected if isinstance(u.get('id'), int)]
+            # Baselines and campus_id / fingerprint_key for this batch only
+            with metrics.timer('baseline_read'):
+                baselines = store.get_many(ids)
+            with metrics.timer('hash_read'):
+                hashes = hash_store.get_many(ids)
+            with metrics.timer('diff_write'):
+                for user in selected:
+                    uid = user.get('id')
+                    if uid is None:
+                        continue
+                    uid_str = str(uid)
+                    # Try to get campus_id from user or hash
+                    campus_id = get_campus_id(user)
+                    if not campus_id and uid_str in hashes:
+                        campus_id = hashes[uid_str].get('campus_id')
+                    baseline = baselines.get(uid_str)
+                    events, changes, move_rejected = diff_user(user, baseline)
+                    # Always use the official event list, never emit empty events
+                    if not events:
+                        continue  # skip writing this log entry
+                    # Internal/external
+                    fingerprint_key = (hashes.get(uid_str) or {}).get('fingerprint_key') or 'unknown'
+                    # Compose log entry
+                    log_entry = {
+                        'user_id': uid,
+                        'user_login': user.get('login'),
+                        'campus_id': campus_id,
+                        'updated_at': user.get('updated_at'),
+                        'events': events,
+                        'changes': changes,
+                        'internal_external': fingerprint_key,
+                        'ts': run_ts
+                    }
+                    line = json.dumps(log_entry) + '\n'
+                    out.write(line)
+                    written += len(line)
+                    metrics.count('events')
+                    if move_rejected:
+                        rejected_moves.append(uid)
+            processed += len(selected)
     # Optionally, log rejected moves to a separate file
     if rejected_moves:
-        with open(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../.backlog/rejected_moves.log')), 'w') as rm:
-            for uid in rejected_moves:
-                rm.write(f"{uid}\n")
+        with open(rejected_path, 'a' if append else 'w') as rm:
+            rm.write(''.join(f"{uid}\n" for uid in rejected_moves))
+    # Only advanced once both files are written: a crash before this point
+    # re-processes the same users on the next run rather than losing them.
+    save_watermark(watermark_path, *(next_mark or (None, set())))
+    metrics.add_bytes('diff_write', written=written)
+    metrics.count('users', processed)
+    metrics.flush()
 
 if __name__ == '__main__':
     main()
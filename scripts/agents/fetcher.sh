@@ -21,52 +21,38 @@ source "$ROOT_DIR/.env" 2>/dev/null || true
 
 API_TOKEN="${API_TOKEN:-}"
 BASE_URL="${API_BASE:-https://api.intra.42.fr}"
-RATE_LIMIT_DELAY="${RATE_LIMIT_DELAY:-6.0}"  # Shared across FETCHER_INSTANCES
+RATE_LIMIT_DELAY="${RATE_LIMIT_DELAY:-6.0}"  # Fallback pause if the shared bucket is unavailable
+API_RATE_PER_HOUR="${API_RATE_PER_HOUR:-1200}"  # Shared across FETCHER_INSTANCES and backlog_worker
+API_RATE_BURST="${API_RATE_BURST:-2}"
 TOKEN_HELPER="$ROOT_DIR/scripts/token_manager.sh"
+LOCATION_INDEX="$ROOT_DIR/scripts/agents/location_index.py"
+QUEUE_STORE="$ROOT_DIR/scripts/agents/queue_store.py"
+API_CLIENT="$ROOT_DIR/scripts/agents/api_client.py"
 
 # Allow overriding the source queue (default: internal queue)
 FETCH_QUEUE="${FETCH_QUEUE_FILE:-$BACKLOG_DIR/fetch_queue_internal.txt}"
 PROCESS_QUEUE="$BACKLOG_DIR/process_queue.txt"
-PROCESS_LOCK="$PROCESS_QUEUE.lock"
 
 [[ ! -f "$FETCH_QUEUE" ]] && touch "$FETCH_QUEUE"
 [[ ! -f "$PROCESS_QUEUE" ]] && touch "$PROCESS_QUEUE"
-[[ ! -f "$PROCESS_LOCK" ]] && touch "$PROCESS_LOCK"
 
-echo "[$(date -u +'%Y-%m-%dT%H:%M:%SZ')] Fetcher started on queue $(basename "$FETCH_QUEUE") (rate limit: ${RATE_LIMIT_DELAY}s per fetcher)" | tee -a "$LOG_FILE"
+echo "[$(date -u +'%Y-%m-%dT%H:%M:%SZ')] Fetcher started on queue $(basename "$FETCH_QUEUE") (rate limit: ${API_RATE_PER_HOUR} req/hour shared)" | tee -a "$LOG_FILE"
 
 COUNTER=0
 FETCH_ERRORS=0
 
-# Lock file for coordinating multiple fetchers
-LOCK_FILE="${FETCH_QUEUE}.lock"
-
 while true; do
-  # Acquire exclusive lock to safely read and modify queue
-  exec 3>"$LOCK_FILE"
-  flock -x 3 || { sleep 1; continue; }
-  
-  # Read next user ID from fetch queue
-  if ! IFS= read -r USER_ID < "$FETCH_QUEUE" 2>/dev/null; then
-    flock -u 3
-    exec 3>&-
+  # Pop the head of the fetch queue (one transaction; safe across parallel fetchers)
+  USER_ID=$(python3 "$QUEUE_STORE" pop --file "$FETCH_QUEUE" 2>/dev/null || true)
+  if [[ -z "$USER_ID" ]]; then
     sleep 5
     continue
   fi
   
-  [[ -z "$USER_ID" ]] && { flock -u 3; exec 3>&-; continue; }
-  
-  # Remove from fetch queue (atomic operation under lock)
-  tail -n +2 "$FETCH_QUEUE" > "$FETCH_QUEUE.tmp" && mv "$FETCH_QUEUE.tmp" "$FETCH_QUEUE"
-  
-  # Release lock
-  flock -u 3
-  exec 3>&-
-  
   COUNTER=$((COUNTER + 1))
   
-  # Per-fetcher independent rate limiting
-  sleep "$RATE_LIMIT_DELAY"
+  # Global rate limiting: wait for a token of the bucket shared by all fetchers
+  python3 "$API_CLIENT" --rate-per-hour "$API_RATE_PER_HOUR" --burst "$API_RATE_BURST" acquire 2>/dev/null || sleep "$RATE_LIMIT_DELAY"
   
   # Fetch user JSON from API using token manager
   echo "[$(date -u +'%Y-%m-%dT%H:%M:%SZ')] → Fetching user $USER_ID"
@@ -76,7 +62,7 @@ while true; do
   if [[ -z "$user_json" ]]; then
     echo "[$(date -u +'%Y-%m-%dT%H:%M:%SZ')] ⚠️  User $USER_ID: empty response (retrying)" | tee -a "$LOG_FILE"
     # Re-enqueue for retry
-    echo "$USER_ID" >> "$FETCH_QUEUE"
+    python3 "$QUEUE_STORE" push --file "$FETCH_QUEUE" "$USER_ID" 2>/dev/null || echo "$USER_ID" >> "$FETCH_QUEUE"
     FETCH_ERRORS=$((FETCH_ERRORS + 1))
     continue
   fi
@@ -93,18 +79,16 @@ while true; do
 	  [[ "$campus_id" == "null" ]] && campus_id=0
 	  mkdir -p "$EXPORTS_USERS/campus_${campus_id}"
 	  echo "$user_json" > "$EXPORTS_USERS/campus_${campus_id}/user_${USER_ID}.json"
+	  python3 "$LOCATION_INDEX" record --base "$EXPORTS_USERS" "$USER_ID" "$campus_id" 2>/dev/null || true
   
-  # Enqueue to process queue for upserter with simple lock
-  {
-    flock -x 5
-    echo "$USER_ID" >> "$PROCESS_QUEUE"
-  } 5>"$PROCESS_LOCK"
+  # Enqueue to process queue for upserter
+  python3 "$QUEUE_STORE" push --file "$PROCESS_QUEUE" "$USER_ID" 2>/dev/null || echo "$USER_ID" >> "$PROCESS_QUEUE"
   
   echo "[$(date -u +'%Y-%m-%dT%H:%M:%SZ')] ✓ Fetched user $USER_ID (campus $campus_id) → process_queue" | tee -a "$LOG_FILE"
   
   if [[ $((COUNTER % 20)) -eq 0 ]]; then
-    FETCH_QUEUE_SIZE=$(wc -l < "$FETCH_QUEUE" 2>/dev/null || echo "0")
-    PROCESS_QUEUE_SIZE=$(wc -l < "$PROCESS_QUEUE" 2>/dev/null || echo "0")
+    FETCH_QUEUE_SIZE=$(python3 "$QUEUE_STORE" len --file "$FETCH_QUEUE" 2>/dev/null || echo "0")
+    PROCESS_QUEUE_SIZE=$(python3 "$QUEUE_STORE" len --file "$PROCESS_QUEUE" 2>/dev/null || echo "0")
     echo "[$(date -u +'%Y-%m-%dT%H:%M:%SZ')] Stats: Fetched=$COUNTER | Errors=$FETCH_ERRORS | FetchQueue=$FETCH_QUEUE_SIZE | ProcessQueue=$PROCESS_QUEUE_SIZE" | tee -a "$LOG_FILE"
     
     # Trim log to prevent growth (every 20 iterations)
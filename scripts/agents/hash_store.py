@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Keyed, crash-safe store for detector fingerprint state.
+
+Replaces .backlog/detector_hashes.json (one JSON object holding every user's
+hash, timestamp, campus_id, fingerprint_key and snapshot, parsed and rewritten
+in full each detector cycle) with one SQLite WAL database keyed by uid.
+
+- get()/get_many() are point lookups; nothing is loaded up front.
+- set() only marks an entry dirty in memory; commit() writes the dirty entries
+  in one transaction, so a crash leaves the previous cycle's state intact.
+- Entries keep the legacy JSON shape, so callers index them as before and
+  export writes a detector_hashes.json-compatible file.
+
+The legacy JSON file is imported once per path by ensure_migrated() and left
+untouched.
+
+HashStore(path, compact=True) keeps the lookup cache in a CompactHashState
+(compact_state.py: binary digests, array columns, interned strings) instead
+of one dict per entry; get() still returns legacy-shaped dicts. The detector
+uses it so a resident cache of the whole population stays small.
+
+CLI:
+  hash_store.py migrate [--db PATH] [--json PATH]
+  hash_store.py get [--db PATH] UID [UID...]
+  hash_store.py export [--db PATH] [--out PATH]
+  hash_store.py stats [--db PATH]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from compact_state import CompactHashState
+from sqlite_store import chunked, connect, placeholders, transaction
+
+ROOT = os.environ.get("ROOT_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+
+def default_db_path(root: str) -> str:
+    return os.environ.get("HASH_DB") or os.path.join(root, ".backlog", "detector_hashes.db")
+
+
+LEGACY_JSON = os.path.join(ROOT, ".backlog", "detector_hashes.json")
+DEFAULT_DB = default_db_path(ROOT)
+
+MIGRATE_BATCH = 5000
+
+# campus_id is untyped: it is usually an int but may be whatever the API sent.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    uid INTEGER PRIMARY KEY,
+    hash TEXT,
+    timestamp REAL,
+    campus_id,
+    fingerprint_key TEXT,
+    snapshot TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+_COLUMNS = "hash, timestamp, campus_id, fingerprint_key, snapshot"
+_UPSERT = f"INSERT OR REPLACE INTO hashes (uid, {_COLUMNS}) VALUES ({placeholders(6)})"
+
+
+def _entry_to_row(uid: int, entry: Any) -> Tuple:
+    if isinstance(entry, str):
+        # Oldest format: bare hash string.
+        return (uid, entry, None, None, None, None)
+    snapshot = entry.get("snapshot")
+    return (
+        uid,
+        entry.get("hash"),
+        entry.get("timestamp"),
+        entry.get("campus_id"),
+        entry.get("fingerprint_key"),
+        json.dumps(snapshot, separators=(",", ":")) if snapshot is not None else None,
+    )
+
+
+def _row_to_entry(row: Tuple) -> Dict[str, Any]:
+    hash_value, timestamp, campus_id, fingerprint_key, snapshot = row
+    return {
+        "hash": hash_value,
+        "timestamp": timestamp,
+        "campus_id": campus_id,
+        "fingerprint_key": fingerprint_key,
+        "snapshot": json.loads(snapshot) if snapshot is not None else None,
+    }
+
+
+class HashStore:
+    def __init__(self, path: str = DEFAULT_DB, compact: bool = False):
+        self.path = path
+        self.conn = connect(path)
+        self.conn.executescript(_SCHEMA)
+        self._cache: Any = CompactHashState() if compact else {}
+        self._dirty: Dict[int, Dict[str, Any]] = {}
+
+    def __enter__(self) -> "HashStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+
+    # -- reads -------------------------------------------------------------
+    def get(self, uid) -> Optional[Dict[str, Any]]:
+        key = int(uid)
+        if key in self._cache:
+            return self._cache[key]
+        row = self.conn.execute(f"SELECT {_COLUMNS} FROM hashes WHERE uid = ?", (key,)).fetchone()
+        entry = _row_to_entry(row) if row else None
+        self._cache[key] = entry
+        return entry
+
+    def prefetch(self, uids: Iterable) -> None:
+        """Warm the lookup cache for a batch of uids with a few IN (...) queries."""
+        cache = self._cache
+        wanted = sorted({int(u) for u in uids if int(u) not in cache})
+        for chunk in chunked(wanted):
+            found = dict.fromkeys(chunk)
+            cur = self.conn.execute(
+                f"SELECT uid, {_COLUMNS} FROM hashes WHERE uid IN ({placeholders(len(chunk))})",
+                chunk,
+            )
+            for row in cur:
+                found[row[0]] = _row_to_entry(row[1:])
+            self._cache.update(found)
+
+    def get_many(self, uids: Iterable) -> Dict[str, Dict[str, Any]]:
+        """Return {str(uid): entry} for every uid that has an entry."""
+        keys = {int(u) for u in uids}
+        self.prefetch(keys)
+        return {str(k): self._cache[k] for k in keys if self._cache.get(k) is not None}
+
+    def preload(self) -> int:
+        """Load every committed entry into the lookup cache (resident callers)."""
+        cur = self.conn.execute(f"SELECT uid, {_COLUMNS} FROM hashes")
+        for row in cur:
+            if row[0] not in self._dirty:
+                self._cache[row[0]] = _row_to_entry(row[1:])
+        return len(self._cache)
+
+    @property
+    def cached(self) -> int:
+        return len(self._cache)
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Stream every committed entry in uid order."""
+        cur = self.conn.execute(f"SELECT uid, {_COLUMNS} FROM hashes ORDER BY uid")
+        for row in cur:
+            yield str(row[0]), _row_to_entry(row[1:])
+
+    # -- writes ------------------------------------------------------------
+    def set(self, uid, entry: Dict[str, Any]) -> None:
+        key = int(uid)
+        self._cache[key] = entry
+        self._dirty[key] = entry
+
+    @property
+    def dirty(self) -> int:
+        return len(self._dirty)
+
+    def commit(self) -> int:
+        """Write dirty entries in one atomic transaction."""
+        if not self._dirty:
+            return 0
+        rows = [_entry_to_row(uid, entry) for uid, entry in self._dirty.items()]
+        with transaction(self.conn) as conn:
+            conn.executemany(_UPSERT, rows)
+        self._dirty.clear()
+        return len(rows)
+
+    # -- migration / export ------------------------------------------------
+    def ensure_migrated(self, legacy_json: str = LEGACY_JSON) -> int:
+        """Import a legacy detector_hashes.json exactly once."""
+        key = f"migrated:{os.path.abspath(legacy_json)}"
+        if self.conn.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone():
+            return 0
+        imported = self.migrate_from_json(legacy_json)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            (key, json.dumps({"imported": imported, "at": time.time()})),
+        )
+        return imported
+
+    def migrate_from_json(self, legacy_json: str) -> int:
+        """Copy entries from a detector_hashes.json file; existing rows win."""
+        try:
+            with open(legacy_json, "r") as f:
+                payload = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return 0
+        if not isinstance(payload, dict):
+            return 0
+        rows = [
+            _entry_to_row(int(uid), entry)
+            for uid, entry in payload.items()
+            if uid.isdigit() and isinstance(entry, (dict, str))
+        ]
+        for start in range(0, len(rows), MIGRATE_BATCH):
+            with transaction(self.conn) as conn:
+                conn.executemany(
+                    f"INSERT OR IGNORE INTO hashes (uid, {_COLUMNS}) VALUES ({placeholders(6)})",
+                    rows[start:start + MIGRATE_BATCH],
+                )
+        return len(rows)
+
+    def export_json(self, out) -> int:
+        """Write committed entries as a detector_hashes.json object, streamed."""
+        count = 0
+        out.write("{")
+        for uid, entry in self.items():
+            if count:
+                out.write(", ")
+            out.write(f"{json.dumps(uid)}: {json.dumps(entry)}")
+            count += 1
+        out.write("}")
+        return count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="SQLite detector hash store (replaces detector_hashes.json).")
+    parser.add_argument("--db", default=DEFAULT_DB, help=f"Database path (default: {DEFAULT_DB})")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_mig = sub.add_parser("migrate", help="One-shot import of a legacy detector_hashes.json")
+    p_mig.add_argument("--json", default=LEGACY_JSON, help=f"Legacy file (default: {LEGACY_JSON})")
+    p_get = sub.add_parser("get")
+    p_get.add_argument("uids", nargs="+")
+    p_exp = sub.add_parser("export", help="Write the store as detector_hashes.json")
+    p_exp.add_argument("--out", default="-", help="Output path (default: stdout)")
+    sub.add_parser("stats")
+    args = parser.parse_args()
+
+    with HashStore(args.db) as store:
+        if args.cmd == "migrate":
+            count = store.ensure_migrated(args.json)
+            print(f"hash_store: imported {count} entries from {args.json}")
+        elif args.cmd == "get":
+            print(json.dumps(store.get_many(args.uids), indent=2))
+        elif args.cmd == "export":
+            if args.out == "-":
+                store.export_json(sys.stdout)
+                sys.stdout.write("\n")
+            else:
+                tmp = f"{args.out}.tmp.{os.getpid()}"
+                with open(tmp, "w") as f:
+                    store.export_json(f)
+                os.replace(tmp, args.out)
+        else:
+            print(json.dumps({"db": args.db, "entries": len(store)}))
+
+
+if __name__ == "__main__":
+    main()
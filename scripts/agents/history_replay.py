@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Replay cached raw_detect snapshots to rebuild history.
+
+After a detector_fields.json change, a classification fix or lost baselines,
+live cycles only repair state for users that happen to change again. This
+walks a range of .cache/raw_detect/users_<stamp>.json generations oldest
+first and rebuilds, from nothing:
+
+- events_logs.jsonl / rejected_moves.log: every generation is diffed against
+  the state the previous ones left (events_logs_generator.diff_user rules,
+  so the lines are what the generator would have written after each one);
+  the first generation of the range only seeds the state
+- detector_hashes.json: the detector's entry per user, replaced only when
+  the fingerprint changes, as detector cycles do
+- eventifier_baseline.db: the last raw snapshot seen per user
+
+Parsing (JSON decode, projection, fingerprints) is the expensive part and
+has no ordering constraint, so generations are parsed on a fork pool
+(--jobs, HISTORY_REPLAY_JOBS; 0 = all cores) while the parent diffs the ones
+already parsed, in order. Records carry only the projected fields back.
+
+Output goes to --out (default .backlog/replay/); --install then swaps it into
+the live paths (events_logs.jsonl, rejected_moves.log, detector_hashes.json
+and .db, the baseline db) and advances the events_logs watermark. Stop the
+detector and its daemon first; --install refuses while the daemon pid file
+exists. A summary with snapshots/s and users/s is printed and kept as
+replay.json.
+
+CLI:
+  history_replay.py [--dir DIR] [--from STAMP] [--to STAMP] [--jobs N] [--out DIR] [--install]
+"""
+
+import argparse
+import calendar
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from baseline_store import BaselineStore
+from baseline_store import default_db_path as default_baseline_db
+from columnar_snapshot import default_raw_dir, snapshot_files
+from compact_state import CompactHashState
+from detector_core import (
+    SNAPSHOT_FIELDS,
+    FingerprintEngine,
+    build_snapshot,
+    get_campus_id,
+    get_updated_timestamp,
+    load_detector_config,
+    raw_snapshot,
+    resolve_campus_id,
+)
+from detector_cycle import load_thresholds
+from events_logs_generator import advance_watermark, default_watermark_path, diff_user, save_watermark
+from hash_store import HashStore
+from hash_store import default_db_path as default_hash_db
+from json_stream import iter_users, projection_fields
+from metrics import Metrics
+
+ROOT = os.environ.get("ROOT_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+STAMP_FORMAT = "%Y%m%dT%H%M%SZ"
+BASELINE_BATCH = 5000
+
+# Set before the pool forks; workers inherit them.
+_ENGINE: Optional[FingerprintEngine] = None
+_FIELDS: List[str] = []
+_INTERNAL_CAMPUS_ID: Any = None
+
+
+def default_out_dir(root: str) -> str:
+    return os.environ.get("HISTORY_REPLAY_DIR") or os.path.join(root, ".backlog", "replay")
+
+
+def snapshot_stamp(path: str) -> str:
+    name = os.path.basename(path)
+    return name[len("users_"):-len(".json")]
+
+
+def snapshot_time(path: str) -> int:
+    """Generation time from the users_<stamp>.json name, else the file mtime."""
+    try:
+        return calendar.timegm(time.strptime(snapshot_stamp(path), STAMP_FORMAT))
+    except ValueError:
+        return int(os.path.getmtime(path))
+
+
+def select_snapshots(raw_dir: str, start: Optional[str], end: Optional[str]) -> List[str]:
+    """Generations whose stamp falls in [start, end] (lexical, as the names sort)."""
+    return [p for p in snapshot_files(raw_dir)
+            if (start is None or snapshot_stamp(p) >= start) and (end is None or snapshot_stamp(p) <= end)]
+
+
+def parse_snapshot(path: str) -> Tuple[str, List[Tuple[Any, ...]]]:
+    """Pool worker: (uid, slim user, resolved campus, fingerprint) per valid user of one generation.
+
+    The fingerprint key follows the campus, which may have to come from the
+    user's previous entry: users without one get an (internal, external) pair.
+    """
+    engine = _ENGINE
+    records = []
+    for user in iter_users(path, _FIELDS):
+        if not isinstance(user, dict) or user.get("label") == "error" or user.get("id") is None:
+            continue
+        campus_id = resolve_campus_id(user)
+        if campus_id is None:
+            fp: Any = (engine.internal(user), engine.external(user))
+        else:
+            fp = engine.fingerprint(user, "internal" if campus_id == _INTERNAL_CAMPUS_ID else "external")
+        slim = {k: user.get(k) for k in ("id", "updated_at", *SNAPSHOT_FIELDS)}
+        slim["campus_id"] = get_campus_id(user)
+        records.append((user["id"], slim, campus_id, fp))
+    return path, records
+
+
+class Replay:
+    def __init__(self, root: str, out_dir: str):
+        self.root = root
+        self.out_dir = out_dir
+        self.internal_campus_id = load_thresholds(root)["internal_campus_id"]
+        config = load_detector_config(root)
+        self.engine = FingerprintEngine(config)
+        self.fields = projection_fields(config["internal_fields"], config["external_fields"], SNAPSHOT_FIELDS)
+        self.baselines: Dict[int, Dict[str, Any]] = {}
+        self.hashes = CompactHashState()
+        self.watermark: Any = None
+        self.stats = {"snapshots": 0, "users": 0, "events": 0, "rejected_moves": 0, "hash_changes": 0}
+
+    def hash_entry(self, uid: int, user: Dict[str, Any], campus_id: Any, fp: Any) -> None:
+        """Detector semantics: campus falls back to the last entry, entry replaced on fingerprint change."""
+        last_hash, last_campus, _ = self.hashes.head(uid)
+        if campus_id is None:
+            campus_id = last_campus
+        if campus_id is None:
+            campus_id = self.internal_campus_id
+        fingerprint_key = "internal" if campus_id == self.internal_campus_id else "external"
+        if isinstance(fp, tuple):
+            fp = fp[0] if fingerprint_key == "internal" else fp[1]
+        if last_hash == fp:
+            return
+        self.hashes[uid] = {
+            "hash": fp,
+            "timestamp": get_updated_timestamp(user),
+            "campus_id": campus_id,
+            "fingerprint_key": fingerprint_key,
+            "snapshot": build_snapshot(user),
+        }
+        self.stats["hash_changes"] += 1
+
+    def apply(self, path: str, records: List[Tuple[Any, ...]], seed: bool, out, rejected) -> None:
+        run_ts = snapshot_time(path)
+        users = []
+        for uid, user, campus_id, fp in records:
+            self.hash_entry(uid, user, campus_id, fp)
+            baseline = self.baselines.get(uid)
+            self.baselines[uid] = raw_snapshot(user)
+            users.append(user)
+            if seed:
+                continue
+            events, changes, move_rejected = diff_user(user, baseline)
+            if not events:
+                continue
+            _, entry_campus, fingerprint_key = self.hashes.head(uid)
+            line = json.dumps({
+                "user_id": uid,
+                "user_login": user.get("login"),
+                "campus_id": user.get("campus_id") or entry_campus,
+                "updated_at": user.get("updated_at"),
+                "events": events,
+                "changes": changes,
+                "internal_external": fingerprint_key or "unknown",
+                "ts": run_ts,
+            }) + "\n"
+            out.write(line)
+            self.stats["events"] += 1
+            if move_rejected:
+                rejected.write(f"{uid}\n")
+                self.stats["rejected_moves"] += 1
+        self.watermark = advance_watermark(users, self.watermark)
+        self.stats["snapshots"] += 1
+        self.stats["users"] += len(records)
+
+    def parsed(self, paths: List[str], jobs: int):
+        """(path, records) in path order; parsed ahead on a fork pool when jobs > 1."""
+        global _ENGINE, _FIELDS, _INTERNAL_CAMPUS_ID
+        _ENGINE, _FIELDS, _INTERNAL_CAMPUS_ID = self.engine, self.fields, self.internal_campus_id
+        if jobs > 1 and len(paths) > 1:
+            with multiprocessing.get_context("fork").Pool(min(jobs, len(paths))) as pool:
+                yield from pool.imap(parse_snapshot, paths)
+        else:
+            for path in paths:
+                yield parse_snapshot(path)
+
+    def run(self, paths: List[str], jobs: int, metrics: Metrics) -> Dict[str, Any]:
+        os.makedirs(self.out_dir, exist_ok=True)
+        started = time.monotonic()
+        events_path = os.path.join(self.out_dir, "events_logs.jsonl")
+        rejected_path = os.path.join(self.out_dir, "rejected_moves.log")
+        with open(events_path, "w") as out, open(rejected_path, "w") as rejected:
+            for i, (path, records) in enumerate(metrics.timed_iter("parse_wait", self.parsed(paths, jobs))):
+                metrics.add_bytes("parse", read=os.path.getsize(path))
+                with metrics.timer("diff"):
+                    self.apply(path, records, i == 0, out, rejected)
+        with metrics.timer("state_write"):
+            self.write_hashes(os.path.join(self.out_dir, "detector_hashes.json"))
+            self.write_baselines(os.path.join(self.out_dir, "eventifier_baseline.db"))
+        elapsed = time.monotonic() - started
+        summary = dict(self.stats)
+        summary.update({
+            "from": snapshot_stamp(paths[0]),
+            "to": snapshot_stamp(paths[-1]),
+            "jobs": jobs,
+            "seconds": round(elapsed, 3),
+            "snapshots_per_s": round(self.stats["snapshots"] / elapsed, 2) if elapsed else None,
+            "users_per_s": round(self.stats["users"] / elapsed) if elapsed else None,
+            "hash_entries": len(self.hashes),
+            "baselines": len(self.baselines),
+            "watermark": self.watermark[0] if self.watermark else None,
+        })
+        with open(os.path.join(self.out_dir, "replay.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        for name in ("snapshots", "users", "events"):
+            metrics.count(name, self.stats[name])
+        return summary
+
+    def write_hashes(self, path: str) -> None:
+        """detector_hashes.json in HashStore.export_json()'s layout (uid order)."""
+        tmp = f"{path}.tmp.{os.getpid()}"
+        with open(tmp, "w") as f:
+            f.write("{")
+            for i, uid in enumerate(sorted(self.hashes)):
+                if i:
+                    f.write(", ")
+                f.write(f"{json.dumps(str(uid))}: {json.dumps(self.hashes[uid])}")
+            f.write("}")
+        os.replace(tmp, path)
+
+    def write_baselines(self, path: str) -> None:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+        items = sorted(self.baselines.items())
+        with BaselineStore(path) as store:
+            for start in range(0, len(items), BASELINE_BATCH):
+                store.put_many(items[start:start + BASELINE_BATCH])
+
+
+def _replace_db(src: str, dest: str) -> None:
+    """Move a closed SQLite database over dest, dropping dest's WAL files first."""
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(dest + suffix):
+            os.unlink(dest + suffix)
+    os.replace(src, dest)
+
+
+def install(root: str, out_dir: str, watermark: Optional[Tuple[float, set]]) -> None:
+    """Swap the replay output into the live paths."""
+    backlog = os.path.join(root, ".backlog")
+    for name in ("events_logs.jsonl", "rejected_moves.log"):
+        tmp = os.path.join(backlog, f".{name}.replay")
+        shutil.copyfile(os.path.join(out_dir, name), tmp)
+        os.replace(tmp, os.path.join(backlog, name))
+
+    # The hash db is rebuilt from the replayed json and marked as migrated from it.
+    hash_json = os.path.join(backlog, "detector_hashes.json")
+    shutil.copyfile(os.path.join(out_dir, "detector_hashes.json"), hash_json + ".replay")
+    os.replace(hash_json + ".replay", hash_json)
+    hash_db = default_hash_db(root)
+    tmp_db = hash_db + ".replay"
+    if os.path.exists(tmp_db):
+        os.unlink(tmp_db)
+    with HashStore(tmp_db) as store:
+        store.ensure_migrated(hash_json)
+    _replace_db(tmp_db, hash_db)
+
+    baseline_db = default_baseline_db(root)
+    tmp_db = baseline_db + ".replay"
+    shutil.copyfile(os.path.join(out_dir, "eventifier_baseline.db"), tmp_db)
+    _replace_db(tmp_db, baseline_db)
+
+    if watermark:
+        save_watermark(default_watermark_path(root), *watermark)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay raw_detect snapshots into fresh events logs, hashes and baselines.")
+    parser.add_argument("--dir", default=default_raw_dir(ROOT), help="Snapshot directory (default: .cache/raw_detect)")
+    parser.add_argument("--from", dest="start", help="First stamp (users_<stamp>.json), inclusive")
+    parser.add_argument("--to", dest="end", help="Last stamp, inclusive")
+    parser.add_argument("--jobs", type=int, default=int(os.environ.get("HISTORY_REPLAY_JOBS", "0")),
+                        help="Parser processes (0 = all cores)")
+    parser.add_argument("--out", default=default_out_dir(ROOT), help="Output directory (default: .backlog/replay)")
+    parser.add_argument("--install", action="store_true", help="Swap the output into the live state files")
+    args = parser.parse_args()
+    jobs = args.jobs or os.cpu_count() or 1
+
+    if args.install and os.path.exists(os.path.join(ROOT, ".backlog", "detector_daemon.pid")):
+        sys.exit("history_replay: detector daemon is running (.backlog/detector_daemon.pid); stop it before --install")
+    paths = select_snapshots(args.dir, args.start, args.end)
+    if not paths:
+        sys.exit(f"history_replay: no users_*.json in range under {args.dir}")
+    metrics = Metrics("history_replay", ROOT)
+    replay = Replay(ROOT, args.out)
+    summary = replay.run(paths, jobs, metrics)
+    if args.install:
+        install(ROOT, args.out, replay.watermark)
+        summary["installed"] = True
+    metrics.flush()
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
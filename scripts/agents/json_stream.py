@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Streaming readers for user payloads (users_latest.json, raw_detect snapshots).
+
+A window/resync payload is either a top-level JSON array (what the API and the
+cache files hold) or JSONL (one user per line, what
+fetch_users_by_updated_at_window.sh writes with OUTPUT_FORMAT=jsonl). Both are
+read incrementally: only one decoded user is alive at a time, and iter_users()
+projects each user down to the fields the detector fingerprints, so peak memory
+no longer grows with the window size.
+"""
+
+import json
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+CHUNK_SIZE = 1 << 16
+
+# Fields every consumer needs besides the configured fingerprint fields.
+BASE_FIELDS = ("id", "login", "updated_at", "label")
+
+_decoder = json.JSONDecoder()
+_WS = " \t\r\n"
+_NUMBER_CHARS = "0123456789+-.eE"
+
+
+def _open(source: Union[str, IO[str]]) -> IO[str]:
+    if isinstance(source, str):
+        return open(source, "r", encoding="utf-8")
+    return source
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _skip_ws(buf: str, pos: int) -> int:
+    while pos < len(buf) and buf[pos] in _WS:
+        pos += 1
+    return pos
+
+
+def iter_array(fh: IO[str], chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """Yield the elements of a top-level JSON array one at a time."""
+    buf = ""
+    pos = 0
+    eof = False
+
+    def fill(size: int = chunk_size) -> None:
+        nonlocal buf, pos, eof
+        more = fh.read(size)
+        if not more:
+            eof = True
+        buf = buf[pos:] + more
+        pos = 0
+
+    while True:
+        pos = _skip_ws(buf, pos)
+        if pos < len(buf) or eof:
+            break
+        fill()
+    if pos >= len(buf):
+        return
+    if buf[pos] != "[":
+        raise ValueError("expected a JSON array")
+    pos += 1
+    expect_value = True
+    while True:
+        pos = _skip_ws(buf, pos)
+        if pos >= len(buf):
+            if eof:
+                raise ValueError("unterminated JSON array")
+            fill()
+            continue
+        ch = buf[pos]
+        if ch == "]":
+            return
+        if ch == ",":
+            if expect_value:
+                raise ValueError("unexpected ',' in JSON array")
+            pos += 1
+            expect_value = True
+            continue
+        try:
+            value, end = _decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill(max(chunk_size, len(buf) - pos))
+            continue
+        # A value touching the end of the buffer may be cut short: pull more
+        # and decode it again. A number also decodes from a prefix cut right
+        # after "." or "e" ("0." -> 0), so it needs a non-number character
+        # after it before it counts as complete.
+        if not eof and (_skip_ws(buf, end) >= len(buf)
+                        or (_is_number(value) and (end >= len(buf) or buf[end] in _NUMBER_CHARS))):
+            fill(max(chunk_size, len(buf) - pos))
+            continue
+        yield value
+        pos = end
+        expect_value = False
+
+
+def iter_jsonl(fh: IO[str]) -> Iterator[Any]:
+    for line in fh:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            continue
+
+
+def iter_records(source: Union[str, IO[str]], chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """Yield records from a JSON array or JSONL file, detected from the first byte."""
+    fh = _open(source)
+    try:
+        head = ""
+        while True:
+            ch = fh.read(1)
+            if not ch or ch not in _WS:
+                head = ch
+                break
+        if not head:
+            return
+        if head == "[":
+            yield from iter_array(_Prefixed(head, fh), chunk_size)
+        else:
+            yield from iter_jsonl(_Prefixed(head, fh))
+    finally:
+        if isinstance(source, str):
+            fh.close()
+
+
+class _Prefixed:
+    """File wrapper that replays the sniffed first character."""
+
+    def __init__(self, head: str, fh: IO[str]):
+        self.head = head
+        self.fh = fh
+
+    def read(self, size: int = -1) -> str:
+        head, self.head = self.head, ""
+        if size is not None and size >= 0:
+            return head + self.fh.read(max(size - len(head), 0))
+        return head + self.fh.read()
+
+    def __iter__(self) -> Iterator[str]:
+        head, self.head = self.head, ""
+        first = head + self.fh.readline()
+        if first:
+            yield first
+        yield from self.fh
+
+
+def project_user(user: Dict[str, Any], fields: Iterable[str]) -> Dict[str, Any]:
+    """Keep only fingerprint/identity fields plus the campus hints get_campus_id() reads."""
+    out = {k: user[k] for k in fields if k in user}
+    campus_users = user.get("campus_users")
+    if isinstance(campus_users, list):
+        out["campus_users"] = [
+            {"campus_id": cu.get("campus_id"), "is_primary": cu.get("is_primary")}
+            for cu in campus_users
+            if isinstance(cu, dict)
+        ]
+    campus_list = user.get("campus")
+    if isinstance(campus_list, list):
+        out["campus"] = [{"id": c.get("id")} for c in campus_list if isinstance(c, dict)]
+    return out
+
+
+def projection_fields(*field_lists: Sequence[str]) -> List[str]:
+    seen: Dict[str, None] = dict.fromkeys(BASE_FIELDS)
+    for fields in field_lists:
+        for field in fields:
+            seen.setdefault(field)
+    return list(seen)
+
+
+def iter_users(
+    source: Union[str, IO[str]],
+    fields: Optional[Sequence[str]] = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[Any]:
+    """Stream users from a payload; with fields, each dict is projected down to them."""
+    for record in iter_records(source, chunk_size):
+        if fields is not None and isinstance(record, dict):
+            yield project_user(record, fields)
+        else:
+            yield record
+
+
+def batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    batch: List[Any] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
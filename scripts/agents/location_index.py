@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Persistent uid -> campus location index for campus-sharded user directories.
+
+exports/09_users and .eventifier_baseline both store one file per user under
+<base>/campus_<id>/user_<uid>.json. Finding a user whose campus is unknown used
+to cost one glob over every campus directory per lookup; this index keeps
+uid -> (campus, relative path, mtime) on disk so readers load it once.
+
+Files kept in <base>:
+- .location_index.json     compacted index (users + observed campus dir mtimes)
+- .location_index.journal  append-only "uid<TAB>campus<TAB>relpath<TAB>mtime" lines
+                           written by agents right after they write a user file
+- .location_index.lock     flock guarding compaction and journal appends
+
+Staleness: any campus_* directory whose mtime differs from the recorded one
+(file created/removed/renamed) is rescanned on refresh(), new directories are
+scanned and vanished ones dropped. When a uid shows up under several campuses
+the most recently modified file wins.
+
+CLI:
+  location_index.py lookup --base DIR UID [UID...]   -> "uid campus path" per hit
+  location_index.py serve  --base DIR                -> same, one uid per stdin line
+                                                        (a miss answers the bare uid)
+  location_index.py record --base DIR UID CAMPUS
+  location_index.py rebuild --base DIR
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import sys
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+INDEX_FILE = ".location_index.json"
+JOURNAL_FILE = ".location_index.journal"
+LOCK_FILE = ".location_index.lock"
+CAMPUS_PREFIX = "campus_"
+INDEX_VERSION = 1
+# Lookup misses trigger at most one catch-up refresh per interval.
+MISS_REFRESH_INTERVAL = 1.0
+
+# uid -> [campus_id, relpath, mtime]
+Entry = List
+
+
+def user_relpath(campus_id, uid) -> str:
+    return os.path.join(f"{CAMPUS_PREFIX}{campus_id}", f"user_{uid}.json")
+
+
+def _parse_campus(name: str):
+    raw = name[len(CAMPUS_PREFIX):]
+    try:
+        return int(raw)
+    except ValueError:
+        return raw
+
+
+def _parse_uid(name: str) -> Optional[str]:
+    if not (name.startswith("user_") and name.endswith(".json")):
+        return None
+    uid = name[5:-5]
+    return uid if uid.isdigit() else None
+
+
+class LocationIndex:
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        self.index_path = os.path.join(base_dir, INDEX_FILE)
+        self.journal_path = os.path.join(base_dir, JOURNAL_FILE)
+        self.lock_path = os.path.join(base_dir, LOCK_FILE)
+        self.users: Dict[str, Entry] = {}
+        self.dirs: Dict[str, int] = {}
+        self.rescanned = 0
+        self._loaded = False
+        self._refreshed_at = 0.0
+
+    # -- loading -----------------------------------------------------------
+    def _load_index(self) -> None:
+        try:
+            with open(self.index_path, "r") as f:
+                payload = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        if not isinstance(payload, dict) or payload.get("version") != INDEX_VERSION:
+            return
+        self.users = payload.get("users") or {}
+        self.dirs = payload.get("dirs") or {}
+
+    def _replay_journal(self) -> int:
+        try:
+            with open(self.journal_path, "r") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return 0
+        applied = 0
+        for line in lines:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) != 4 or not parts[0].isdigit():
+                continue
+            uid, campus, relpath, mtime = parts
+            try:
+                mtime_f = float(mtime)
+            except ValueError:
+                mtime_f = 0.0
+            self._merge(uid, [_parse_campus(CAMPUS_PREFIX + campus), relpath, mtime_f])
+            applied += 1
+        return applied
+
+    def _merge(self, uid: str, entry: Entry) -> None:
+        current = self.users.get(uid)
+        if current is None or current[1] == entry[1] or entry[2] >= current[2]:
+            self.users[uid] = entry
+
+    def _scan_dir(self, name: str) -> None:
+        campus_id = _parse_campus(name)
+        prefix = name + os.sep
+        for uid, entry in list(self.users.items()):
+            if entry[1].startswith(prefix):
+                del self.users[uid]
+        try:
+            it = os.scandir(os.path.join(self.base_dir, name))
+        except FileNotFoundError:
+            return
+        with it:
+            for dent in it:
+                uid = _parse_uid(dent.name)
+                if uid is None:
+                    continue
+                try:
+                    mtime = dent.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                self._merge(uid, [campus_id, prefix + dent.name, mtime])
+        self.rescanned += 1
+
+    def _campus_dirs(self) -> Dict[str, int]:
+        found: Dict[str, int] = {}
+        try:
+            it = os.scandir(self.base_dir)
+        except FileNotFoundError:
+            return found
+        with it:
+            for dent in it:
+                if dent.name.startswith(CAMPUS_PREFIX) and dent.is_dir():
+                    found[dent.name] = dent.stat().st_mtime_ns
+        return found
+
+    def refresh(self) -> "LocationIndex":
+        """Load the index, fold in the journal and rescan stale campus dirs."""
+        os.makedirs(self.base_dir, exist_ok=True)
+        with open(self.lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not self._loaded:
+                self._load_index()
+                self._loaded = True
+            current = self._campus_dirs()
+            stale = [name for name, mtime in current.items() if self.dirs.get(name) != mtime]
+            vanished = [name for name in self.dirs if name not in current]
+            for name in vanished:
+                prefix = name + os.sep
+                for uid, entry in list(self.users.items()):
+                    if entry[1].startswith(prefix):
+                        del self.users[uid]
+            for name in sorted(stale):
+                self._scan_dir(name)
+            replayed = self._replay_journal()
+            self.dirs = current
+            if stale or vanished or replayed or not os.path.isfile(self.index_path):
+                self._save()
+                if replayed:
+                    open(self.journal_path, "w").close()
+        self._refreshed_at = time.monotonic()
+        return self
+
+    def rebuild(self) -> "LocationIndex":
+        self.users = {}
+        self.dirs = {}
+        self._loaded = True
+        try:
+            os.unlink(self.index_path)
+        except FileNotFoundError:
+            pass
+        return self.refresh()
+
+    def _save(self) -> None:
+        tmp = f"{self.index_path}.tmp.{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump(
+                {"version": INDEX_VERSION, "dirs": self.dirs, "users": self.users},
+                f,
+                separators=(",", ":"),
+            )
+        os.replace(tmp, self.index_path)
+
+    # -- reads -------------------------------------------------------------
+    def lookup(self, uid) -> Optional[Tuple[object, str]]:
+        """Return (campus_id, absolute path) for uid, or None."""
+        entry = self.users.get(str(uid))
+        if entry is None:
+            return None
+        return entry[0], os.path.join(self.base_dir, entry[1])
+
+    def path_for(self, uid, refresh: bool = True) -> Optional[str]:
+        hit = self.lookup(uid)
+        if hit is not None and os.path.isfile(hit[1]):
+            return hit[1]
+        if not refresh or time.monotonic() - self._refreshed_at < MISS_REFRESH_INTERVAL:
+            return None
+        # Missing or moved since the last refresh: one stat per campus dir to catch up.
+        self.refresh()
+        hit = self.lookup(uid)
+        if hit and os.path.isfile(hit[1]):
+            return hit[1]
+        return None
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    # -- writes ------------------------------------------------------------
+    def record(self, uid, campus_id, mtime: Optional[float] = None) -> None:
+        uid_str = str(uid)
+        relpath = user_relpath(campus_id, uid_str)
+        if mtime is None:
+            mtime = time.time()
+        self._merge(uid_str, [campus_id, relpath, mtime])
+        append_journal(self.base_dir, [(uid_str, campus_id, relpath, mtime)])
+
+
+def append_journal(base_dir: str, rows: Iterable[Tuple[str, object, str, float]]) -> None:
+    lines = "".join(f"{uid}\t{campus}\t{relpath}\t{mtime:.6f}\n" for uid, campus, relpath, mtime in rows)
+    if not lines:
+        return
+    # Same lock as refresh(): it replays then truncates the journal, and a row
+    # appended in between would be lost.
+    os.makedirs(base_dir, exist_ok=True)
+    with open(os.path.join(base_dir, LOCK_FILE), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with open(os.path.join(base_dir, JOURNAL_FILE), "a") as f:
+            f.write(lines)
+
+
+def record_location(base_dir: str, uid, campus_id) -> None:
+    """Writer hook: note that <base>/campus_<campus_id>/user_<uid>.json was just written."""
+    append_journal(base_dir, [(str(uid), campus_id, user_relpath(campus_id, uid), time.time())])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="uid -> campus location index for campus_* user directories.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    for name in ("lookup", "serve", "record", "rebuild", "stats"):
+        p = sub.add_parser(name)
+        p.add_argument("--base", required=True, help="Directory holding campus_<id>/user_<uid>.json files")
+        if name == "lookup":
+            p.add_argument("uids", nargs="+")
+        elif name == "record":
+            p.add_argument("uid")
+            p.add_argument("campus")
+    args = parser.parse_args()
+
+    if args.cmd == "record":
+        record_location(args.base, args.uid, _parse_campus(CAMPUS_PREFIX + args.campus))
+        return
+
+    index = LocationIndex(args.base)
+    if args.cmd == "rebuild":
+        index.rebuild()
+        print(f"location_index: {len(index)} users in {len(index.dirs)} campus dirs")
+        return
+    index.refresh()
+    if args.cmd == "stats":
+        print(json.dumps({"users": len(index), "dirs": len(index.dirs), "rescanned": index.rescanned}))
+        return
+    if args.cmd == "lookup":
+        for uid in args.uids:
+            path = index.path_for(uid)
+            if path:
+                print(f"{uid} {index.users[uid][0]} {path}")
+        return
+    # serve: answer one lookup per stdin line. Every reply starts with the uid
+    # asked for (bare uid when not found), so a client that timed out can tell
+    # a late reply from the one it is waiting for.
+    for line in sys.stdin:
+        uid = line.strip()
+        path = index.path_for(uid) if uid else None
+        if path:
+            sys.stdout.write(f"{uid} {index.users[uid][0]} {path}\n")
+        else:
+            sys.stdout.write(f"{uid}\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
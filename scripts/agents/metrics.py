@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Lightweight stage instrumentation shared by the pipeline scripts.
+
+A component (detector, eventifier, detector_feed_events, events_logs_generator,
+classify_events) creates one Metrics object and records:
+
+- stage timers: `with metrics.timer("fingerprint"): ...` observes one duration
+  into a per-stage histogram; timed_iter() charges the time spent producing each
+  item of an iterator (JSON decoding) to a stage.
+- lock waits: metrics.flock(fh, "events_queue") takes an exclusive flock and
+  records how long it blocked.
+- bytes read/written per stage and plain item counters (users, events).
+
+flush() merges the run into a cumulative per-component state
+(.backlog/metrics/<component>.json, updated under flock), rewrites the
+Prometheus textfile next to it (<component>.prom, node_exporter textfile
+collector format) and appends one summary line to a rolling JSONL
+(logs/metrics.jsonl, rotated to .1 past METRICS_JSONL_MAX_BYTES). Long-running
+callers can flush() repeatedly; each flush starts a new interval.
+
+Set METRICS_DISABLE=1 to skip all file output; recording stays in memory.
+METRICS_DIR / METRICS_JSONL override the output paths.
+
+CLI:
+  metrics.py summary [--dir DIR]       last-run stage latency per component
+  metrics.py show COMPONENT [--dir DIR]
+"""
+
+import argparse
+import bisect
+import fcntl
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+ROOT = os.environ.get("ROOT_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+JSONL_MAX_BYTES = int(os.environ.get("METRICS_JSONL_MAX_BYTES", str(5 << 20)))
+
+T = TypeVar("T")
+
+
+def default_metrics_dir(root: str) -> str:
+    return os.environ.get("METRICS_DIR") or os.path.join(root, ".backlog", "metrics")
+
+
+def default_jsonl_path(root: str) -> str:
+    return os.environ.get("METRICS_JSONL") or os.path.join(root, "logs", "metrics.jsonl")
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count", "max")
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+            "sum": self.sum,
+            "count": self.count,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Histogram":
+        hist = cls(data.get("buckets") or DEFAULT_BUCKETS)
+        counts = data.get("counts") or []
+        if len(counts) == len(hist.counts):
+            hist.counts = [int(c) for c in counts]
+            hist.sum = float(data.get("sum") or 0.0)
+            hist.count = int(data.get("count") or 0)
+            hist.max = float(data.get("max") or 0.0)
+        return hist
+
+    def merge(self, other: "Histogram") -> None:
+        if other.buckets != self.buckets:
+            # Bucket layout changed: restart the cumulative series.
+            self.__init__(other.buckets)
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.sum += other.sum
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile (max for +Inf)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank and c:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def brief(self) -> Dict[str, Any]:
+        return {"count": self.count, "sum": round(self.sum, 6), "max": round(self.max, 6)}
+
+
+class Timer:
+    """Reusable context manager observing into one histogram (not re-entrant)."""
+
+    __slots__ = ("hist", "start")
+
+    def __init__(self, hist: Histogram):
+        self.hist = hist
+        self.start = 0.0
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.hist.observe(time.perf_counter() - self.start)
+
+
+class Metrics:
+    def __init__(self, component: str, root: str = ROOT, enabled: Optional[bool] = None):
+        self.component = component
+        self.root = root
+        if enabled is None:
+            enabled = os.environ.get("METRICS_DISABLE", "").lower() not in ("1", "true", "yes")
+        self.enabled = enabled
+        self.dir = default_metrics_dir(root)
+        self.jsonl_path = default_jsonl_path(root)
+        self._reset()
+
+    def _reset(self) -> None:
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self.stages: Dict[str, Histogram] = {}
+        self.locks: Dict[str, Histogram] = {}
+        self.io: Dict[str, Dict[str, int]] = {}
+        self.items: Dict[str, int] = {}
+        self._timers: Dict[str, Timer] = {}
+
+    # -- recording ---------------------------------------------------------
+    def stage(self, name: str) -> Histogram:
+        hist = self.stages.get(name)
+        if hist is None:
+            hist = self.stages[name] = Histogram()
+        return hist
+
+    def timer(self, name: str) -> Timer:
+        timer = self._timers.get(name)
+        if timer is None:
+            timer = self._timers[name] = Timer(self.stage(name))
+        return timer
+
+    def observe(self, name: str, seconds: float) -> None:
+        self.stage(name).observe(seconds)
+
+    def timed_iter(self, name: str, iterable: Iterable[T]) -> Iterator[T]:
+        """Yield from iterable, observing the time each item took to produce."""
+        hist = self.stage(name)
+        it = iter(iterable)
+        clock = time.perf_counter
+        while True:
+            start = clock()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            hist.observe(clock() - start)
+            yield item
+
+    def flock(self, fh, name: str, mode: int = fcntl.LOCK_EX) -> None:
+        start = time.perf_counter()
+        fcntl.flock(fh, mode)
+        hist = self.locks.get(name)
+        if hist is None:
+            hist = self.locks[name] = Histogram()
+        hist.observe(time.perf_counter() - start)
+
+    def add_bytes(self, stage: str, read: int = 0, written: int = 0) -> None:
+        entry = self.io.setdefault(stage, {"read": 0, "written": 0})
+        entry["read"] += read
+        entry["written"] += written
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.items[name] = self.items.get(name, 0) + n
+
+    # -- output ------------------------------------------------------------
+    def run_record(self) -> Dict[str, Any]:
+        return {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "component": self.component,
+            "pid": os.getpid(),
+            "duration": round(time.perf_counter() - self._t0, 6),
+            "stages": {name: h.brief() for name, h in self.stages.items()},
+            "locks": {name: h.brief() for name, h in self.locks.items()},
+            "io": self.io,
+            "items": self.items,
+        }
+
+    def flush(self) -> bool:
+        """Merge this interval into the cumulative state and write outputs."""
+        if not self.enabled:
+            return False
+        record = self.run_record()
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            state_path = os.path.join(self.dir, f"{self.component}.json")
+            with open(f"{state_path}.lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                state = self._merge_state(load_state(state_path), record)
+                _atomic_write(state_path, json.dumps(state))
+                _atomic_write(os.path.join(self.dir, f"{self.component}.prom"), render_prometheus(state))
+            self._append_jsonl(record)
+        except OSError:
+            return False
+        finally:
+            self._reset()
+        return True
+
+    def _merge_state(self, state: Dict[str, Any], record: Dict[str, Any]) -> Dict[str, Any]:
+        for key, source in (("stages", self.stages), ("locks", self.locks)):
+            merged = state.setdefault(key, {})
+            for name, hist in source.items():
+                cumulative = Histogram.from_dict(merged.get(name) or {"buckets": hist.buckets})
+                cumulative.merge(hist)
+                merged[name] = cumulative.to_dict()
+        io = state.setdefault("io", {})
+        for stage, entry in self.io.items():
+            total = io.setdefault(stage, {"read": 0, "written": 0})
+            total["read"] += entry["read"]
+            total["written"] += entry["written"]
+        items = state.setdefault("items", {})
+        for name, n in self.items.items():
+            items[name] = items.get(name, 0) + n
+        state["component"] = self.component
+        state["runs"] = int(state.get("runs") or 0) + 1
+        state["updated_at"] = time.time()
+        state["last_run"] = record
+        return state
+
+    def _append_jsonl(self, record: Dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.jsonl_path)), exist_ok=True)
+        try:
+            if os.path.getsize(self.jsonl_path) > JSONL_MAX_BYTES:
+                os.replace(self.jsonl_path, f"{self.jsonl_path}.1")
+        except OSError:
+            pass
+        with open(self.jsonl_path, "a") as fh:
+            fh.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+
+def _atomic_write(path: str, text: str) -> None:
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "w") as fh:
+        fh.write(text)
+    os.replace(tmp, path)
+
+
+def load_state(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r") as fh:
+            state = json.load(fh)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return state if isinstance(state, dict) else {}
+
+
+def _labels(**labels: Any) -> str:
+    parts = []
+    for key, value in labels.items():
+        text = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{text}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _fmt(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _render_histogram(lines: List[str], name: str, hist: Dict[str, Any], **labels: Any) -> None:
+    cumulative = 0
+    buckets = list(hist.get("buckets") or [])
+    counts = list(hist.get("counts") or [])
+    for i, bound in enumerate(buckets + ["+Inf"]):
+        cumulative += counts[i] if i < len(counts) else 0
+        le = bound if isinstance(bound, str) else _fmt(float(bound))
+        lines.append(f"{name}_bucket{_labels(**labels, le=le)} {cumulative}")
+    lines.append(f"{name}_sum{_labels(**labels)} {_fmt(float(hist.get('sum') or 0.0))}")
+    lines.append(f"{name}_count{_labels(**labels)} {int(hist.get('count') or 0)}")
+
+
+def render_prometheus(state: Dict[str, Any]) -> str:
+    component = state.get("component", "unknown")
+    last = state.get("last_run") or {}
+    lines = [
+        "# HELP pipeline_stage_seconds Duration of one stage invocation.",
+        "# TYPE pipeline_stage_seconds histogram",
+    ]
+    for stage, hist in sorted((state.get("stages") or {}).items()):
+        _render_histogram(lines, "pipeline_stage_seconds", hist, component=component, stage=stage)
+    lines += [
+        "# HELP pipeline_stage_last_run_seconds Total time spent in a stage during the last run.",
+        "# TYPE pipeline_stage_last_run_seconds gauge",
+    ]
+    for stage, brief in sorted((last.get("stages") or {}).items()):
+        lines.append(f"pipeline_stage_last_run_seconds{_labels(component=component, stage=stage)} {_fmt(float(brief['sum']))}")
+    lines += [
+        "# HELP pipeline_lock_wait_seconds Time spent waiting for a lock.",
+        "# TYPE pipeline_lock_wait_seconds histogram",
+    ]
+    for lock, hist in sorted((state.get("locks") or {}).items()):
+        _render_histogram(lines, "pipeline_lock_wait_seconds", hist, component=component, lock=lock)
+    lines += [
+        "# HELP pipeline_io_bytes_total Bytes read/written per stage.",
+        "# TYPE pipeline_io_bytes_total counter",
+    ]
+    for stage, entry in sorted((state.get("io") or {}).items()):
+        for direction in ("read", "written"):
+            labels = _labels(component=component, stage=stage, direction=direction)
+            lines.append(f"pipeline_io_bytes_total{labels} {int(entry.get(direction) or 0)}")
+    lines += [
+        "# HELP pipeline_items_total Items processed (users, events, ...).",
+        "# TYPE pipeline_items_total counter",
+    ]
+    for name, n in sorted((state.get("items") or {}).items()):
+        lines.append(f"pipeline_items_total{_labels(component=component, item=name)} {int(n)}")
+    lines += [
+        "# HELP pipeline_runs_total Flushed runs (intervals for long-running components).",
+        "# TYPE pipeline_runs_total counter",
+        f"pipeline_runs_total{_labels(component=component)} {int(state.get('runs') or 0)}",
+        "# HELP pipeline_last_run_duration_seconds Wall time of the last run.",
+        "# TYPE pipeline_last_run_duration_seconds gauge",
+        f"pipeline_last_run_duration_seconds{_labels(component=component)} {_fmt(float(last.get('duration') or 0.0))}",
+        "# HELP pipeline_last_run_timestamp_seconds Unix time of the last flush.",
+        "# TYPE pipeline_last_run_timestamp_seconds gauge",
+        f"pipeline_last_run_timestamp_seconds{_labels(component=component)} {_fmt(float(state.get('updated_at') or 0.0))}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def summarize(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Per-stage last-run total plus cumulative mean/p95 (ms), for dashboards."""
+    last = state.get("last_run") or {}
+    last_stages = last.get("stages") or {}
+    stages = {}
+    for name, data in sorted((state.get("stages") or {}).items()):
+        hist = Histogram.from_dict(data)
+        p95 = hist.quantile(0.95)
+        stages[name] = {
+            "last_run_seconds": (last_stages.get(name) or {}).get("sum"),
+            "mean_ms": round(hist.sum / hist.count * 1000, 3) if hist.count else None,
+            "p95_ms": round(p95 * 1000, 3) if p95 is not None else None,
+            "count": hist.count,
+        }
+    locks = {
+        name: round(Histogram.from_dict(data).sum, 6) for name, data in sorted((state.get("locks") or {}).items())
+    }
+    return {
+        "component": state.get("component"),
+        "runs": state.get("runs", 0),
+        "last_run_at": last.get("ts"),
+        "last_run_seconds": last.get("duration"),
+        "stages": stages,
+        "lock_wait_seconds_total": locks,
+        "items": last.get("items") or {},
+    }
+
+
+def iter_states(metrics_dir: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    try:
+        names = sorted(os.listdir(metrics_dir))
+    except OSError:
+        return
+    for name in names:
+        if name.endswith(".json"):
+            state = load_state(os.path.join(metrics_dir, name))
+            if state:
+                yield name[: -len(".json")], state
+
+
+def main() -> None:
+    default_dir = default_metrics_dir(ROOT)
+    parser = argparse.ArgumentParser(description="Pipeline stage metrics (textfile + JSONL).")
+    parser.add_argument("--dir", default=default_dir, help=f"Metrics directory (default: {default_dir})")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("summary", help="Last-run stage latency per component")
+    p_show = sub.add_parser("show", help="Summary of one component as JSON")
+    p_show.add_argument("component")
+    args = parser.parse_args()
+
+    if args.cmd == "show":
+        print(json.dumps(summarize(load_state(os.path.join(args.dir, f"{args.component}.json"))), indent=2))
+        return
+    found = False
+    for component, state in iter_states(args.dir):
+        found = True
+        summary = summarize(state)
+        print(f"- {component}: last run {summary['last_run_at']} ({summary['last_run_seconds']}s, runs={summary['runs']})")
+        for stage, s in summary["stages"].items():
+            last_run = s["last_run_seconds"]
+            last_txt = f"{last_run:.3f}s" if isinstance(last_run, (int, float)) else "-"
+            print(f"    {stage:<18} last={last_txt:<9} mean={s['mean_ms']}ms p95<={s['p95_ms']}ms n={s['count']}")
+        for lock, waited in summary["lock_wait_seconds_total"].items():
+            print(f"    lock {lock:<13} waited={waited:.3f}s total")
+    if not found:
+        print(f"(no metrics in {args.dir})")
+
+
+if __name__ == "__main__":
+    main()
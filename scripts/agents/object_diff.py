@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Structural diff of full user exports (exports/09_users) into change records.
+
+The eventifier's build_changes() only compares the six SNAPSHOT_FIELDS, so
+project and achievement changes never reach events_queue.jsonl. This diffs
+whole objects and emits the {"path", "old", "new"} records classify_event()
+dispatches on:
+
+  location                          scalar field
+  image.versions.large              nested object (dot-joined)
+  projects_users[3].status          array element field
+  achievements[12]                  element added (old None) / removed (new None)
+
+Arrays are matched by a stable element key rather than position:
+KEYED_ARRAYS names it for the known top-level arrays (projects_users by
+project.id, achievements by id, ...); any other array whose elements all carry
+a unique "id" is keyed by it, the rest compare positionally. The [N] in a
+path is the element's position in the new array, so reordering alone
+produces no change. Removed elements are numbered after the new array's
+last position (len(new), len(new) + 1, ... in old order): classify_event()
+groups changes by N, so a removal must not share one with a surviving
+element.
+
+Unchanged subtrees are skipped by digest: a Summary holds one blake2b digest
+per top-level field and per keyed-array element (computed over canonical JSON,
+i.e. at C speed). diff() only walks fields / elements whose digests differ,
+so the Python-level work follows what changed, not the object size.
+ObjectCache keeps each user's last Summary and object (zlib) in
+.backlog/object_cache.db; ObjectDiffer.observe() diffs a new export against
+it, decoding the cached object only when the root digests differ.
+
+CLI:
+  object_diff.py diff OLD.json NEW.json [--summary]
+  object_diff.py observe [--cache PATH] UID EXPORT.json   diff against the cache, then update it
+  object_diff.py stats [--cache PATH]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlite_store import connect, transaction
+
+ROOT = os.environ.get("ROOT_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+DIGEST_SIZE = 16
+# Element key (a path inside the element) per top-level array.
+KEYED_ARRAYS: Dict[str, Tuple[str, ...]] = {
+    "projects_users": ("project", "id"),
+    "achievements": ("id",),
+    "cursus_users": ("cursus_id",),
+    "campus_users": ("campus_id",),
+    "languages_users": ("language_id",),
+    "titles_users": ("title_id",),
+    "expertises_users": ("expertise_id",),
+}
+DEFAULT_KEY = ("id",)
+
+Change = Dict[str, Any]
+
+_encoder = json.JSONEncoder(sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def default_cache_path(root: str) -> str:
+    return os.environ.get("OBJECT_CACHE_DB") or os.path.join(root, ".backlog", "object_cache.db")
+
+
+def digest(value: Any) -> str:
+    return hashlib.blake2b(_encoder.encode(value).encode(), digest_size=DIGEST_SIZE).hexdigest()
+
+
+def _combine(parts: Iterator[str]) -> str:
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    for part in parts:
+        h.update(part.encode())
+    return h.hexdigest()
+
+
+def element_key(element: Any, key_path: Sequence[str]) -> Any:
+    value = element
+    for part in key_path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value if isinstance(value, (str, int, float, bool)) else None
+
+
+def array_keys(items: List[Any], key_path: Sequence[str]) -> Optional[List[str]]:
+    """JSON-encoded element keys, or None when some element has none or two collide."""
+    keys = []
+    for item in items:
+        key = element_key(item, key_path)
+        if key is None:
+            return None
+        keys.append(json.dumps(key))
+    return keys if len(set(keys)) == len(keys) else None
+
+
+class Summary:
+    """Digests of one object: root, per top-level field, per keyed-array element."""
+
+    __slots__ = ("root", "fields", "elements")
+
+    def __init__(self, root: str, fields: Dict[str, str], elements: Dict[str, Dict[str, str]]):
+        self.root = root
+        self.fields = fields
+        self.elements = elements
+
+    @classmethod
+    def of(cls, obj: Dict[str, Any]) -> "Summary":
+        fields: Dict[str, str] = {}
+        elements: Dict[str, Dict[str, str]] = {}
+        for name, value in obj.items():
+            keys = array_keys(value, KEYED_ARRAYS.get(name, DEFAULT_KEY)) if isinstance(value, list) else None
+            if keys is None:
+                fields[name] = digest(value)
+                continue
+            per_element = {key: digest(item) for key, item in zip(keys, value)}
+            elements[name] = per_element
+            # Order-insensitive: a reordered array is the same field.
+            fields[name] = _combine(f"{k}={d};" for k, d in sorted(per_element.items()))
+        root = _combine(f"{k}={d};" for k, d in sorted(fields.items()))
+        return cls(root, fields, elements)
+
+    def to_json(self) -> str:
+        return json.dumps({"root": self.root, "fields": self.fields, "elements": self.elements},
+                          separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, raw: str) -> "Summary":
+        data = json.loads(raw)
+        return cls(data["root"], data["fields"], data["elements"])
+
+
+# -- diff -------------------------------------------------------------------
+def _join(path: str, name: Any) -> str:
+    return f"{path}.{name}" if path else str(name)
+
+
+def diff_values(path: str, old: Any, new: Any, out: List[Change], key_path: Sequence[str] = DEFAULT_KEY) -> None:
+    if old == new and type(old) is type(new):
+        return
+    if isinstance(old, dict) and isinstance(new, dict):
+        for name, value in new.items():
+            if name in old:
+                diff_values(_join(path, name), old[name], value, out)
+            else:
+                out.append({"path": _join(path, name), "old": None, "new": value})
+        for name, value in old.items():
+            if name not in new:
+                out.append({"path": _join(path, name), "old": value, "new": None})
+    elif isinstance(old, list) and isinstance(new, list):
+        diff_arrays(path, old, new, out, key_path)
+    else:
+        out.append({"path": path, "old": old, "new": new})
+
+
+def diff_arrays(path: str, old: List[Any], new: List[Any], out: List[Change], key_path: Sequence[str],
+                old_digests: Optional[Dict[str, str]] = None, new_digests: Optional[Dict[str, str]] = None) -> None:
+    old_keys = array_keys(old, key_path)
+    new_keys = array_keys(new, key_path) if old_keys is not None else None
+    if old_keys is None or new_keys is None:
+        for i in range(max(len(old), len(new))):
+            if i >= len(old):
+                out.append({"path": f"{path}[{i}]", "old": None, "new": new[i]})
+            elif i >= len(new):
+                out.append({"path": f"{path}[{i}]", "old": old[i], "new": None})
+            else:
+                diff_values(f"{path}[{i}]", old[i], new[i], out)
+        return
+    old_at = {key: i for i, key in enumerate(old_keys)}
+    for j, key in enumerate(new_keys):
+        i = old_at.pop(key, None)
+        if i is None:
+            out.append({"path": f"{path}[{j}]", "old": None, "new": new[j]})
+        elif old_digests is not None and new_digests is not None and old_digests.get(key) == new_digests.get(key):
+            continue
+        else:
+            diff_values(f"{path}[{j}]", old[i], new[j], out)
+    for slot, i in enumerate(sorted(old_at.values()), len(new)):
+        out.append({"path": f"{path}[{slot}]", "old": old[i], "new": None})
+
+
+def diff(old: Any, new: Any, old_summary: Optional[Summary] = None, new_summary: Optional[Summary] = None) -> List[Change]:
+    """Change records turning old into new; summaries skip unchanged fields and elements."""
+    out: List[Change] = []
+    if not (isinstance(old, dict) and isinstance(new, dict)):
+        diff_values("", old, new, out)
+        return out
+    old_summary = old_summary or Summary.of(old)
+    new_summary = new_summary or Summary.of(new)
+    if old_summary.root == new_summary.root:
+        return out
+    old_fields, new_fields = old_summary.fields, new_summary.fields
+    for name, value in new.items():
+        if name not in old:
+            out.append({"path": name, "old": None, "new": value})
+        elif old_fields.get(name) == new_fields.get(name):
+            continue
+        elif name in old_summary.elements and name in new_summary.elements:
+            diff_arrays(name, old[name], value, out, KEYED_ARRAYS.get(name, DEFAULT_KEY),
+                        old_summary.elements[name], new_summary.elements[name])
+        else:
+            diff_values(name, old[name], value, out, KEYED_ARRAYS.get(name, DEFAULT_KEY))
+    for name, value in old.items():
+        if name not in new:
+            out.append({"path": name, "old": value, "new": None})
+    return out
+
+
+# -- cache ------------------------------------------------------------------
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    uid INTEGER PRIMARY KEY,
+    summary TEXT,
+    body BLOB,
+    stored_at REAL
+);
+"""
+
+
+class ObjectCache:
+    """Last seen object and Summary per uid; put() is buffered until commit()."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = connect(path)
+        self.conn.executescript(_SCHEMA)
+        self._dirty: Dict[int, Tuple[str, bytes]] = {}
+
+    def __enter__(self) -> "ObjectCache":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM objects").fetchone()[0]
+
+    def get(self, uid) -> Optional[Tuple[Summary, Callable[[], Any]]]:
+        """(summary, loader) for the cached object; the body is only decoded if loader() is called."""
+        key = int(uid)
+        if key in self._dirty:
+            summary_raw, body = self._dirty[key]
+        else:
+            row = self.conn.execute("SELECT summary, body FROM objects WHERE uid = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            summary_raw, body = row
+        return Summary.from_json(summary_raw), lambda: json.loads(zlib.decompress(body))
+
+    def put(self, uid, obj: Any, summary: Summary) -> None:
+        self._dirty[int(uid)] = (summary.to_json(), zlib.compress(_encoder.encode(obj).encode(), 6))
+
+    def commit(self) -> int:
+        if not self._dirty:
+            return 0
+        now = time.time()
+        rows = [(uid, summary, body, now) for uid, (summary, body) in self._dirty.items()]
+        with transaction(self.conn) as conn:
+            conn.executemany("INSERT OR REPLACE INTO objects (uid, summary, body, stored_at) VALUES (?, ?, ?, ?)", rows)
+        self._dirty.clear()
+        return len(rows)
+
+
+class ObjectDiffer:
+    def __init__(self, cache: ObjectCache):
+        self.cache = cache
+
+    def observe(self, uid, obj: Any) -> Optional[List[Change]]:
+        """Changes since the cached object (None on first sight); the cache then holds obj."""
+        new_summary = Summary.of(obj) if isinstance(obj, dict) else Summary(digest(obj), {}, {})
+        cached = self.cache.get(uid)
+        changes: Optional[List[Change]] = None
+        if cached is not None:
+            old_summary, load = cached
+            if old_summary.root == new_summary.root:
+                return []
+            changes = diff(load(), obj, old_summary if isinstance(obj, dict) else None, new_summary)
+        self.cache.put(uid, obj, new_summary)
+        return changes
+
+
+def _load(path: str) -> Any:
+    if path == "-":
+        return json.load(sys.stdin)
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _summary_line(changes: Optional[List[Change]], limit: int = 8) -> str:
+    if changes is None:
+        return "new (no previous object)"
+    if not changes:
+        return "no changes"
+    paths = [c["path"] for c in changes]
+    more = f" (+{len(paths) - limit} more)" if len(paths) > limit else ""
+    return f"{len(paths)} changes: {','.join(paths[:limit])}{more}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Structural diff of full user exports.")
+    parser.add_argument("--cache", default=default_cache_path(ROOT), help="Object cache (default: .backlog/object_cache.db)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_diff = sub.add_parser("diff", help="Change records between two JSON files ('-' = stdin)")
+    p_diff.add_argument("old")
+    p_diff.add_argument("new")
+    p_diff.add_argument("--summary", action="store_true", help="One line: count and changed paths")
+    p_obs = sub.add_parser("observe", help="Diff an export against the cached object and update the cache")
+    p_obs.add_argument("uid", type=int)
+    p_obs.add_argument("export")
+    p_obs.add_argument("--summary", action="store_true")
+    sub.add_parser("stats")
+    args = parser.parse_args()
+
+    if args.cmd == "diff":
+        old = _load(args.old) if os.path.exists(args.old) or args.old == "-" else None
+        changes = diff(old, _load(args.new)) if old is not None else None
+    elif args.cmd == "observe":
+        with ObjectCache(args.cache) as cache:
+            changes = ObjectDiffer(cache).observe(args.uid, _load(args.export))
+            cache.commit()
+    else:
+        with ObjectCache(args.cache) as cache:
+            print(json.dumps({"db": args.cache, "objects": len(cache)}))
+        return
+    if args.summary:
+        print(_summary_line(changes))
+    else:
+        for change in changes or []:
+            print(json.dumps(change))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 #!/usr/bin/env bash
-# ops_agent.sh - lightweight operations loop for tokens, cleanup, backups
+# ops_agent.sh - lightweight operations loop for tokens, cleanup, events archive, backups
 # Runs inside the ops Docker service. Interval is configurable with OPS_INTERVAL (seconds).
 
 set -euo pipefail
@@ -11,6 +11,12 @@ mkdir -p "$LOG_DIR"
 OPS_INTERVAL="${OPS_INTERVAL:-3600}" # default: 1 hour
 CLEANUP_LINES="${CLEANUP_LINES:-500}" # default truncation target
 LOG_FILE="$LOG_DIR/ops_agent.log"
+AGENTS_CONFIG="$ROOT_DIR/scripts/config/agents.config"
+# Compact events_queue.jsonl once it passes this size (0 = off)
+if [[ -z "${EVENTS_ARCHIVE_MIN_BYTES:-}" && -f "$AGENTS_CONFIG" ]]; then
+  EVENTS_ARCHIVE_MIN_BYTES=$(grep -E '^\s*EVENTS_ARCHIVE_MIN_BYTES=' "$AGENTS_CONFIG" | head -1 | cut -d= -f2 | tr -d '"')
+fi
+EVENTS_ARCHIVE_MIN_BYTES="${EVENTS_ARCHIVE_MIN_BYTES:-0}"
 
 log() {
   echo "[$(date -u +'%Y-%m-%dT%H:%M:%SZ')] $*" | tee -a "$LOG_FILE"
@@ -35,6 +41,17 @@ run_cleanup() {
     || log "Cleanup logs: skipped/failed"
 }
 
+run_archive_compact() {
+  [[ "$EVENTS_ARCHIVE_MIN_BYTES" -gt 0 ]] || return 0
+  local segments
+  if segments=$(ROOT_DIR="$ROOT_DIR" python3 "$ROOT_DIR/scripts/agents/events_archive.py" compact \
+      --min-bytes "$EVENTS_ARCHIVE_MIN_BYTES" 2>>"$LOG_FILE"); then
+    log "Events archive: ok ($(grep -c . <<<"$segments" || true) segment(s) written)"
+  else
+    log "Events archive: compact failed"
+  fi
+}
+
 run_backup() {
   # If a concrete backup script exists, run it; otherwise skip gracefully
   if [[ -x "$ROOT_DIR/scripts/cron/backup_database.sh" ]]; then
@@ -53,6 +70,7 @@ log "Ops agent starting (interval=${OPS_INTERVAL}s)"
 while true; do
   run_token_refresh
   run_cleanup
+  run_archive_compact
   run_backup
   sleep "$OPS_INTERVAL"
 done
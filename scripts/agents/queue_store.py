@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Persistent uid work queues (fetch, process, events_pending, pending_users).
+
+The agents used to keep each queue as a text file with one uid per line and
+rewrite it on every pop (tail -n +2 > tmp && mv, sed -i) or every detector
+cycle. Queues now live in one SQLite WAL database next to the files
+(.backlog/queues.db, override with QUEUE_DB). Each entry is (queue, uid, pos),
+with pos indexed:
+
+- push top (priority >= 2) takes positions below the current head, so a batch
+  lands in order in front of the queue and moves uids that were already queued
+- push bottom (priority 1) appends after the tail and leaves queued uids
+  where they are; priority <= 0 is skipped (fetcher_fields.json semantics,
+  identical to the detector's old apply_priority_queue)
+- pop(n) removes the n lowest positions in one transaction
+- uids are unique per queue, so dedup is free
+
+Push and pop are O(log n) index operations. No queue file is rewritten.
+
+The legacy text file stays the queue's inbox. Anything appended to it (other
+tools, old scripts, the file left over from before the migration) is moved to
+the tail of the queue, under the file's flock, before the next operation.
+Queues are named after the file ("fetch_queue_internal.txt" ->
+"fetch_queue_internal").
+
+After every change a queue writes its depth to queue_depths/<name> next to
+the database, for readers without SQLite (api/server.js in its container).
+
+CLI (every command takes --file QUEUE_FILE [--lock LOCK_FILE] [--db PATH]):
+  queue_store.py push  [--priority N] UID [UID...]   (or "-" to read stdin)
+  queue_store.py pop   [-n N]                         -> one uid per line
+  queue_store.py len
+  queue_store.py list  [--limit N]
+  queue_store.py clear
+"""
+
+import argparse
+import fcntl
+import os
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlite_store import chunked, connect, placeholders, transaction
+
+PRIORITY_TOP = 2
+PRIORITY_BOTTOM = 1
+PRIORITY_SKIP = 0
+
+DB_NAME = "queues.db"
+DEPTHS_DIR = "queue_depths"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue_items (
+    queue TEXT NOT NULL,
+    uid INTEGER NOT NULL,
+    pos INTEGER NOT NULL,
+    priority INTEGER,
+    enqueued_at REAL,
+    PRIMARY KEY (queue, uid)
+) WITHOUT ROWID;
+CREATE UNIQUE INDEX IF NOT EXISTS queue_items_pos ON queue_items (queue, pos);
+"""
+
+
+def default_db_path(queue_file: str) -> str:
+    return os.environ.get("QUEUE_DB") or os.path.join(os.path.dirname(os.path.abspath(queue_file)), DB_NAME)
+
+
+def queue_name(queue_file: str) -> str:
+    return os.path.splitext(os.path.basename(queue_file))[0]
+
+
+def _as_uid(value: Any) -> Optional[int]:
+    text = str(value).strip() if value is not None else ""
+    return int(text) if text.isdigit() else None
+
+
+def _as_priority(value: Any) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return PRIORITY_SKIP
+
+
+class QueueStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = connect(path)
+        self.conn.executescript(_SCHEMA)
+
+    def __enter__(self) -> "QueueStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def queue(self, queue_file: str, lock_file: Optional[str] = None) -> "UidQueue":
+        return UidQueue(self, queue_file, lock_file)
+
+
+class UidQueue:
+    """One named queue; its legacy text file is drained into it on every call."""
+
+    def __init__(self, store: QueueStore, queue_file: str, lock_file: Optional[str] = None):
+        self.conn = store.conn
+        self.name = queue_name(queue_file)
+        self.depth_path = os.path.join(os.path.dirname(os.path.abspath(store.path)), DEPTHS_DIR, self.name)
+        self.inbox = queue_file
+        self.lock_file = lock_file or f"{queue_file}.lock"
+
+    # -- inbox -------------------------------------------------------------
+    def drain_inbox(self) -> int:
+        """Append uids written to the legacy file, then empty it."""
+        try:
+            if os.path.getsize(self.inbox) == 0:
+                return 0
+        except FileNotFoundError:
+            return 0
+        with open(self.lock_file, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            with open(self.inbox, "r+") as f:
+                lines = f.read().split()
+                added = self._push_bottom([uid for uid in map(_as_uid, lines) if uid is not None], PRIORITY_BOTTOM)
+                # Truncate only after the rows are committed; a re-drain is deduplicated.
+                f.seek(0)
+                f.truncate()
+        if added:
+            self._publish_depth()
+        return added
+
+    def _publish_depth(self, depth: Optional[int] = None) -> None:
+        if depth is None:
+            depth = self.conn.execute("SELECT COUNT(*) FROM queue_items WHERE queue = ?", (self.name,)).fetchone()[0]
+        try:
+            os.makedirs(os.path.dirname(self.depth_path), exist_ok=True)
+            tmp = f"{self.depth_path}.tmp.{os.getpid()}"
+            with open(tmp, "w") as f:
+                f.write(f"{depth}\n")
+            os.replace(tmp, self.depth_path)
+        except OSError:
+            pass
+
+    # -- positions ---------------------------------------------------------
+    def _bounds(self) -> Tuple[Optional[int], Optional[int]]:
+        # Two index probes instead of MIN()/MAX() together, which would scan.
+        head = self.conn.execute(
+            "SELECT pos FROM queue_items WHERE queue = ? ORDER BY pos ASC LIMIT 1", (self.name,)
+        ).fetchone()
+        tail = self.conn.execute(
+            "SELECT pos FROM queue_items WHERE queue = ? ORDER BY pos DESC LIMIT 1", (self.name,)
+        ).fetchone()
+        return (head[0] if head else None, tail[0] if tail else None)
+
+    def _present(self, uids: List[int]) -> Dict[int, int]:
+        found: Dict[int, int] = {}
+        for chunk in chunked(uids):
+            cur = self.conn.execute(
+                f"SELECT uid, pos FROM queue_items WHERE queue = ? AND uid IN ({placeholders(len(chunk))})",
+                (self.name, *chunk),
+            )
+            found.update(cur.fetchall())
+        return found
+
+    def _push_top(self, uids: List[int], priority: int) -> int:
+        uids = list(dict.fromkeys(uids))
+        if not uids:
+            return 0
+        now = time.time()
+        with transaction(self.conn) as conn:
+            head, _ = self._bounds()
+            base = (head if head is not None else 0) - len(uids)
+            present = self._present(uids)
+            for offset, uid in enumerate(uids):
+                if uid in present:
+                    conn.execute(
+                        "UPDATE queue_items SET pos = ?, priority = ? WHERE queue = ? AND uid = ?",
+                        (base + offset, priority, self.name, uid),
+                    )
+                else:
+                    conn.execute(
+                        "INSERT INTO queue_items (queue, uid, pos, priority, enqueued_at) VALUES (?, ?, ?, ?, ?)",
+                        (self.name, uid, base + offset, priority, now),
+                    )
+        return len(uids)
+
+    def _push_bottom(self, uids: List[int], priority: int) -> int:
+        uids = list(dict.fromkeys(uids))
+        if not uids:
+            return 0
+        now = time.time()
+        with transaction(self.conn) as conn:
+            present = self._present(uids)
+            fresh = [uid for uid in uids if uid not in present]
+            if not fresh:
+                return 0
+            _, tail = self._bounds()
+            start = (tail if tail is not None else -1) + 1
+            conn.executemany(
+                "INSERT INTO queue_items (queue, uid, pos, priority, enqueued_at) VALUES (?, ?, ?, ?, ?)",
+                [(self.name, uid, start + offset, priority, now) for offset, uid in enumerate(fresh)],
+            )
+        return len(fresh)
+
+    # -- public API --------------------------------------------------------
+    def push(self, uids: Iterable[Any], priority: int = PRIORITY_BOTTOM) -> int:
+        return self.push_many((uid, priority) for uid in uids)
+
+    def push_many(self, items: Iterable[Tuple[Any, Any]]) -> int:
+        """Apply (uid, priority) updates: >=2 to the top in order, 1 to the tail, <=0 skipped."""
+        self.drain_inbox()
+        top: List[int] = []
+        bottom: List[int] = []
+        for raw_uid, raw_priority in items:
+            uid = _as_uid(raw_uid)
+            if uid is None:
+                continue
+            priority = _as_priority(raw_priority)
+            if priority >= PRIORITY_TOP:
+                top.append(uid)
+            elif priority > PRIORITY_SKIP:
+                bottom.append(uid)
+        # Tops first so a uid pushed both ways in one batch ends up on top.
+        pushed = self._push_top(top, PRIORITY_TOP) + self._push_bottom(bottom, PRIORITY_BOTTOM)
+        if pushed:
+            self._publish_depth()
+        return pushed
+
+    def pop(self, count: int = 1) -> List[str]:
+        """Remove and return up to count uids from the head."""
+        self.drain_inbox()
+        with transaction(self.conn) as conn:
+            rows = conn.execute(
+                "SELECT uid, pos FROM queue_items WHERE queue = ? ORDER BY pos LIMIT ?",
+                (self.name, max(count, 0)),
+            ).fetchall()
+            if rows:
+                conn.execute(
+                    "DELETE FROM queue_items WHERE queue = ? AND pos <= ?",
+                    (self.name, rows[-1][1]),
+                )
+        if rows:
+            self._publish_depth()
+        return [str(uid) for uid, _ in rows]
+
+    def move_to_bottom(self, uids: Iterable[Any]) -> int:
+        """Move queued uids to the tail, keeping their relative order."""
+        self.drain_inbox()
+        wanted = [uid for uid in map(_as_uid, uids) if uid is not None]
+        with transaction(self.conn) as conn:
+            present = self._present(list(dict.fromkeys(wanted)))
+            ordered = sorted(present, key=present.get)
+            _, tail = self._bounds()
+            start = (tail if tail is not None else -1) + 1
+            conn.executemany(
+                "UPDATE queue_items SET pos = ? WHERE queue = ? AND uid = ?",
+                [(start + offset, self.name, uid) for offset, uid in enumerate(ordered)],
+            )
+        return len(ordered)
+
+    def remove(self, uids: Iterable[Any]) -> List[str]:
+        """Remove uids; returns the ones that were queued, in queue order."""
+        self.drain_inbox()
+        wanted = list(dict.fromkeys(uid for uid in map(_as_uid, uids) if uid is not None))
+        with transaction(self.conn) as conn:
+            present = self._present(wanted)
+            for chunk in chunked(list(present)):
+                conn.execute(
+                    f"DELETE FROM queue_items WHERE queue = ? AND uid IN ({placeholders(len(chunk))})",
+                    (self.name, *chunk),
+                )
+        if present:
+            self._publish_depth()
+        return [str(uid) for uid in sorted(present, key=present.get)]
+
+    def remove_present_in(self, other: "UidQueue") -> int:
+        """Drop uids that are also queued in other."""
+        self.drain_inbox()
+        other.drain_inbox()
+        with transaction(self.conn) as conn:
+            cur = conn.execute(
+                "DELETE FROM queue_items WHERE queue = ? AND uid IN "
+                "(SELECT uid FROM queue_items WHERE queue = ?)",
+                (self.name, other.name),
+            )
+        if cur.rowcount:
+            self._publish_depth()
+        return cur.rowcount
+
+    def uids(self, limit: Optional[int] = None) -> Iterator[str]:
+        self.drain_inbox()
+        sql = "SELECT uid FROM queue_items WHERE queue = ? ORDER BY pos"
+        params: Tuple = (self.name,)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params += (limit,)
+        for (uid,) in self.conn.execute(sql, params):
+            yield str(uid)
+
+    def __len__(self) -> int:
+        self.drain_inbox()
+        depth = self.conn.execute("SELECT COUNT(*) FROM queue_items WHERE queue = ?", (self.name,)).fetchone()[0]
+        self._publish_depth(depth)
+        return depth
+
+    def clear(self) -> int:
+        with open(self.lock_file, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(self.inbox):
+                open(self.inbox, "w").close()
+            with transaction(self.conn) as conn:
+                cur = conn.execute("DELETE FROM queue_items WHERE queue = ?", (self.name,))
+        self._publish_depth(0)
+        return cur.rowcount
+
+
+def open_queue(queue_file: str, lock_file: Optional[str] = None, db_path: Optional[str] = None) -> Tuple[QueueStore, UidQueue]:
+    store = QueueStore(db_path or default_db_path(queue_file))
+    return store, store.queue(queue_file, lock_file)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Persistent uid queues (SQLite; legacy queue files act as inboxes).")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    for name in ("push", "pop", "len", "list", "clear"):
+        p = sub.add_parser(name)
+        p.add_argument("--file", required=True, help="Legacy queue file (names the queue, used as inbox)")
+        p.add_argument("--lock", default=None, help="Lock file guarding the inbox (default: FILE.lock)")
+        p.add_argument("--db", default=None, help=f"Database path (default: QUEUE_DB or <dir of FILE>/{DB_NAME})")
+        if name == "push":
+            p.add_argument("--priority", type=int, default=PRIORITY_BOTTOM,
+                           help="2+ = top, 1 = bottom, 0 = skip (default: 1)")
+            p.add_argument("uids", nargs="+", help='uids, or "-" to read them from stdin')
+        elif name == "pop":
+            p.add_argument("-n", "--count", type=int, default=1)
+        elif name == "list":
+            p.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+
+    store, queue = open_queue(args.file, args.lock, args.db)
+    with store:
+        if args.cmd == "push":
+            uids = sys.stdin.read().split() if args.uids == ["-"] else args.uids
+            queue.push(uids, args.priority)
+        elif args.cmd == "pop":
+            for uid in queue.pop(args.count):
+                print(uid)
+        elif args.cmd == "len":
+            print(len(queue))
+        elif args.cmd == "list":
+            for uid in queue.uids(args.limit):
+                print(uid)
+        else:
+            print(queue.clear())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Shared SQLite plumbing for the agents' on-disk stores.
+
+Every store opens its database in WAL mode so readers (monitoring, generators)
+never block the writer, with synchronous=NORMAL (durable at checkpoint, never
+corrupt) and a busy timeout so concurrent agents wait instead of failing.
+"""
+
+import os
+import sqlite3
+from typing import Iterator, Sequence, TypeVar
+
+T = TypeVar("T")
+
+# SQLite caps bound parameters per statement (999 on older builds).
+MAX_VARS = 900
+
+
+def connect(path: str, timeout: float = 30.0) -> sqlite3.Connection:
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(timeout * 1000)}")
+    return conn
+
+
+def chunked(items: Sequence[T], size: int = MAX_VARS) -> Iterator[Sequence[T]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK around a batch (autocommit connections)."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
+
+
+def placeholders(count: int) -> str:
+    return ",".join("?" * count)
@@ -27,90 +27,127 @@ DB_NAME="${DB_NAME:-api42}"
 
 PROCESS_QUEUE="$BACKLOG_DIR/process_queue.txt"
 [[ ! -f "$PROCESS_QUEUE" ]] && touch "$PROCESS_QUEUE"
+QUEUE_STORE="$ROOT_DIR/scripts/agents/queue_store.py"
+DB_UPSERTER="$ROOT_DIR/scripts/agents/db_upserter.py"
+UPSERT_BATCH="${UPSERT_BATCH:-200}"
 
-echo "[$(date -u +'%Y-%m-%dT%H:%M:%SZ')] Upserter started (no batching, immediate upserts)" | tee -a "$LOG_FILE"
+# Batched upserts (one connection, COPY + ON CONFLICT per batch) when psycopg is available
+if [[ "${UPSERTER_LEGACY:-0}" != "1" ]] && python3 -c 'import psycopg' 2>/dev/null; then
+  DB_HOST="$DB_HOST" DB_PORT="$DB_PORT" DB_USER="$DB_USER" DB_PASSWORD="$DB_PASSWORD" DB_NAME="$DB_NAME" ROOT_DIR="$ROOT_DIR" \
+    exec python3 "$DB_UPSERTER" run --batch "$UPSERT_BATCH" --log-file "$LOG_FILE" >> "$LOG_FILE" 2>&1
+fi
+
+# Resident uid -> campus index (loaded once, one pipe round-trip per lookup)
+LOCATION_INDEX="$ROOT_DIR/scripts/agents/location_index.py"
+start_location_index() {
+  coproc LOCIDX { python3 "$LOCATION_INDEX" serve --base "$EXPORTS_USERS" 2>/dev/null; }
+}
+
+restart_location_index() {
+  if [[ -n "${LOCIDX_PID:-}" ]]; then
+    kill "$LOCIDX_PID" 2>/dev/null || true
+    wait "$LOCIDX_PID" 2>/dev/null || true
+  fi
+  start_location_index
+}
+
+start_location_index
+
+# Prints the snapshot path (nothing when the user has none). Returns 2 when the
+# index did not answer in time: the caller restarts it and requeues the uid.
+find_snapshot_file() {
+  local user_id="$1"
+  local reply=""
+  if [[ -n "${LOCIDX_PID:-}" ]] && kill -0 "$LOCIDX_PID" 2>/dev/null; then
+    echo "$user_id" >&"${LOCIDX[1]}"
+    # Replies start with the uid asked for; skip late answers to earlier lookups.
+    while IFS= read -r -t 5 reply <&"${LOCIDX[0]}"; do
+      if [[ "${reply%% *}" == "$user_id" ]]; then
+        [[ "$reply" == *" "* ]] && echo "${reply#* * }"
+        return 0
+      fi
+    done
+    return 2
+  fi
+  # Index helper unavailable: fall back to probing every campus directory
+  local campus_dir
+  for campus_dir in "$EXPORTS_USERS"/campus_*; do
+    if [[ -f "$campus_dir/user_${user_id}.json" ]]; then
+      echo "$campus_dir/user_${user_id}.json"
+      return 0
+    fi
+  done
+}
+
+echo "[$(date -u +'%Y-%m-%dT%H:%M:%SZ')] Upserter started (no batching, immediate upserts; install psycopg for batched mode)" | tee -a "$LOG_FILE"
 
 COUNTER=0
 
 # Main loop
 while true; do
-  # Read random line from process queue
-  if [[ -s "$PROCESS_QUEUE" ]]; then
-    # Get random line number
-    TOTAL_LINES=$(wc -l < "$PROCESS_QUEUE")
-    if [[ $TOTAL_LINES -gt 0 ]]; then
-      RANDOM_LINE=$((RANDOM % TOTAL_LINES + 1))
-      USER_ID=$(sed -n "${RANDOM_LINE}p" "$PROCESS_QUEUE")
-    else
-      sleep 1
+  # Pop the head of the process queue (FIFO, removed in the same transaction)
+  USER_ID=$(python3 "$QUEUE_STORE" pop --file "$PROCESS_QUEUE" 2>/dev/null || true)
+  if [[ -n "$USER_ID" ]]; then
+    campus_id=0
+    
+    # Find the snapshot file (it was created by fetcher)
+    lookup_rc=0
+    snapshot_file=$(find_snapshot_file "$USER_ID") || lookup_rc=$?
+    if [[ "$lookup_rc" -eq 2 ]]; then
+      echo "[$(date -u +'%Y-%m-%dT%H:%M:%SZ')] ⚠️  User $USER_ID: location index timed out, requeued" | tee -a "$LOG_FILE"
+      python3 "$QUEUE_STORE" push --file "$PROCESS_QUEUE" --priority 2 "$USER_ID" >/dev/null 2>&1 || true
+      restart_location_index
       continue
     fi
     
-    if [[ -n "$USER_ID" ]]; then
-      # Remove the selected line from queue
-      sed -i "${RANDOM_LINE}d" "$PROCESS_QUEUE"
-      
-      campus_id=0
-      snapshot_file=""
-      
-      # Find the snapshot file (it was created by fetcher)
-      for campus_dir in "$EXPORTS_USERS"/campus_*; do
-        if [[ -f "$campus_dir/user_${USER_ID}.json" ]]; then
-          snapshot_file="$campus_dir/user_${USER_ID}.json"
-          campus_id=$(basename "$campus_dir" | sed 's/campus_//')
-          break
-        fi
-      done
-      
-      if [[ -z "$snapshot_file" ]]; then
-        echo "[$(date -u +'%Y-%m-%dT%H:%M:%SZ')] ⚠️  User $USER_ID: snapshot not found" | tee -a "$LOG_FILE"
-        continue
-      fi
-      
-      # Load JSON
-      user_json=$(cat "$snapshot_file" 2>/dev/null || echo "")
-      [[ -z "$user_json" ]] && continue
-      
+    if [[ -z "$snapshot_file" ]]; then
+      echo "[$(date -u +'%Y-%m-%dT%H:%M:%SZ')] ⚠️  User $USER_ID: snapshot not found" | tee -a "$LOG_FILE"
+      continue
+    fi
+    
+    # Load JSON
+    user_json=$(cat "$snapshot_file" 2>/dev/null || echo "")
+    [[ -z "$user_json" ]] && continue
+    
 	      # Extract primary campus_id (fallback: first campus_users or campus[0].id)
 	      campus_id=$(echo "$user_json" | jq '((.campus_users[]? | select(.is_primary==true) | .campus_id) // .campus_users[0].campus_id // .campus[0].id // 0)' 2>/dev/null)
 	      [[ -z "$campus_id" ]] && campus_id=0
 	      [[ "$campus_id" == "null" ]] && campus_id=0
-      
-      # Extract fields
-      login=$(echo "$user_json" | jq -r '.login // ""' 2>/dev/null | sed "s/'/''/g")
-      email=$(echo "$user_json" | jq -r '.email // ""' 2>/dev/null | sed "s/'/''/g")
-      first_name=$(echo "$user_json" | jq -r '.first_name // ""' 2>/dev/null | sed "s/'/''/g")
-      last_name=$(echo "$user_json" | jq -r '.last_name // ""' 2>/dev/null | sed "s/'/''/g")
-      correction_point=$(echo "$user_json" | jq -r '.correction_point // 0' 2>/dev/null)
-      wallet=$(echo "$user_json" | jq -r '.wallet // 0' 2>/dev/null)
-      location=$(echo "$user_json" | jq -r '.location // ""' 2>/dev/null | sed "s/'/''/g")
-      
-      # Upsert to DB immediately
-      PGPASSWORD="$DB_PASSWORD" psql -h "$DB_HOST" -p "$DB_PORT" -U "$DB_USER" -d "$DB_NAME" -v ON_ERROR_STOP=0 \
-        -c "INSERT INTO users (id, login, email, first_name, last_name, correction_point, wallet, location, campus_id) 
-            VALUES ($USER_ID, E'$login', E'$email', E'$first_name', E'$last_name', $correction_point, $wallet, E'$location', $campus_id)
-            ON CONFLICT (id) DO UPDATE SET
-              login=EXCLUDED.login,
-              email=EXCLUDED.email,
-              correction_point=EXCLUDED.correction_point,
-              wallet=EXCLUDED.wallet,
-              location=EXCLUDED.location,
-              campus_id=EXCLUDED.campus_id;" \
-        2>/dev/null || true
-      
-      COUNTER=$((COUNTER + 1))
-      echo "[$(date -u +'%Y-%m-%dT%H:%M:%SZ')] ✓ Upserted user $USER_ID (total: $COUNTER)" | tee -a "$LOG_FILE"
-      
-      # Send event to API server for real-time notifications
-      curl -s -X POST "http://localhost:8000/api/user-updated" \
-        -H "Content-Type: application/json" \
-        -d "{\"id\": $USER_ID, \"login\": \"$login\", \"campus_id\": $campus_id, \"wallet\": $wallet, \"correction_point\": $correction_point, \"location\": \"$location\", \"change_type\": \"upserted\"}" \
-        2>/dev/null || true
-      
-      # Trim log to prevent growth (every 50 users)
-      if [[ $((COUNTER % 50)) -eq 0 ]]; then
-        [[ $(wc -l < "$LOG_FILE" 2>/dev/null || echo "0") -gt 5500 ]] && tail -5000 "$LOG_FILE" > "${LOG_FILE}.tmp" && mv "${LOG_FILE}.tmp" "$LOG_FILE"
-      fi
+    
+    # Extract fields
+    login=$(echo "$user_json" | jq -r '.login // ""' 2>/dev/null | sed "s/'/''/g")
+    email=$(echo "$user_json" | jq -r '.email // ""' 2>/dev/null | sed "s/'/''/g")
+    first_name=$(echo "$user_json" | jq -r '.first_name // ""' 2>/dev/null | sed "s/'/''/g")
+    last_name=$(echo "$user_json" | jq -r '.last_name // ""' 2>/dev/null | sed "s/'/''/g")
+    correction_point=$(echo "$user_json" | jq -r '.correction_point // 0' 2>/dev/null)
+    wallet=$(echo "$user_json" | jq -r '.wallet // 0' 2>/dev/null)
+    location=$(echo "$user_json" | jq -r '.location // ""' 2>/dev/null | sed "s/'/''/g")
+    
+    # Upsert to DB immediately
+    PGPASSWORD="$DB_PASSWORD" psql -h "$DB_HOST" -p "$DB_PORT" -U "$DB_USER" -d "$DB_NAME" -v ON_ERROR_STOP=0 \
+      -c "INSERT INTO users (id, login, email, first_name, last_name, correction_point, wallet, location, campus_id) 
+          VALUES ($USER_ID, E'$login', E'$email', E'$first_name', E'$last_name', $correction_point, $wallet, E'$location', $campus_id)
+          ON CONFLICT (id) DO UPDATE SET
+            login=EXCLUDED.login,
+            email=EXCLUDED.email,
+            correction_point=EXCLUDED.correction_point,
+            wallet=EXCLUDED.wallet,
+            location=EXCLUDED.location,
+            campus_id=EXCLUDED.campus_id;" \
+      2>/dev/null || true
+    
+    COUNTER=$((COUNTER + 1))
+    echo "[$(date -u +'%Y-%m-%dT%H:%M:%SZ')] ✓ Upserted user $USER_ID (total: $COUNTER)" | tee -a "$LOG_FILE"
+    
+    # Send event to API server for real-time notifications
+    curl -s -X POST "http://localhost:8000/api/user-updated" \
+      -H "Content-Type: application/json" \
+      -d "{\"id\": $USER_ID, \"login\": \"$login\", \"campus_id\": $campus_id, \"wallet\": $wallet, \"correction_point\": $correction_point, \"location\": \"$location\", \"change_type\": \"upserted\"}" \
+      2>/dev/null || true
+    
+    # Trim log to prevent growth (every 50 users)
+    if [[ $((COUNTER % 50)) -eq 0 ]]; then
+      [[ $(wc -l < "$LOG_FILE" 2>/dev/null || echo "0") -gt 5500 ]] && tail -5000 "$LOG_FILE" > "${LOG_FILE}.tmp" && mv "${LOG_FILE}.tmp" "$LOG_FILE"
     fi
   else
     # No more items in queue
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Offline check of api_client.py's resident mode against a stub HTTP server.
+
+Starts a local HTTP/1.1 server and one `api_client.py serve` process (what
+backlog_worker.sh keeps as its coprocess), then sends requests one at a time
+the way the worker does across users and checks:
+
+  keepalive    every request after the first reused one connection
+  retry_after  a 429 with Retry-After: R is retried no sooner than R seconds
+  pacing       N requests at --rate-per-hour take at least (N - burst) / rate
+  tags         every reply echoes the id of the request it answers
+
+The bucket lives in a scratch directory, so the host's shared
+.backlog/rate_limit.bucket is not touched.
+
+CLI:
+  api_client_check.py [--requests N] [--rate-per-hour R] [--retry-after S]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+API_CLIENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "agents", "api_client.py")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = set()
+    throttled = []  # times of the 429 and of the retry that followed it
+    retry_after = 1
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        StubHandler.connections.add(self.client_address)
+        if self.path.startswith("/throttle"):
+            StubHandler.throttled.append(time.monotonic())
+            if len(StubHandler.throttled) == 1:
+                self._reply(429, b'{"error":"rate limited"}', {"Retry-After": str(StubHandler.retry_after)})
+                return
+        self._reply(200, json.dumps({"path": self.path}).encode())
+
+    def _reply(self, code, body, headers=None):
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check api_client.py serve against a stub server.")
+    parser.add_argument("--requests", type=int, default=6)
+    parser.add_argument("--rate-per-hour", type=float, default=7200.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args()
+    StubHandler.retry_after = args.retry_after
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    burst = 1.0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        proc = subprocess.Popen(
+            [sys.executable, API_CLIENT, "--bucket", os.path.join(tmp, "rate_limit.bucket"),
+             "--rate-per-hour", str(args.rate_per_hour), "--burst", str(burst), "--token", "stub",
+             "--retry-delay", "0.1", "--log", os.path.join(tmp, "client.log"), "serve", "--concurrency", "2"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1,
+        )
+
+        def request(req_id: str, path: str) -> str:
+            outfile = os.path.join(tmp, req_id)
+            proc.stdin.write(f"{req_id}\t{base}{path}\t{outfile}\tcheck\n")
+            proc.stdin.flush()
+            return proc.stdout.readline().rstrip("\n")
+
+        replies = []
+        started = time.monotonic()
+        for n in range(args.requests):
+            replies.append((f"r{n}", request(f"r{n}", f"/users/{n}")))
+        paced = time.monotonic() - started
+        throttle_reply = request("t0", "/throttle")
+        proc.stdin.close()
+        proc.wait(timeout=30)
+
+    server.shutdown()
+    rate = args.rate_per_hour / 3600.0
+    min_paced = max(0.0, (args.requests - burst) / rate)
+    retry_gap = StubHandler.throttled[1] - StubHandler.throttled[0] if len(StubHandler.throttled) > 1 else None
+    checks = {
+        "keepalive": len(StubHandler.connections) == 1,
+        "retry_after": retry_gap is not None and retry_gap >= args.retry_after - 0.05
+                       and throttle_reply.split("\t")[1] == "200",
+        "pacing": paced >= min_paced - 0.05,
+        "tags": all(reply.split("\t")[:2] == [req_id, "200"] for req_id, reply in replies),
+    }
+    print(json.dumps({
+        "checks": checks,
+        "connections": len(StubHandler.connections),
+        "retry_gap_s": None if retry_gap is None else round(retry_gap, 3),
+        "paced_s": round(paced, 3),
+        "min_paced_s": round(min_paced, 3),
+    }))
+    sys.exit(0 if all(checks.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
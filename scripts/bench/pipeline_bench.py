@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Offline throughput benchmark for the detection/event pipeline.
+
+Builds a scratch ROOT_DIR (a copy of scripts/ plus synth_fixtures.py data),
+then runs each stage as its own process and reports, per stage:
+
+  users/s, events/s   input users (or events for classify_*) and output events
+  peak_rss_mb         max RSS of the stage and its children (wait4 rusage)
+  io                  rchar/wchar, read/write syscalls and block I/O bytes
+                      (/proc/self/io delta; reaped children are accounted to us)
+
+Stages (run in this order):
+  classify_events      classify_events.py listing to /dev/null
+  classify_summary     classify_events.py --summary --jobs J
+  detector_feed_events detector_feed_events.py over users_latest.json
+  events_logs          events_logs_generator.py over the newest users_*.json
+  eventifier           scripts/cron/eventifier.sh over events_pending.txt
+  detector             scripts/agents/detector.sh with the window served from
+                       .cache/raw_detect/window.jsonl instead of the API
+
+Optional stages (only with --stages):
+  columnar_diff        columnar_snapshot.py: build the two newest sidecars and
+                       diff them (needs numpy)
+
+The scratch root is deleted afterwards unless --keep or --root is given.
+--json writes the report for comparing runs.
+
+CLI:
+  pipeline_bench.py [--users N] [fixture options] [--stages a,b] [--jobs J]
+                    [--root DIR] [--keep] [--json OUT]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from synth_fixtures import REPO_ROOT, add_fixture_args, fixture_kwargs, generate
+
+STAGES = ["classify_events", "classify_summary", "detector_feed_events", "events_logs", "eventifier", "detector"]
+OPTIONAL_STAGES = ["columnar_diff"]
+
+# Serves the fixture window instead of calling the API.
+FAKE_FETCH_HELPER = """#!/usr/bin/env bash
+# pipeline_bench.py: serve the synthetic window instead of calling the API.
+cat "$(cd "$(dirname "${BASH_SOURCE[0]}")/../.." && pwd)/.cache/raw_detect/window.jsonl"
+"""
+
+IO_FIELDS = ("rchar", "wchar", "syscr", "syscw", "read_bytes", "write_bytes")
+
+
+def read_proc_io() -> Dict[str, int]:
+    try:
+        with open("/proc/self/io", "r") as fh:
+            pairs = (line.split(":", 1) for line in fh)
+            return {k.strip(): int(v) for k, v in pairs if k.strip() in IO_FIELDS}
+    except OSError:
+        return {}
+
+
+def count_lines(path: str) -> int:
+    try:
+        with open(path, "rb") as fh:
+            return sum(buf.count(b"\n") for buf in iter(lambda: fh.read(1 << 20), b""))
+    except OSError:
+        return 0
+
+
+def run_stage(cmd: List[str], env: Dict[str, str], cwd: str) -> Dict[str, Any]:
+    """Run one stage and collect wall time, peak RSS and I/O counters."""
+    io_before = read_proc_io()
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull:
+        proc = subprocess.Popen(cmd, env=env, cwd=cwd, stdout=devnull, stderr=subprocess.PIPE)
+        stderr = proc.stderr.read() if proc.stderr else b""
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - started
+    io_after = read_proc_io()
+    return {
+        "seconds": round(elapsed, 3),
+        "returncode": proc.returncode,
+        "peak_rss_mb": round(rusage.ru_maxrss / 1024, 1),
+        "io": {k: io_after.get(k, 0) - io_before.get(k, 0) for k in IO_FIELDS if k in io_after},
+        "blocks_in": rusage.ru_inblock,
+        "blocks_out": rusage.ru_oublock,
+        "stderr_tail": stderr.decode("utf-8", "replace").strip().splitlines()[-3:] if proc.returncode else [],
+    }
+
+
+def prepare_root(root: str, args: argparse.Namespace) -> Dict[str, Any]:
+    shutil.copytree(
+        os.path.join(REPO_ROOT, "scripts"),
+        os.path.join(root, "scripts"),
+        ignore=shutil.ignore_patterns("__pycache__", "*.pyc"),
+    )
+    helper = os.path.join(root, "scripts", "helpers", "fetch_users_by_updated_at_window.sh")
+    with open(helper, "w") as fh:
+        fh.write(FAKE_FETCH_HELPER)
+    os.chmod(helper, 0o755)
+    return generate(root, **fixture_kwargs(args))
+
+
+def stage_plan(name: str, root: str, args: argparse.Namespace, manifest: Dict[str, Any]) -> Dict[str, Any]:
+    """Command, input size and output file for a stage."""
+    counts = manifest["counts"]
+    backlog = os.path.join(root, ".backlog")
+    events_queue = os.path.join(backlog, "events_queue.jsonl")
+    classify = os.path.join(root, "scripts", "monitoring", "classify_events.py")
+    if name == "classify_events":
+        return {"cmd": [sys.executable, classify, "--queue", events_queue], "events_in": True}
+    if name == "classify_summary":
+        cmd = [sys.executable, classify, "--queue", events_queue, "--summary", "--jobs", str(args.jobs)]
+        return {"cmd": cmd, "events_in": True}
+    if name == "detector_feed_events":
+        cmd = [sys.executable, os.path.join(root, "scripts", "agents", "detector_feed_events.py")]
+        return {"cmd": cmd, "users": counts["users"], "output": os.path.join(backlog, "events_logs.jsonl")}
+    if name == "events_logs":
+        cmd = [sys.executable, os.path.join(root, "scripts", "agents", "events_logs_generator.py")]
+        return {"cmd": cmd, "users": counts["users"], "output": os.path.join(backlog, "events_logs.jsonl"), "rewrites": True}
+    if name == "columnar_diff":
+        cmd = [sys.executable, os.path.join(root, "scripts", "agents", "columnar_snapshot.py"), "diff", "--events"]
+        return {"cmd": cmd, "users": counts["users"]}
+    if name == "eventifier":
+        cmd = ["bash", os.path.join(root, "scripts", "cron", "eventifier.sh")]
+        return {"cmd": cmd, "users": counts["pending"], "output": events_queue, "env": {"EVENT_BATCH": str(max(1, counts["pending"]))}}
+    cmd = ["bash", os.path.join(root, "scripts", "agents", "detector.sh")]
+    return {"cmd": cmd, "users": counts["users"], "output": events_queue}
+
+
+def run(args: argparse.Namespace, root: str) -> Dict[str, Any]:
+    manifest = prepare_root(root, args)
+    env = dict(os.environ, ROOT_DIR=root)
+    env.pop("HASH_DB", None)
+    env.pop("QUEUE_DB", None)
+    env.pop("BASELINE_DB", None)
+    report: Dict[str, Any] = {"fixture": manifest, "stages": {}}
+    for name in args.stages:
+        plan = stage_plan(name, root, args, manifest)
+        output = plan.get("output")
+        before = 0 if plan.get("rewrites") or not output else count_lines(output)
+        events_in = count_lines(os.path.join(root, ".backlog", "events_queue.jsonl")) if plan.get("events_in") else None
+        result = run_stage(plan["cmd"], dict(env, **plan.get("env", {})), root)
+        if events_in is not None:
+            result["events"] = events_in
+            result["users"] = None
+        else:
+            result["users"] = plan["users"]
+            result["events"] = count_lines(output) - before if output else 0
+        secs = result["seconds"] or 1e-9
+        result["users_per_s"] = round(result["users"] / secs, 1) if result["users"] is not None else None
+        result["events_per_s"] = round(result["events"] / secs, 1)
+        report["stages"][name] = result
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    counts = report["fixture"]["counts"]
+    lines = [
+        f"fixture: users={counts['users']} internal={counts['internal']} changed={counts['changed']} "
+        f"events={counts['events']} pending={counts['pending']} (generated in {report['fixture']['generated_in']}s)",
+        f"{'stage':<22}{'rc':>3}{'sec':>9}{'users/s':>11}{'events/s':>11}{'rss_mb':>8}"
+        f"{'rchar_mb':>10}{'wchar_mb':>10}{'syscr':>9}{'syscw':>9}",
+    ]
+    for name, r in report["stages"].items():
+        io = r["io"]
+        users_per_s = f"{r['users_per_s']:.0f}" if r["users_per_s"] is not None else "-"
+        lines.append(
+            f"{name:<22}{r['returncode']:>3}{r['seconds']:>9.2f}{users_per_s:>11}{r['events_per_s']:>11.0f}"
+            f"{r['peak_rss_mb']:>8.1f}{io.get('rchar', 0) / 1e6:>10.1f}{io.get('wchar', 0) / 1e6:>10.1f}"
+            f"{io.get('syscr', 0):>9}{io.get('syscw', 0):>9}"
+        )
+        for err in r["stderr_tail"]:
+            lines.append(f"    ! {err}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark pipeline stages on synthetic fixtures.")
+    add_fixture_args(parser)
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Comma-separated subset of: {', '.join(STAGES + OPTIONAL_STAGES)}")
+    parser.add_argument("--jobs", type=int, default=0, help="--jobs for classify_summary (default: 0 = all cores)")
+    parser.add_argument("--root", default=None, help="Scratch ROOT_DIR to use (kept afterwards)")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary ROOT_DIR")
+    parser.add_argument("--json", default=None, help="Also write the report as JSON here")
+    args = parser.parse_args()
+    args.stages = [s for s in args.stages.split(",") if s]
+    unknown = [s for s in args.stages if s not in STAGES + OPTIONAL_STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+
+    root: Optional[str] = args.root
+    cleanup = False
+    if root:
+        os.makedirs(root, exist_ok=True)
+    else:
+        root = tempfile.mkdtemp(prefix="pipeline_bench_")
+        cleanup = not args.keep
+    try:
+        report = run(args, root)
+    finally:
+        if cleanup:
+            shutil.rmtree(root, ignore_errors=True)
+    report["root"] = root if not cleanup else None
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(report, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Synthetic fixtures for offline benchmarks of the detection/event pipeline.
+
+Writes a deterministic, API-shaped dataset into a scratch ROOT_DIR so that the
+detector Python block, eventifier, detector_feed_events.py,
+events_logs_generator.py and classify_events.py can run without live data:
+
+  .cache/raw_detect/users_<stamp>.json   one JSON array per snapshot generation
+  .cache/raw_detect/users_latest.json    the newest generation
+  .cache/raw_detect/window.jsonl         the newest generation as JSONL (detector window)
+  logs/.eventifier_baseline/campus_<c>/user_<id>.json   generation 0 snapshots
+  .eventifier_baseline -> logs/.eventifier_baseline     (detector_feed_events.py)
+  exports/09_users/campus_<c>/user_<id>.json            newest full user (eventifier)
+  .backlog/detector_hashes.json          generation 0 fingerprints (legacy format)
+  .backlog/events_queue.jsonl            detector-shaped events, generation 0 -> newest
+  .backlog/events_pending.txt            changed uids for the eventifier (capped)
+  fixture.json                           parameters and counts
+
+Every user is generated from its own seeded RNG and written as it is produced,
+so memory stays flat from 1k to 1M users. Each snapshot generation applies the
+location / wallet / correction_point / name change rates independently;
+--new-rate users have no baseline or hash entry and surface as new_seen.
+
+CLI:
+  synth_fixtures.py --root DIR --users N [--campuses N] [--snapshots K]
+                    [--location-rate R] [--wallet-rate R] [--cp-rate R]
+                    [--name-rate R] [--new-rate R] [--seed S] [--no-user-files]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import IO, Any, Dict, List, Optional
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.insert(0, os.path.join(REPO_ROOT, "scripts", "agents"))
+
+from detector_core import (  # noqa: E402
+    EVENT_ORDER,
+    FingerprintEngine,
+    build_event_changes,
+    build_snapshot,
+    load_detector_config,
+    raw_snapshot,
+)
+
+INTERNAL_CAMPUS_ID = 21
+EXTERNAL_CAMPUS_IDS = [1, 9, 12, 13, 14, 16, 20, 22, 25, 26, 29, 30, 31, 32, 33, 35, 36, 37, 38, 39]
+FIRST_UID = 100000
+FIRST_NAMES = ["Ada", "Alan", "Grace", "Linus", "Margaret", "Dennis", "Barbara", "Ken", "Frances", "Edsger"]
+LAST_NAMES = ["Lovelace", "Turing", "Hopper", "Torvalds", "Hamilton", "Ritchie", "Liskov", "Thompson", "Allen", "Dijkstra"]
+GENERATION_SECONDS = 60
+PENDING_LIMIT = 5000
+
+
+class JsonArrayWriter:
+    """Streams one JSON value at a time into a top-level array."""
+
+    def __init__(self, path: str):
+        self.fh: IO[str] = open(path, "w", encoding="utf-8")
+        self.fh.write("[")
+        self.first = True
+
+    def write(self, value: Any) -> None:
+        if not self.first:
+            self.fh.write(",")
+        self.fh.write(json.dumps(value, separators=(",", ":")))
+        self.first = False
+
+    def close(self) -> None:
+        self.fh.write("]\n")
+        self.fh.close()
+
+
+def iso(ts: float) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(ts))
+
+
+def seat(rng: random.Random) -> str:
+    return f"c{rng.randint(1, 4)}r{rng.randint(1, 13)}p{rng.randint(1, 8)}"
+
+
+def make_user(uid: int, campus_id: int, rng: random.Random, ts: float) -> Dict[str, Any]:
+    login = f"synth{uid}"
+    first = rng.choice(FIRST_NAMES)
+    last = rng.choice(LAST_NAMES)
+    return {
+        "id": uid,
+        "email": f"{login}@student.42.example",
+        "login": login,
+        "first_name": first,
+        "last_name": last,
+        "usual_full_name": f"{first} {last}",
+        "displayname": f"{first} {last}",
+        "kind": "student",
+        "image": {"link": f"https://cdn.intra.42.fr/users/{login}.jpg"},
+        "staff?": False,
+        "correction_point": rng.randint(0, 20),
+        "pool_month": rng.choice(["july", "august", "september"]),
+        "pool_year": str(rng.randint(2019, 2025)),
+        "location": seat(rng) if rng.random() < 0.3 else None,
+        "wallet": rng.randint(0, 50) * 5,
+        "anonymize_date": None,
+        "data_erasure_date": None,
+        "created_at": iso(ts - 86400 * rng.randint(30, 2000)),
+        "updated_at": iso(ts),
+        "alumnized_at": None,
+        "alumni?": False,
+        "active?": True,
+        "campus_users": [
+            {"id": uid * 10, "user_id": uid, "campus_id": campus_id, "is_primary": True}
+        ],
+    }
+
+
+def evolve(user: Dict[str, Any], rng: random.Random, rates: Dict[str, float], ts: float) -> Dict[str, Any]:
+    """Next snapshot of a user with each change applied at its configured rate."""
+    nxt = dict(user)
+    changed = False
+    if rng.random() < rates["location"]:
+        nxt["location"] = None if user.get("location") else seat(rng)
+        changed = True
+    if rng.random() < rates["wallet"]:
+        nxt["wallet"] = max(0, user["wallet"] + rng.choice([-20, -10, 5, 10, 25]))
+        changed = True
+    if rng.random() < rates["cp"]:
+        nxt["correction_point"] = max(0, user["correction_point"] + rng.choice([-2, -1, 1, 2]))
+        changed = True
+    if rng.random() < rates["name"]:
+        nxt["last_name"] = rng.choice(LAST_NAMES)
+        nxt["usual_full_name"] = nxt["displayname"] = f"{nxt['first_name']} {nxt['last_name']}"
+        changed = True
+    if changed:
+        nxt["updated_at"] = iso(ts)
+    return nxt
+
+
+def detector_events(user: Dict[str, Any], baseline: Optional[Dict[str, Any]], ts: int) -> List[Dict[str, Any]]:
+    """Events the detector would append for this user (one per event type)."""
+    common = {
+        "user_id": user["id"],
+        "user_login": user["login"],
+        "campus_id": user["campus_users"][0]["campus_id"],
+        "updated_at": user["updated_at"],
+    }
+    if baseline is None:
+        return [dict(common, first_snapshot=True, types=["new_seen"], changes=[], source="detector", ts=ts)]
+    grouped = build_event_changes(build_snapshot(baseline), build_snapshot(user))
+    return [
+        dict(common, first_snapshot=False, types=[event_type], changes=grouped[event_type], source="detector", ts=ts)
+        for event_type in EVENT_ORDER
+        if event_type in grouped
+    ]
+
+
+def write_json(path: str, payload: Any, indent: Optional[int] = None) -> None:
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(payload, fh, indent=indent)
+
+
+def generate(
+    root: str,
+    users: int,
+    campuses: int = 8,
+    internal_share: float = 0.4,
+    snapshots: int = 3,
+    location_rate: float = 0.3,
+    wallet_rate: float = 0.1,
+    cp_rate: float = 0.1,
+    name_rate: float = 0.01,
+    new_rate: float = 0.02,
+    seed: int = 42,
+    user_files: bool = True,
+    pending_limit: int = PENDING_LIMIT,
+) -> Dict[str, Any]:
+    """Write the fixture tree under root and return its manifest."""
+    started = time.time()
+    raw_dir = os.path.join(root, ".cache", "raw_detect")
+    backlog_dir = os.path.join(root, ".backlog")
+    baseline_dir = os.path.join(root, "logs", ".eventifier_baseline")
+    exports_dir = os.path.join(root, "exports", "09_users")
+    for path in (raw_dir, backlog_dir, baseline_dir, exports_dir):
+        os.makedirs(path, exist_ok=True)
+    feed_baseline = os.path.join(root, ".eventifier_baseline")
+    if not os.path.lexists(feed_baseline):
+        os.symlink(os.path.relpath(baseline_dir, root), feed_baseline)
+
+    rates = {"location": location_rate, "wallet": wallet_rate, "cp": cp_rate, "name": name_rate}
+    externals = EXTERNAL_CAMPUS_IDS[: max(0, campuses - 1)] or [INTERNAL_CAMPUS_ID]
+    fingerprints = FingerprintEngine(load_detector_config(REPO_ROOT))
+    base_ts = float(int(started) - snapshots * GENERATION_SECONDS)
+    gen_ts = [base_ts + g * GENERATION_SECONDS for g in range(snapshots + 1)]
+
+    snapshot_writers = [
+        JsonArrayWriter(os.path.join(raw_dir, f"users_{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(gen_ts[g]))}.json"))
+        for g in range(1, snapshots + 1)
+    ]
+    latest = JsonArrayWriter(os.path.join(raw_dir, "users_latest.json"))
+    window = open(os.path.join(raw_dir, "window.jsonl"), "w", encoding="utf-8")
+    events_out = open(os.path.join(backlog_dir, "events_queue.jsonl"), "w", encoding="utf-8")
+    pending_out = open(os.path.join(backlog_dir, "events_pending.txt"), "w", encoding="utf-8")
+    hashes_out = open(os.path.join(backlog_dir, "detector_hashes.json"), "w", encoding="utf-8")
+    hashes_out.write("{")
+    created_dirs = set()
+
+    counts = {"users": users, "internal": 0, "new_seen": 0, "changed": 0, "events": 0, "pending": 0}
+    for i in range(users):
+        uid = FIRST_UID + i
+        rng = random.Random(seed * 1000003 + uid)
+        campus_id = INTERNAL_CAMPUS_ID if rng.random() < internal_share else rng.choice(externals)
+        history = [make_user(uid, campus_id, rng, gen_ts[0])]
+        for g in range(1, snapshots + 1):
+            history.append(evolve(history[-1], rng, rates, gen_ts[g]))
+        current = history[-1]
+        baseline = None if rng.random() < new_rate else history[0]
+
+        for writer, snap in zip(snapshot_writers, history[1:]):
+            writer.write(snap)
+        latest.write(current)
+        window.write(json.dumps(current, separators=(",", ":")) + "\n")
+
+        fingerprint_key = "internal" if campus_id == INTERNAL_CAMPUS_ID else "external"
+        counts["internal"] += fingerprint_key == "internal"
+        if baseline is not None:
+            if i > counts["new_seen"]:
+                hashes_out.write(", ")
+            entry = {
+                "hash": fingerprints.fingerprint(baseline, fingerprint_key),
+                "timestamp": gen_ts[0],
+                "campus_id": campus_id,
+                "fingerprint_key": fingerprint_key,
+                "snapshot": build_snapshot(baseline),
+            }
+            hashes_out.write(f"{json.dumps(str(uid))}: {json.dumps(entry)}")
+        else:
+            counts["new_seen"] += 1
+
+        if user_files:
+            campus_dir = f"campus_{campus_id}"
+            if campus_dir not in created_dirs:
+                os.makedirs(os.path.join(baseline_dir, campus_dir), exist_ok=True)
+                os.makedirs(os.path.join(exports_dir, campus_dir), exist_ok=True)
+                created_dirs.add(campus_dir)
+            if baseline is not None:
+                write_json(os.path.join(baseline_dir, campus_dir, f"user_{uid}.json"), raw_snapshot(baseline), indent=2)
+            write_json(os.path.join(exports_dir, campus_dir, f"user_{uid}.json"), current)
+
+        events = detector_events(current, baseline, int(gen_ts[-1]))
+        for event in events:
+            events_out.write(json.dumps(event) + "\n")
+        counts["events"] += len(events)
+        if baseline is None or events:
+            counts["changed"] += 1
+            if user_files and counts["pending"] < pending_limit:
+                pending_out.write(f"{uid}\n")
+                counts["pending"] += 1
+
+    hashes_out.write("}")
+    for handle in (hashes_out, window, events_out, pending_out):
+        handle.close()
+    for writer in snapshot_writers + [latest]:
+        writer.close()
+
+    manifest = {
+        "params": {
+            "users": users,
+            "campuses": len(set(externals) | {INTERNAL_CAMPUS_ID}),
+            "internal_share": internal_share,
+            "snapshots": snapshots,
+            "location_rate": location_rate,
+            "wallet_rate": wallet_rate,
+            "cp_rate": cp_rate,
+            "name_rate": name_rate,
+            "new_rate": new_rate,
+            "seed": seed,
+            "user_files": user_files,
+        },
+        "counts": counts,
+        "generated_in": round(time.time() - started, 3),
+    }
+    write_json(os.path.join(root, "fixture.json"), manifest, indent=2)
+    return manifest
+
+
+def add_fixture_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--users", type=int, default=1000, help="Users to generate (default: 1000)")
+    parser.add_argument("--campuses", type=int, default=8, help="Campuses including the internal one (default: 8)")
+    parser.add_argument("--internal-share", type=float, default=0.4, help="Share of users on campus 21 (default: 0.4)")
+    parser.add_argument("--snapshots", type=int, default=3, help="users_*.json generations (default: 3)")
+    parser.add_argument("--location-rate", type=float, default=0.3, help="Per-generation location change rate")
+    parser.add_argument("--wallet-rate", type=float, default=0.1, help="Per-generation wallet change rate")
+    parser.add_argument("--cp-rate", type=float, default=0.1, help="Per-generation correction_point change rate")
+    parser.add_argument("--name-rate", type=float, default=0.01, help="Per-generation last_name change rate")
+    parser.add_argument("--new-rate", type=float, default=0.02, help="Users without baseline/hash (new_seen)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--no-user-files",
+        dest="user_files",
+        action="store_false",
+        help="Skip per-user baseline/export files (and the eventifier inbox)",
+    )
+
+
+def fixture_kwargs(args: argparse.Namespace) -> Dict[str, Any]:
+    return {
+        "users": args.users,
+        "campuses": args.campuses,
+        "internal_share": args.internal_share,
+        "snapshots": max(1, args.snapshots),
+        "location_rate": args.location_rate,
+        "wallet_rate": args.wallet_rate,
+        "cp_rate": args.cp_rate,
+        "name_rate": args.name_rate,
+        "new_rate": args.new_rate,
+        "seed": args.seed,
+        "user_files": args.user_files,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate synthetic detector/eventifier fixtures.")
+    parser.add_argument("--root", required=True, help="Scratch ROOT_DIR to populate")
+    add_fixture_args(parser)
+    args = parser.parse_args()
+    manifest = generate(args.root, **fixture_kwargs(args))
+    print(json.dumps(manifest, indent=2))
+
+
+if __name__ == "__main__":
+    main()
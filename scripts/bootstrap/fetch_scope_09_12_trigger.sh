@@ -30,13 +30,14 @@ log "and fetches their nested data (achievements, projects, coalitions)"
 log ""
 
 # Check if backlog has content
-if [ ! -f "$BACKLOG_DIR/pending_users.txt" ] || [ ! -s "$BACKLOG_DIR/pending_users.txt" ]; then
+QUEUE_STORE="$ROOT_DIR/scripts/agents/queue_store.py"
+PENDING_COUNT=$(python3 "$QUEUE_STORE" len --file "$BACKLOG_DIR/pending_users.txt" 2>/dev/null || echo 0)
+if [ "$PENDING_COUNT" -eq 0 ]; then
     log "⚠️  No pending users in backlog"
     log "Backlog file: $BACKLOG_DIR/pending_users.txt"
     exit 0
 fi
 
-PENDING_COUNT=$(wc -l < "$BACKLOG_DIR/pending_users.txt")
 log "Found $PENDING_COUNT pending users to process"
 log ""
 log "Processing will occur automatically via:"
@@ -45,7 +46,7 @@ log "  - Fetches achievements_users, projects_users, coalitions_users"
 log "  - Inserts into DB and clears backlog"
 log ""
 log "Backlog monitoring:"
-tail -5 "$BACKLOG_DIR/pending_users.txt" | sed 's/^/  - /' | tee -a "$LOG_FILE"
+python3 "$QUEUE_STORE" list --file "$BACKLOG_DIR/pending_users.txt" --limit 5 | sed 's/^/  - /' | tee -a "$LOG_FILE"
 
 log ""
 log "════════════════════════════════════════════════════════════"
@@ -24,7 +24,8 @@ for logfile in detect_changes.log fetcher.log upserter.log; do
   if [[ -f "$filepath" ]]; then
     lines=$(wc -l < "$filepath")
     if [[ $lines -gt $TAIL_LIMIT ]]; then
-      tail -"$TAIL_LIMIT" "$filepath" > "${filepath}.tmp" && mv "${filepath}.tmp" "$filepath"
+      # Rewrite in place (same inode): db_upserter.py appends to upserter.log through a >> redirect
+      tail -"$TAIL_LIMIT" "$filepath" > "${filepath}.tmp" && cat "${filepath}.tmp" > "$filepath" && rm -f "${filepath}.tmp"
       echo "✓ Trimmed $logfile: $lines → $TAIL_LIMIT lines"
     fi
   fi
@@ -1,9 +1,13 @@
 #!/bin/bash
 
 # eventifier.sh - Process events_pending queue, diff exports vs baselines, emit JSONL events
-# Baselines: logs/.eventifier_baseline/user_<id>.json
+# Baselines: logs/.eventifier_baseline.db (SQLite; legacy logs/.eventifier_baseline/user_<id>.json imported once)
 # Events:    .backlog/events_queue.jsonl (append-only)
-# Queue:     .backlog/events_pending.txt (populated by fetcher)
+# Queue:     .backlog/queues.db via queue_store.py (.backlog/events_pending.txt is its inbox)
+# EVENTIFIER_FULL_DIFF=1 (env or agents.config) also diffs whole exports
+# (projects, achievements, ...) via object_diff.py against .backlog/object_cache.db;
+# paths the classify rules skip or ignore (updated_at, coalitions, ...) never
+# make an event on their own
 
 set -euo pipefail
 
@@ -12,53 +16,59 @@ BACKLOG_DIR="$ROOT_DIR/.backlog"
 LOG_DIR="$ROOT_DIR/logs"
 EXPORTS_DIR="$ROOT_DIR/exports/09_users"
 BASELINE_DIR="$LOG_DIR/.eventifier_baseline"
+BASELINE_DB="${BASELINE_DB:-$LOG_DIR/.eventifier_baseline.db}"
 
 EVENTS_PENDING="$BACKLOG_DIR/events_pending.txt"
 EVENTS_LOCK="$BACKLOG_DIR/events_pending.lock"
 EVENTS_QUEUE="$BACKLOG_DIR/events_queue.jsonl"
 EVENTS_QUEUE_LOCK="$BACKLOG_DIR/events_queue.lock"
+AGENTS_CONFIG="$ROOT_DIR/scripts/config/agents.config"
 
-mkdir -p "$BACKLOG_DIR" "$LOG_DIR" "$BASELINE_DIR"
+mkdir -p "$BACKLOG_DIR" "$LOG_DIR"
 touch "$EVENTS_PENDING" "$EVENTS_LOCK" "$EVENTS_QUEUE" "$EVENTS_QUEUE_LOCK"
 
 EVENT_BATCH="${EVENT_BATCH:-50}"
+EVENTIFIER_FULL_DIFF="${EVENTIFIER_FULL_DIFF:-}"
+if [[ -z "$EVENTIFIER_FULL_DIFF" && -f "$AGENTS_CONFIG" ]]; then
+  EVENTIFIER_FULL_DIFF=$(grep -E '^\s*EVENTIFIER_FULL_DIFF=' "$AGENTS_CONFIG" | head -1 | cut -d= -f2 | tr -d '"' | xargs || true)
+fi
+EVENTIFIER_FULL_DIFF="${EVENTIFIER_FULL_DIFF:-0}"
+QUEUE_STORE="$ROOT_DIR/scripts/agents/queue_store.py"
 
-# Acquire lock and pull a batch of IDs
-exec 9>"$EVENTS_LOCK"
-flock -x 9
-mapfile -t ID_ARR < <(head -n "$EVENT_BATCH" "$EVENTS_PENDING" | sed '/^$/d')
+# Pop a batch of IDs (removed from the queue in one transaction)
+mapfile -t ID_ARR < <(python3 "$QUEUE_STORE" pop --file "$EVENTS_PENDING" --lock "$EVENTS_LOCK" -n "$EVENT_BATCH")
 
 if [[ ${#ID_ARR[@]} -eq 0 ]]; then
-  flock -u 9
-  exec 9>&-
-  echo "eventifier: no IDs in events_pending.txt"
+  echo "eventifier: no IDs in events_pending queue"
   exit 0
 fi
 
-# Rewrite queue without the batch we pulled
-tmp_queue=$(mktemp)
-tail -n +"$(( ${#ID_ARR[@]} + 1 ))" "$EVENTS_PENDING" > "$tmp_queue" || true
-mv "$tmp_queue" "$EVENTS_PENDING"
-
-flock -u 9
-exec 9>&-
-
 ID_COUNT=${#ID_ARR[@]}
 ID_LIST="$(IFS=,; echo "${ID_ARR[*]}")"
-export ROOT_DIR BACKLOG_DIR EXPORTS_DIR BASELINE_DIR EVENTS_PENDING EVENTS_QUEUE EVENTS_QUEUE_LOCK
+export ROOT_DIR BACKLOG_DIR EXPORTS_DIR BASELINE_DIR BASELINE_DB EVENTS_PENDING EVENTS_QUEUE EVENTS_QUEUE_LOCK EVENTIFIER_FULL_DIFF
 export IDS="$ID_LIST"
 env | grep '^IDS=' >&2 || true
 echo "eventifier: ID_LIST='$ID_LIST'" >&2
 echo "eventifier: processing ${ID_COUNT} ids from queue" >&2
 
 python3 - << 'PY'
-import glob
 import json
 import os
+import sys
 import time
 
+sys.path.insert(0, os.path.join(os.environ["ROOT_DIR"], "scripts", "agents"))
+sys.path.insert(0, os.path.join(os.environ["ROOT_DIR"], "scripts", "monitoring"))
+from baseline_store import BaselineStore
+from detector_core import SNAPSHOT_FIELDS, build_changes, get_campus_id, raw_snapshot
+from location_index import LocationIndex
+from metrics import Metrics
+from object_diff import ObjectCache, ObjectDiffer, default_cache_path
+from path_rules import get_rules
+
 exports_dir = os.environ["EXPORTS_DIR"]
 baseline_dir = os.environ["BASELINE_DIR"]
+baseline_db = os.environ["BASELINE_DB"]
 events_queue = os.environ["EVENTS_QUEUE"]
 events_queue_lock = os.environ["EVENTS_QUEUE_LOCK"]
 
@@ -77,105 +87,30 @@ def load_json(path):
         return None
 
 
-def find_export(uid: str):
-    pattern = os.path.join(exports_dir, "campus_*", f"user_{uid}.json")
-    matches = glob.glob(pattern)
-    return matches[0] if matches else None
+metrics = Metrics("eventifier", os.environ["ROOT_DIR"])
 
+with metrics.timer("export_index"):
+    export_index = LocationIndex(exports_dir).refresh()
 
-def to_number(value):
-    try:
-        return float(value)
-    except (TypeError, ValueError):
-        return None
 
-
-def normalize_location(value):
-    if value in (None, ""):
-        return None
-    return value
-
-
-def snapshot(user):
-    return {
-        "login": user.get("login"),
-        "first_name": user.get("first_name"),
-        "last_name": user.get("last_name"),
-        "correction_point": user.get("correction_point"),
-        "wallet": user.get("wallet"),
-        "location": normalize_location(user.get("location")),
-    }
-
-
-EVENT_TYPE_ORDER = (
-    "data",
-    "connection",
-    "deconnection",
-    "evaluation",
-    "correction",
-    "wallet",
-)
-
-
-def build_changes(old_snap, new_snap):
-    changes = []
-    present_types = set()
-
-    for key in ("login", "first_name", "last_name"):
-        old = old_snap.get(key)
-        new = new_snap.get(key)
-        if old != new:
-            changes.append({"path": key, "old": old, "new": new})
-            present_types.add("data")
-
-    old_loc = normalize_location(old_snap.get("location"))
-    new_loc = normalize_location(new_snap.get("location"))
-    if old_loc != new_loc:
-        if old_loc is None and new_loc is not None:
-            changes.append({"path": "location", "old": None, "new": new_loc})
-            present_types.add("connection")
-        elif old_loc is not None and new_loc is None:
-            changes.append({"path": "location", "old": old_loc, "new": None})
-            present_types.add("deconnection")
-
-    old_cp = to_number(old_snap.get("correction_point"))
-    new_cp = to_number(new_snap.get("correction_point"))
-    if old_cp is not None and new_cp is not None and old_cp != new_cp:
-        changes.append({"path": "correction_point", "old": old_cp, "new": new_cp})
-        delta = new_cp - old_cp
-        if delta < 0:
-            present_types.add("evaluation")
-        elif delta > 0:
-            present_types.add("correction")
-
-    old_wallet = to_number(old_snap.get("wallet"))
-    new_wallet = to_number(new_snap.get("wallet"))
-    if old_wallet is not None and new_wallet is not None and old_wallet != new_wallet:
-        changes.append({"path": "wallet", "old": old_wallet, "new": new_wallet})
-        present_types.add("wallet")
-
-    ordered_types = [t for t in EVENT_TYPE_ORDER if t in present_types]
-    return changes, ordered_types
-
-
-def get_campus_id(user):
-    campus_users = user.get("campus_users", [])
-    if isinstance(campus_users, list) and campus_users:
-        for cu in campus_users:
-            if isinstance(cu, dict) and cu.get("is_primary"):
-                return cu.get("campus_id")
-        cu0 = campus_users[0]
-        if isinstance(cu0, dict):
-            return cu0.get("campus_id")
-    campus_list = user.get("campus", [])
-    if isinstance(campus_list, list) and campus_list:
-        c0 = campus_list[0]
-        if isinstance(c0, dict):
-            return c0.get("id")
-    return None
+def find_export(uid: str):
+    return export_index.path_for(uid)
 
 
 events = []
+change_events = []
+new_baselines = []
+
+baseline_store = BaselineStore(baseline_db)
+object_cache = ObjectCache(default_cache_path(os.environ["ROOT_DIR"])) if os.environ.get("EVENTIFIER_FULL_DIFF") == "1" else None
+object_differ = ObjectDiffer(object_cache) if object_cache is not None else None
+# Structural paths classify_events.py would skip or ignore are noise, not events
+path_rules = get_rules() if object_differ is not None else None
+with metrics.timer("baseline_read"):
+    baseline_store.ensure_migrated(baseline_dir)
+    baselines = baseline_store.get_many(uid for uid in ids if uid.isdigit())
+export_timer = metrics.timer("export_load")
+diff_timer = metrics.timer("diff")
 
 for uid in ids:
     export_path = find_export(uid)
@@ -189,7 +124,8 @@ for uid in ids:
         )
         continue
 
-    current = load_json(export_path)
+    with export_timer:
+        current = load_json(export_path)
     if not isinstance(current, dict):
         events.append(
             {
@@ -199,35 +135,39 @@ for uid in ids:
             }
         )
         continue
+    metrics.add_bytes("export_load", read=os.path.getsize(export_path))
 
-    baseline_path = os.path.join(baseline_dir, f"user_{uid}.json")
-    baseline_raw = load_json(baseline_path)
-    baseline_snap = snapshot(baseline_raw) if isinstance(baseline_raw, dict) else None
-    current_snap = snapshot(current)
+    baseline_raw = baselines.get(uid)
+    baseline_snap = raw_snapshot(baseline_raw) if isinstance(baseline_raw, dict) else None
+    current_snap = raw_snapshot(current)
 
     first_snapshot = baseline_snap is None
     changes = []
     types = []
     if not first_snapshot:
-        changes, types = build_changes(baseline_snap, current_snap)
-
-    try:
-        with open(baseline_path, "w") as f:
-            json.dump(current_snap, f, indent=2)
-    except Exception as e:
-        events.append(
-            {
-                "user_id": int(uid),
-                "error": f"failed to write baseline {baseline_path}: {e}",
-                "ts": int(time.time()),
-            }
-        )
-        continue
+        with diff_timer:
+            changes, types = build_changes(baseline_snap, current_snap)
+    if object_differ is not None:
+        # The six snapshot fields stay with build_changes(); the first sight of
+        # a user only seeds the object cache.
+        with diff_timer:
+            structural = object_differ.observe(uid, current)
+        extra = [
+            c for c in structural or []
+            if c["path"] not in SNAPSHOT_FIELDS and path_rules.match(c["path"])[0] not in ("skip", "ignore")
+        ]
+        if extra and not first_snapshot:
+            changes = changes + extra
+            types = types + ["structure"]
+
+    # Later duplicates in the same batch diff against this snapshot.
+    baselines[uid] = current_snap
+    new_baselines.append((uid, current_snap))
 
     if first_snapshot or not types:
         continue
 
-    events.append(
+    change_events.append(
         {
             "user_id": int(uid),
             "user_login": current.get("login"),
@@ -242,16 +182,43 @@ for uid in ids:
         }
     )
 
+# One atomic commit per batch; events are only emitted for committed baselines.
+try:
+    with metrics.timer("baseline_write"):
+        baseline_store.put_many(new_baselines)
+        if object_cache is not None:
+            object_cache.commit()
+    events.extend(change_events)
+except Exception as e:
+    for uid, _ in new_baselines:
+        events.append(
+            {
+                "user_id": int(uid),
+                "error": f"failed to write baseline batch to {baseline_db}: {e}",
+                "ts": int(time.time()),
+            }
+        )
+finally:
+    baseline_store.close()
+    if object_cache is not None:
+        object_cache.close()
+
 with open(events_queue_lock, "w") as lf:
     try:
-        import fcntl
-
-        fcntl.flock(lf, fcntl.LOCK_EX)
+        metrics.flock(lf, "events_queue")
     except Exception:
         pass
-    with open(events_queue, "a") as eq:
+    written = 0
+    with metrics.timer("events_append"), open(events_queue, "a") as eq:
         for ev in events:
-            eq.write(json.dumps(ev) + "\n")
+            line = json.dumps(ev) + "\n"
+            eq.write(line)
+            written += len(line)
+    metrics.add_bytes("events_append", written=written)
+
+metrics.count("users", len(ids))
+metrics.count("events", len(events))
+metrics.flush()
 
 print(f"eventifier: processed {len(ids)} ids, wrote {len(events)} event records to {events_queue}")
 PY
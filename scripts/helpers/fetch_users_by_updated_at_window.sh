@@ -12,6 +12,8 @@ set -euo pipefail
 #   FILTER_CURSUS_ID - Optional: limit to specific cursus ID (default: 21)
 #
 # Output: JSON array of matching users
+#         (OUTPUT_FORMAT=jsonl: one compact user object per line, streamed page by page
+#          without accumulating the whole window in memory)
 #
 # Examples:
 #   # Fetch users updated in last 30 seconds, kind=student, cursus 21
@@ -35,6 +37,7 @@ WINDOW_SECONDS="${1:-30}"
 FILTER_KIND="${FILTER_KIND:-${2:-student}}"
 FILTER_CURSUS_ID="${FILTER_CURSUS_ID:-${3:-21}}"
 FILTER_ALUMNI="${FILTER_ALUMNI:-false}"
+OUTPUT_FORMAT="${OUTPUT_FORMAT:-json}"
 
 # Validate window is numeric
 if ! [[ "$WINDOW_SECONDS" =~ ^[0-9]+$ ]]; then
@@ -65,7 +68,11 @@ while true; do
   if [[ "$page_count" == "0" ]]; then
     break
   fi
-  accum=$(printf '%s\n%s\n' "$accum" "$page_json" | jq -s 'add')
+  if [[ "$OUTPUT_FORMAT" == "jsonl" ]]; then
+    echo "$page_json" | jq -c '.[]'
+  else
+    accum=$(printf '%s\n%s\n' "$accum" "$page_json" | jq -s 'add')
+  fi
   page=$((page + 1))
   sleep 1
 done
@@ -73,4 +80,6 @@ done
 # Filter out alumni_p==true (keeps null and false)
 
 # Emit accumulated response (alumni already filtered server-side)
-echo "$accum"
+if [[ "$OUTPUT_FORMAT" != "jsonl" ]]; then
+  echo "$accum"
+fi
@@ -7,16 +7,35 @@
 #        respect_global_rate_limit "6.0"  # wait until 6 seconds passed since last call
 #
 # Design:
-#   - Lock file: .backlog/rate_limit.lock
-#   - Timestamp file: .backlog/rate_limit.timestamp
-#   - Each fetcher acquires lock, checks delay, sleeps if needed, updates timestamp
+#   - Token bucket shared with backlog_worker.sh/fetcher.sh (scripts/agents/api_client.py):
+#     state in .backlog/rate_limit.bucket, float precision. Rate and burst are the
+#     same API_RATE_PER_HOUR / API_RATE_BURST (env or agents.config) the other
+#     bucket users pass, so every caller refills the shared state identically
+#   - Fallback when python3 is unavailable (the only place the delay argument is used):
+#     - Lock file: .backlog/rate_limit.lock
+#     - Timestamp file: .backlog/rate_limit.timestamp
+#     - Each fetcher acquires lock, checks delay, sleeps if needed, updates timestamp
 #   - This ensures synchronized access to API across all fetcher instances
 
 LOCK_FILE="${BACKLOG_DIR:-./.backlog}/rate_limit.lock"
 TIMESTAMP_FILE="${BACKLOG_DIR:-./.backlog}/rate_limit.timestamp"
+RATE_LIMIT_API_CLIENT="$(cd "$(dirname "${BASH_SOURCE[0]}")/../agents" && pwd)/api_client.py"
+RATE_LIMIT_CONFIG="$(cd "$(dirname "${BASH_SOURCE[0]}")/../config" && pwd)/agents.config"
+for key in API_RATE_PER_HOUR API_RATE_BURST; do
+  if [[ -z "${!key:-}" && -f "$RATE_LIMIT_CONFIG" ]]; then
+    printf -v "$key" '%s' "$(grep -E "^\s*${key}=" "$RATE_LIMIT_CONFIG" | head -1 | cut -d= -f2 | tr -d '"')"
+  fi
+done
+API_RATE_PER_HOUR="${API_RATE_PER_HOUR:-1200}"
+API_RATE_BURST="${API_RATE_BURST:-2}"
 
 respect_global_rate_limit() {
   local delay_seconds="${1:-6.0}"
+
+  if python3 "$RATE_LIMIT_API_CLIENT" --bucket "${BACKLOG_DIR:-./.backlog}/rate_limit.bucket" \
+      --rate-per-hour "$API_RATE_PER_HOUR" --burst "$API_RATE_BURST" acquire 2>/dev/null; then
+    return 0
+  fi
   
   # Acquire exclusive lock
   exec 9>"$LOCK_FILE"
@@ -10,17 +10,58 @@ according to the user-facing event types we care about:
 - achievements touched
 - stable identity fields (login / first_name / last_name)
 It also surfaces any remaining paths as "other" so we can spot mismatches.
-
-This is read-only; it never mutates queues or baselines.
+Which change paths map to which category (and which are ignored) is declared
+in scripts/config/classify_rules.json and compiled by path_rules.py.
+
+With --follow it tails the queue like a streaming consumer: new lines are read
+in batches, and the byte offset of the last printed event is checkpointed
+(inode + offset, written atomically) so a restart resumes where it stopped.
+A truncated or rotated queue is detected and read again from byte 0.
+
+With --jobs N (N > 1, 0 = all cores) a whole-file audit is split into byte
+ranges that end on newlines; each range is parsed and classified in a worker
+process and the rendered results are printed in file order, identical to the
+single-process output. --summary prints aggregate label counts (overall, per
+campus, per event type and per hour) as JSON instead of every event.
+
+With --archive the compacted segments written by events_archive.py compact
+(.backlog/events_archive) are read first, in order, then the live queue; with
+--jobs each compressed block is one work unit. --follow only tails the live
+queue.
+
+It never mutates queues or baselines. It does write files of its own: the
+--follow checkpoint, and its stage metrics (.backlog/metrics/classify_events.*
+and one line per run in logs/metrics.jsonl; set METRICS_DISABLE=1 to keep
+them in memory only).
 """
 
 import argparse
+from collections import Counter, defaultdict
 from datetime import datetime, timezone
+import itertools
 import json
+import multiprocessing
 import os
-from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import re
+import signal
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from path_rules import DEFAULT_RULES_PATH, PathRules, get_rules
+
+ROOT = os.environ.get("ROOT_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "agents"))
+from metrics import Metrics  # noqa: E402
+from events_archive import EventArchive, read_block_file  # noqa: E402
 
 DEFAULT_QUEUE = ".backlog/events_queue.jsonl"
+DEFAULT_ARCHIVE = ".backlog/events_archive"
+DEFAULT_CHECKPOINT = ".backlog/classify_events.offset"
+FOLLOW_READ_BYTES = 1 << 20
+FOLLOW_POLL_SECONDS = 1.0
+BATCH_CHUNK_BYTES = 8 << 20
+METRICS_FLUSH_SECONDS = 60.0
 
 
 def to_number(value: Any) -> Optional[float]:
@@ -42,20 +83,129 @@ def load_events(path: str) -> Iterable[Dict[str, Any]]:
                 continue
 
 
-IGNORE_SUFFIXES = (
-    "updated_at",
-    "created_at",
-    "marked_at",
-    "anonymize_date",
-    "data_erasure_date",
-)
-
+def load_checkpoint(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            state = json.load(fh)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return state if isinstance(state, dict) else {}
+
+
+def save_checkpoint(path: str, state: Dict[str, Any]) -> None:
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(state, fh)
+    os.replace(tmp, path)
+
+
+class EventTail:
+    """Incremental reader over an append-only JSONL file with a byte-offset checkpoint.
+
+    read_batch() returns (end_offset, event) pairs for the complete lines that
+    arrived since the last call; a trailing partial line stays buffered until
+    its newline is written. commit(end_offset) persists the resume point.
+    """
+
+    def __init__(self, path: str, checkpoint_path: str, read_bytes: int = FOLLOW_READ_BYTES):
+        self.path = path
+        self.checkpoint_path = checkpoint_path
+        self.read_bytes = read_bytes
+        self.fh = None
+        self.inode: Optional[int] = None
+        self.offset = 0  # file offset of the first byte not yet split into lines
+        self.buffer = b""
+        self.events = 0
+        self._open(load_checkpoint(checkpoint_path))
+
+    def _open(self, resume: Optional[Dict[str, Any]]) -> None:
+        try:
+            fh = open(self.path, "rb")
+        except FileNotFoundError:
+            self.fh = None
+            return
+        st = os.fstat(fh.fileno())
+        offset = 0
+        if resume and resume.get("inode") == st.st_ino:
+            saved = resume.get("offset")
+            if isinstance(saved, int) and 0 <= saved <= st.st_size:
+                offset = saved
+                self.events = int(resume.get("events") or 0)
+        fh.seek(offset)
+        self.fh = fh
+        self.inode = st.st_ino
+        self.offset = offset
+        self.buffer = b""
+
+    def _check_reset(self) -> None:
+        """Called at EOF: reopen after rotation, rewind after truncation."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if self.fh is None or st.st_ino != self.inode:
+            if self.fh is not None:
+                self.fh.close()
+            self._open(None)
+        elif st.st_size < self.offset + len(self.buffer):
+            self.fh.seek(0)
+            self.offset = 0
+            self.buffer = b""
+
+    def read_batch(self) -> List[Tuple[int, Dict[str, Any]]]:
+        if self.fh is None:
+            self._check_reset()
+            if self.fh is None:
+                return []
+        chunk = self.fh.read(self.read_bytes)
+        if not chunk:
+            self._check_reset()
+            return []
+        data = self.buffer + chunk
+        cut = data.rfind(b"\n") + 1
+        if not cut:
+            self.buffer = data
+            return []
+        self.buffer = data[cut:]
+        out: List[Tuple[int, Dict[str, Any]]] = []
+        pos = self.offset
+        for line in data[:cut].split(b"\n")[:-1]:
+            pos += len(line) + 1
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                out.append((pos, json.loads(line)))
+            except ValueError:
+                continue
+        self.offset += cut
+        return out
+
+    def commit(self, end_offset: int, events: int = 0) -> None:
+        self.events += events
+        save_checkpoint(
+            self.checkpoint_path,
+            {
+                "path": os.path.abspath(self.path),
+                "inode": self.inode,
+                "offset": end_offset,
+                "events": self.events,
+                "updated_at": int(time.time()),
+            },
+        )
 
-def is_ignore_path(path: str) -> bool:
-    return path.endswith(IGNORE_SUFFIXES)
+    def close(self) -> None:
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
 
 
-def classify_event(event: Dict[str, Any], internal_campus_id: int) -> Dict[str, Any]:
+def classify_event(
+    event: Dict[str, Any], internal_campus_id: int, rules: Optional[PathRules] = None
+) -> Dict[str, Any]:
+    match = (rules or get_rules()).match
     campus_id = event.get("campus_id")
     changes = event.get("changes", [])
 
@@ -79,14 +229,16 @@ def classify_event(event: Dict[str, Any], internal_campus_id: int) -> Dict[str,
         new = change.get("new")
         if not path:
             continue
-        if path.startswith("coalitions"):
+        # One memoized lookup per path; rules come from scripts/config/classify_rules.json.
+        category, idx, field = match(path)
+        if category == "skip":
             continue
-        if is_ignore_path(path):
+        if category == "ignore":
             ignored_changes.append({"path": path, "old": old, "new": new})
             continue
 
         # Location events.
-        if path.endswith("location"):
+        if category == "location":
             if campus_id == internal_campus_id:
                 if connection is None or path == "location":
                     connection = (path, old, new)
@@ -95,7 +247,7 @@ def classify_event(event: Dict[str, Any], internal_campus_id: int) -> Dict[str,
             continue
 
         # Wallet events.
-        if path.endswith("wallet"):
+        if category == "wallet":
             if campus_id == internal_campus_id:
                 old_n = to_number(old)
                 new_n = to_number(new)
@@ -109,7 +261,7 @@ def classify_event(event: Dict[str, Any], internal_campus_id: int) -> Dict[str,
             continue
 
         # Correction / evaluation.
-        if path.endswith("correction_point"):
+        if category == "correction_point":
             old_n = to_number(old)
             new_n = to_number(new)
             if old_n is not None and new_n is not None:
@@ -120,28 +272,21 @@ def classify_event(event: Dict[str, Any], internal_campus_id: int) -> Dict[str,
             continue
 
         # Achievements.
-        if path.startswith("achievements["):
-            idx = path.split("]")[0].split("[", 1)[1]
-            bucket = achievements.setdefault(idx, {})
-            field = path.split("].", 1)[1] if "]." in path else path
-            bucket[field] = {"old": old, "new": new}
+        if category == "achievements":
+            achievements.setdefault(idx, {})[field] = {"old": old, "new": new}
             continue
 
         # Projects.
-        if path.startswith("projects_users["):
-            idx = path.split("]")[0].split("[", 1)[1]
-            bucket = projects.setdefault(idx, {})
-            field = path.split("].", 1)[1] if "]." in path else path
-            bucket[field] = {"old": old, "new": new}
+        if category == "projects":
+            projects.setdefault(idx, {})[field] = {"old": old, "new": new}
             if field == "retriable_at":
                 retry_projects.add(idx)
             if field == "status":
                 project_status[idx] = (old, new)
             continue
 
-        leaf = path.split(".")[-1]
-        if leaf in ("login", "first_name", "last_name"):
-            data_changes.append((leaf, old, new))
+        if category == "data":
+            data_changes.append((field, old, new))
             continue
 
         other_paths.add(path)
@@ -199,6 +344,248 @@ def classify_event(event: Dict[str, Any], internal_campus_id: int) -> Dict[str,
     }
 
 
+def format_event(event: Dict[str, Any], classification: Dict[str, Any]) -> str:
+    """Rendered event block without its "[idx] " prefix (index is assigned by the caller)."""
+    labels = classification["labels"] or ["(no labels)"]
+    ts_value = event.get("ts")
+    ts_human = "-"
+    if isinstance(ts_value, (int, float)):
+        ts_human = datetime.fromtimestamp(ts_value, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%SZ")
+    user_name = event.get('user_login') or event.get('user_name') or '-'
+    lines = [
+        f"user={event.get('user_id')} user_name={user_name} "
+        f"campus={event.get('campus_id')} [{', '.join(labels)}] ts={ts_human}"
+    ]
+    if labels == ["(no labels)"]:
+        if classification.get("unknown_changes"):
+            lines.append("  unclassified changes:")
+            for ch in classification["unknown_changes"]:
+                lines.append(f"    - {ch['path']}: {ch['old']} -> {ch['new']}")
+        elif classification.get("ignored_changes"):
+            lines.append("  changes (ignored by detector):")
+            for ch in classification["ignored_changes"]:
+                lines.append(f"    - {ch['path']}: {ch['old']} -> {ch['new']}")
+    return "\n".join(lines) + "\n"
+
+
+def print_event(idx: int, event: Dict[str, Any], classification: Dict[str, Any]) -> None:
+    print(f"[{str(idx).zfill(2)}] {format_event(event, classification)}")
+
+
+# -- batch mode -------------------------------------------------------------
+def label_kind(label: str) -> str:
+    """Label without its values: "wallet 10->12 (Δ +2)" -> "wallet"."""
+    if label.startswith("error:"):
+        return label
+    return re.split(r"[\s\[(]", label, 1)[0]
+
+
+def new_summary() -> Dict[str, Any]:
+    return {
+        "events": 0,
+        "labels": Counter(),
+        "per_campus": defaultdict(Counter),
+        "per_type": defaultdict(Counter),
+        "per_hour": defaultdict(Counter),
+    }
+
+
+def add_to_summary(summary: Dict[str, Any], event: Dict[str, Any], classification: Dict[str, Any]) -> None:
+    kinds = [label_kind(label) for label in classification["labels"]] or ["unlabeled"]
+    ts_value = event.get("ts")
+    hour = "-"
+    if isinstance(ts_value, (int, float)):
+        hour = datetime.fromtimestamp(ts_value, tz=timezone.utc).strftime("%Y-%m-%dT%H:00Z")
+    summary["events"] += 1
+    summary["labels"].update(kinds)
+    summary["per_campus"][str(event.get("campus_id"))].update(kinds)
+    for event_type in event.get("types") or ["unknown"]:
+        summary["per_type"][str(event_type)].update(kinds)
+    summary["per_hour"][hour].update(kinds)
+
+
+def merge_summary(into: Dict[str, Any], part: Dict[str, Any]) -> None:
+    into["events"] += part["events"]
+    into["labels"].update(part["labels"])
+    for key in ("per_campus", "per_type", "per_hour"):
+        for group, counts in part[key].items():
+            into[key][group].update(counts)
+
+
+def summary_to_json(summary: Dict[str, Any]) -> Dict[str, Any]:
+    def counts(counter: Counter) -> Dict[str, int]:
+        return dict(sorted(counter.items()))
+
+    out: Dict[str, Any] = {"events": summary["events"], "labels": counts(summary["labels"])}
+    for key in ("per_campus", "per_type", "per_hour"):
+        out[key] = {group: counts(c) for group, c in sorted(summary[key].items())}
+    return out
+
+
+def chunk_ranges(path: str, chunk_bytes: int) -> List[Tuple[int, int]]:
+    """Split a file into [start, end) byte ranges that each end on a newline."""
+    size = os.path.getsize(path)
+    ranges: List[Tuple[int, int]] = []
+    start = 0
+    with open(path, "rb") as fh:
+        while start < size:
+            end = start + chunk_bytes
+            if end >= size:
+                end = size
+            else:
+                fh.seek(end)
+                fh.readline()
+                end = fh.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def iter_range(path: str, start: int, end: int) -> Iterator[Dict[str, Any]]:
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        pos = start
+        while pos < end:
+            line = fh.readline()
+            if not line:
+                break
+            pos += len(line)
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def iter_block(path: str, codec: str, offset: int, length: int) -> Iterator[Dict[str, Any]]:
+    for line in read_block_file(path, codec, offset, length):
+        try:
+            yield json.loads(line)
+        except ValueError:
+            continue
+
+
+def iter_source(source: Tuple[Any, ...]) -> Iterator[Dict[str, Any]]:
+    """("range", path, start, end) of the live queue or ("block", path, codec, offset, length) of a segment."""
+    if source[0] == "block":
+        return iter_block(*source[1:])
+    return iter_range(*source[1:])
+
+
+def archive_sources(archive_dir: Optional[str]) -> List[Tuple[Any, ...]]:
+    if not archive_dir:
+        return []
+    return [("block",) + task for task in EventArchive(ROOT, archive_dir).block_tasks()]
+
+
+def load_archived_events(archive_dir: Optional[str]) -> Iterator[Dict[str, Any]]:
+    for source in archive_sources(archive_dir):
+        yield from iter_source(source)
+
+
+def classify_range(task: Tuple[Tuple[Any, ...], int, bool, str]) -> Any:
+    """Pool worker: a summary for the source, or one (labelled, text) pair per event."""
+    source, internal_campus_id, summarize, rules_path = task
+    rules = get_rules(rules_path)
+    if summarize:
+        summary = new_summary()
+        for event in iter_source(source):
+            add_to_summary(summary, event, classify_event(event, internal_campus_id, rules))
+        return summary
+    out: List[Tuple[bool, str]] = []
+    for event in iter_source(source):
+        classification = classify_event(event, internal_campus_id, rules)
+        out.append((bool(classification["labels"]), format_event(event, classification)))
+    return out
+
+
+def run_batch(args: argparse.Namespace, internal_campus_id: int, metrics: Metrics) -> None:
+    """Classify byte-range chunks on a process pool and merge results in file order."""
+    metrics.add_bytes("classify_chunk", read=os.path.getsize(args.queue))
+    sources = archive_sources(args.archive)
+    sources += [("range", args.queue, start, end) for start, end in chunk_ranges(args.queue, args.chunk_bytes)]
+    tasks = [(source, internal_campus_id, args.summary, args.rules) for source in sources]
+    jobs = args.jobs or os.cpu_count() or 1
+    pool = multiprocessing.Pool(min(jobs, len(tasks))) if jobs > 1 and len(tasks) > 1 else None
+    results = pool.imap(classify_range, tasks) if pool else map(classify_range, tasks)
+    # In the parent, classify_chunk is the wait for each chunk in file order.
+    results = metrics.timed_iter("classify_chunk", results)
+    idx = 0
+    try:
+        if args.summary:
+            summary = new_summary()
+            for part in results:
+                merge_summary(summary, part)
+            idx = summary["events"]
+            print(json.dumps(summary_to_json(summary), indent=2, ensure_ascii=False))
+            return
+        shown = 0
+        for part in results:
+            for labelled, text in part:
+                idx += 1
+                if args.unknown_only and labelled:
+                    continue
+                shown += 1
+                if args.limit and shown > args.limit:
+                    return
+                print(f"[{str(idx).zfill(2)}] {text}")
+    finally:
+        metrics.count("events", idx)
+        if pool:
+            pool.terminate()
+            pool.join()
+
+
+def follow(args: argparse.Namespace, internal_campus_id: int, metrics: Metrics) -> None:
+    """Tail the queue forever, printing new events and checkpointing after each batch."""
+    tail = EventTail(args.queue, args.checkpoint, args.read_bytes)
+    rules = get_rules(args.rules)
+    classify_timer = metrics.timer("classify")
+    last_flush = time.monotonic()
+    # SIGTERM behaves like Ctrl-C so the checkpoint is flushed on the way out.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    idx = tail.events
+    shown = 0
+    try:
+        while True:
+            offset = tail.offset
+            batch = tail.read_batch()
+            metrics.add_bytes("read_batch", read=max(0, tail.offset - offset))
+            if time.monotonic() - last_flush >= METRICS_FLUSH_SECONDS:
+                metrics.flush()
+                last_flush = time.monotonic()
+            if not batch:
+                time.sleep(args.poll_interval)
+                continue
+            processed = 0
+            limit_reached = False
+            for end_offset, event in batch:
+                with classify_timer:
+                    classification = classify_event(event, internal_campus_id, rules)
+                idx += 1
+                processed += 1
+                if args.unknown_only and classification["labels"]:
+                    continue
+                shown += 1
+                print_event(idx, event, classification)
+                if args.limit and shown >= args.limit:
+                    limit_reached = True
+                    break
+            sys.stdout.flush()
+            # Resume after the last printed event, or after the whole batch.
+            tail.commit(end_offset if limit_reached else tail.offset, processed)
+            metrics.count("events", processed)
+            if limit_reached:
+                return
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tail.close()
+        metrics.flush()
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(
         description="Classify eventifier JSONL entries into user-facing event types."
@@ -225,6 +612,57 @@ def main() -> None:
         default=None,
         help="Override internal campus id (defaults to CAMPUS_ID env or 21).",
     )
+    parser.add_argument(
+        "--rules",
+        default=DEFAULT_RULES_PATH,
+        help="Change-path rules config (default: scripts/config/classify_rules.json)",
+    )
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="Keep reading new events as they are appended (resumes from --checkpoint).",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default=DEFAULT_CHECKPOINT,
+        help=f"Byte-offset checkpoint used by --follow (default: {DEFAULT_CHECKPOINT})",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=FOLLOW_POLL_SECONDS,
+        help=f"Seconds to wait at end of file in --follow mode (default: {FOLLOW_POLL_SECONDS})",
+    )
+    parser.add_argument(
+        "--read-bytes",
+        type=int,
+        default=FOLLOW_READ_BYTES,
+        help=f"Bytes read per batch in --follow mode (default: {FOLLOW_READ_BYTES})",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Worker processes for batch classification (0 = all cores, default: 1).",
+    )
+    parser.add_argument(
+        "--chunk-bytes",
+        type=int,
+        default=BATCH_CHUNK_BYTES,
+        help=f"Approximate bytes per batch chunk (default: {BATCH_CHUNK_BYTES})",
+    )
+    parser.add_argument(
+        "--summary",
+        action="store_true",
+        help="Print label counts per campus, event type and hour (JSON) instead of each event.",
+    )
+    parser.add_argument(
+        "--archive",
+        nargs="?",
+        const=DEFAULT_ARCHIVE,
+        default=None,
+        help=f"Also read compacted segments before the live queue (default dir: {DEFAULT_ARCHIVE})",
+    )
     args = parser.parse_args()
 
     internal_campus_id = (
@@ -233,37 +671,42 @@ def main() -> None:
         else int(os.environ.get("CAMPUS_ID", os.environ.get("INTERNAL_CAMPUS_ID", 21)))
     )
 
+    metrics = Metrics("classify_events", ROOT)
+    if args.follow:
+        follow(args, internal_campus_id, metrics)
+        return
+
+    if args.summary or args.jobs != 1:
+        try:
+            run_batch(args, internal_campus_id, metrics)
+        finally:
+            metrics.flush()
+        return
+
+    rules = get_rules(args.rules)
+    classify_timer = metrics.timer("classify")
+    render_timer = metrics.timer("render")
     shown = 0
-    for idx, event in enumerate(load_events(args.queue), start=1):
-        classification = classify_event(event, internal_campus_id)
-        labels = classification["labels"]
-        if args.unknown_only:
-            if labels:
-                continue
-        shown += 1
-        if args.limit and shown > args.limit:
-            break
-
-        labels = labels or ["(no labels)"]
-        ts_value = event.get("ts")
-        ts_human = "-"
-        if isinstance(ts_value, (int, float)):
-            ts_human = datetime.fromtimestamp(ts_value, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%SZ")
-        user_name = event.get('user_login') or event.get('user_name') or '-'
-        print(
-            f"[{str(idx).zfill(2)}] user={event.get('user_id')} user_name={user_name} "
-            f"campus={event.get('campus_id')} [{', '.join(labels)}] ts={ts_human}"
-        )
-        if labels == ["(no labels)"]:
-            if classification.get("unknown_changes"):
-                print("  unclassified changes:")
-                for ch in classification["unknown_changes"]:
-                    print(f"    - {ch['path']}: {ch['old']} -> {ch['new']}")
-            elif classification.get("ignored_changes"):
-                print("  changes (ignored by detector):")
-                for ch in classification["ignored_changes"]:
-                    print(f"    - {ch['path']}: {ch['old']} -> {ch['new']}")
-        print()
+    idx = 0
+    try:
+        events = itertools.chain(load_archived_events(args.archive), load_events(args.queue))
+        for idx, event in enumerate(metrics.timed_iter("json_load", events), start=1):
+            with classify_timer:
+                classification = classify_event(event, internal_campus_id, rules)
+            labels = classification["labels"]
+            if args.unknown_only:
+                if labels:
+                    continue
+            shown += 1
+            if args.limit and shown > args.limit:
+                break
+            with render_timer:
+                print_event(idx, event, classification)
+        else:
+            metrics.add_bytes("json_load", read=os.path.getsize(args.queue))
+    finally:
+        metrics.count("events", idx)
+        metrics.flush()
 
 
 if __name__ == "__main__":
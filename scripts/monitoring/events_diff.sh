@@ -2,7 +2,8 @@
 set -euo pipefail
 
 # events_diff.sh - Inspect the latest events emitted by detector.
-# - Reads from .backlog/events_queue.jsonl (append-only log).
+# - Reads from .backlog/events_queue.jsonl (append-only log) and, once that
+#   has been compacted, the tail of .backlog/events_archive.
 # - Shows the last N entries with their change summary (types + fields).
 # - Does not mutate the queue.
 
@@ -13,27 +14,30 @@ EVENTS_QUEUE="$BACKLOG_DIR/events_queue.jsonl"
 DEFAULT_LIMIT=50
 LIMIT="${1:-$DEFAULT_LIMIT}"
 
-export EVENTS_QUEUE LIMIT
+export ROOT_DIR EVENTS_QUEUE LIMIT
 
 python3 - << 'PY'
 import json, os, sys, time
 
+sys.path.insert(0, os.path.join(os.environ["ROOT_DIR"], "scripts", "agents"))
+from events_archive import EventArchive
+
 queue_file = os.environ["EVENTS_QUEUE"]
 limit = int(os.environ.get("LIMIT", "50"))
 
-if not os.path.isfile(queue_file):
+archive = EventArchive(os.environ["ROOT_DIR"], queue_path=queue_file)
+counts = archive.counts()
+if not os.path.isfile(queue_file) and not counts["archived"]:
     print(f"❌ events_queue file not found: {queue_file}", file=sys.stderr)
     sys.exit(1)
 
-with open(queue_file, "r") as f:
-    lines = [line.strip() for line in f if line.strip()]
-
-if not lines:
+events = [line.decode("utf-8", "replace") for line in archive.tail(limit)]
+if not events:
     print("No events recorded yet.")
     sys.exit(0)
 
-events = lines[-limit:]
-print(f"=== Last {len(events)} events (tail of events_queue) ===")
+print(f"=== Last {len(events)} events (tail of events_queue; "
+      f"{counts['total']} recorded, {counts['archived']} archived) ===")
 for raw in events:
     try:
         ev = json.loads(raw)
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Compiled change-path dispatch for classify_events.py.
+
+The category rules (which change paths are skipped, ignored, or mapped to
+location / wallet / correction_point / achievements / projects / data) live in
+scripts/config/classify_rules.json instead of an if/endswith chain. They are
+compiled once into a prefix trie and a suffix trie (reversed patterns); a path
+is walked through both and the lowest-numbered matching rule wins, which is
+exactly the first-match order of the old chain. Results, including the parsed
+slot and field of indexed paths like projects_users[3].status, are memoized
+per path, so repeated paths cost one dict lookup.
+
+The memo is where the speedup comes from. An uncached trie walk is slower
+than the old chain (`bench` on the sample paths: ~3.0 us vs ~1.3 us per
+change), because it steps through the path one character at a time in Python
+while str.startswith/endswith run in C. Change paths repeat heavily, so
+nearly every lookup is a memo hit (~0.12 us).
+
+Rule keys:
+  category  one of CATEGORIES
+  prefix    path starts with any of these
+  suffix    path ends with any of these
+  leaf      last dot-separated segment equals one of these
+            (prefix/suffix/leaf take a list of strings, or a single string)
+  indexed   prefix ends with "[": split "<prefix>N].field" into ("N", "field")
+
+A missing or unreadable config falls back to DEFAULT_RULES, which reproduce
+the historical hardcoded behaviour.
+
+CLI:
+  path_rules.py match [--rules PATH] PATH [PATH...]
+  path_rules.py bench [--rules PATH] [--queue PATH] [--rounds N]
+"""
+
+import argparse
+import functools
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "config", "classify_rules.json")
+MEMO_SIZE = 1 << 16
+
+CATEGORIES = ("skip", "ignore", "location", "wallet", "correction_point", "achievements", "projects", "data")
+OTHER = "other"
+
+DEFAULT_RULES: List[Dict[str, Any]] = [
+    {"category": "skip", "prefix": ["coalitions"]},
+    {"category": "ignore", "suffix": ["updated_at", "created_at", "marked_at", "anonymize_date", "data_erasure_date"]},
+    {"category": "location", "suffix": ["location"]},
+    {"category": "wallet", "suffix": ["wallet"]},
+    {"category": "correction_point", "suffix": ["correction_point"]},
+    {"category": "achievements", "prefix": ["achievements["], "indexed": True},
+    {"category": "projects", "prefix": ["projects_users["], "indexed": True},
+    {"category": "data", "leaf": ["login", "first_name", "last_name"]},
+]
+
+# (category, slot, field): slot/field are set for indexed rules, field for leaf rules.
+Match = Tuple[str, Optional[str], Optional[str]]
+
+# Trie terminal entries: (priority, category, indexed, leaf)
+_Entry = Tuple[int, str, bool, bool]
+_TERMINAL = None
+
+
+def load_rules(path: str = DEFAULT_RULES_PATH) -> List[Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            config = json.load(fh)
+    except (OSError, json.JSONDecodeError):
+        return DEFAULT_RULES
+    rules = config.get("rules") if isinstance(config, dict) else None
+    return rules if isinstance(rules, list) and rules else DEFAULT_RULES
+
+
+def _patterns(rule: Dict[str, Any], key: str, priority: int) -> List[str]:
+    value = rule.get(key, [])
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, list) or not all(isinstance(p, str) and p for p in value):
+        raise ValueError(f"classify rule {priority}: {key} must be a string or a list of non-empty strings")
+    return value
+
+
+def _insert(root: Dict[Any, Any], key: str, entry: _Entry) -> None:
+    node = root
+    for ch in key:
+        node = node.setdefault(ch, {})
+    node.setdefault(_TERMINAL, []).append(entry)
+
+
+class PathRules:
+    """Rules compiled into prefix/suffix tries; match(path) -> (category, slot, field)."""
+
+    def __init__(self, rules: Iterable[Dict[str, Any]]):
+        self._prefix: Dict[Any, Any] = {}
+        self._suffix: Dict[Any, Any] = {}
+        for priority, rule in enumerate(rules):
+            category = rule.get("category")
+            if category not in CATEGORIES:
+                raise ValueError(f"classify rule {priority}: unknown category {category!r}")
+            indexed = bool(rule.get("indexed"))
+            for pattern in _patterns(rule, "prefix", priority):
+                if indexed and not pattern.endswith("["):
+                    raise ValueError(f"classify rule {priority}: indexed prefix {pattern!r} must end with '['")
+                _insert(self._prefix, pattern, (priority, category, indexed, False))
+            for pattern in _patterns(rule, "suffix", priority):
+                _insert(self._suffix, pattern[::-1], (priority, category, False, False))
+            for pattern in _patterns(rule, "leaf", priority):
+                _insert(self._suffix, pattern[::-1], (priority, category, False, True))
+        self.match = functools.lru_cache(maxsize=MEMO_SIZE)(self._lookup)
+
+    @classmethod
+    def from_file(cls, path: str = DEFAULT_RULES_PATH) -> "PathRules":
+        return cls(load_rules(path))
+
+    def _lookup(self, path: str) -> Match:
+        best: Optional[_Entry] = None
+        node = self._prefix
+        for ch in path:
+            node = node.get(ch)
+            if node is None:
+                break
+            for entry in node.get(_TERMINAL, ()):
+                if best is None or entry[0] < best[0]:
+                    best = entry
+        node = self._suffix
+        for i in range(len(path) - 1, -1, -1):
+            node = node.get(path[i])
+            if node is None:
+                break
+            for entry in node.get(_TERMINAL, ()):
+                if entry[3] and i and path[i - 1] != ".":
+                    continue
+                if best is None or entry[0] < best[0]:
+                    best = entry
+        if best is None:
+            return (OTHER, None, None)
+        _, category, indexed, leaf = best
+        if indexed:
+            slot = path.split("]")[0].split("[", 1)[1]
+            field = path.split("].", 1)[1] if "]." in path else path
+            return (category, slot, field)
+        if leaf:
+            return (category, None, path.rsplit(".", 1)[-1])
+        return (category, None, None)
+
+
+@functools.lru_cache(maxsize=None)
+def get_rules(path: str = DEFAULT_RULES_PATH) -> PathRules:
+    """One compiled PathRules per config path (per process)."""
+    return PathRules.from_file(path)
+
+
+# -- benchmark --------------------------------------------------------------
+_LEGACY_IGNORE_SUFFIXES = ("updated_at", "created_at", "marked_at", "anonymize_date", "data_erasure_date")
+
+SAMPLE_PATHS = [
+    "location", "wallet", "correction_point", "login", "first_name", "last_name",
+    "updated_at", "coalitions[0].score", "coalitions_users[1].updated_at",
+    "achievements[3].name", "achievements[3].updated_at", "achievements[12]",
+    "projects_users[7].status", "projects_users[7].retriable_at", "projects_users[7].final_mark",
+    "projects_users[7].project.name", "projects_users[2].marked_at", "cursus_users[0].level",
+    "campus[0].name", "user.login", "titles[0].name", "languages_users[0].language_id",
+    "image.versions.large", "pool_year", "staff?",
+]
+
+
+def legacy_dispatch(path: str) -> Match:
+    """The pre-rules if/endswith chain from classify_event(), kept for the benchmark."""
+    if path.startswith("coalitions"):
+        return ("skip", None, None)
+    if path.endswith(_LEGACY_IGNORE_SUFFIXES):
+        return ("ignore", None, None)
+    if path.endswith("location"):
+        return ("location", None, None)
+    if path.endswith("wallet"):
+        return ("wallet", None, None)
+    if path.endswith("correction_point"):
+        return ("correction_point", None, None)
+    if path.startswith("achievements["):
+        idx = path.split("]")[0].split("[", 1)[1]
+        field = path.split("].", 1)[1] if "]." in path else path
+        return ("achievements", idx, field)
+    if path.startswith("projects_users["):
+        idx = path.split("]")[0].split("[", 1)[1]
+        field = path.split("].", 1)[1] if "]." in path else path
+        return ("projects", idx, field)
+    leaf = path.split(".")[-1]
+    if leaf in ("login", "first_name", "last_name"):
+        return ("data", None, leaf)
+    return (OTHER, None, None)
+
+
+def queue_paths(path: str) -> List[str]:
+    paths: List[str] = []
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                for change in event.get("changes") or []:
+                    if isinstance(change, dict) and change.get("path"):
+                        paths.append(change["path"])
+    except OSError:
+        pass
+    return paths
+
+
+def bench(rules_path: str, queue: Optional[str], rounds: int) -> Dict[str, Any]:
+    paths = list(SAMPLE_PATHS) * 40
+    if queue:
+        paths.extend(queue_paths(queue))
+
+    def per_change_ns(fn) -> float:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for path in paths:
+                fn(path)
+        return (time.perf_counter() - start) * 1e9 / (rounds * len(paths))
+
+    rules = PathRules.from_file(rules_path)
+    mismatches = sorted({p for p in paths if rules.match(p) != legacy_dispatch(p)})
+    cold_rules = PathRules.from_file(rules_path)
+    cold = per_change_ns(cold_rules._lookup)
+    return {
+        "changes": len(paths),
+        "distinct_paths": len(set(paths)),
+        "rounds": rounds,
+        "legacy_ns_per_change": round(per_change_ns(legacy_dispatch), 1),
+        "trie_uncached_ns_per_change": round(cold, 1),
+        "trie_memo_ns_per_change": round(per_change_ns(rules.match), 1),
+        "mismatches": mismatches,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compiled classify_events path rules.")
+    parser.add_argument("--rules", default=DEFAULT_RULES_PATH, help="Rules config (default: scripts/config/classify_rules.json)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_match = sub.add_parser("match", help="Show the category of change paths")
+    p_match.add_argument("paths", nargs="+")
+    p_bench = sub.add_parser("bench", help="Per-change dispatch cost: legacy chain vs compiled rules")
+    p_bench.add_argument("--queue", default=None, help="Also use the change paths of an events_queue.jsonl")
+    p_bench.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.cmd == "match":
+        rules = PathRules.from_file(args.rules)
+        for path in args.paths:
+            print(json.dumps({"path": path, "match": rules.match(path)}))
+    else:
+        print(json.dumps(bench(args.rules, args.queue, args.rounds), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -88,9 +88,10 @@ section "Process flow overview"
 fetch_q_int="$BACKLOG_DIR/fetch_queue_internal.txt"
 fetch_q_ext="$BACKLOG_DIR/fetch_queue_external.txt"
 process_q="$BACKLOG_DIR/process_queue.txt"
-echo "- fetch_queue_internal: $(wc -l < "${fetch_q_int}" 2>/dev/null || echo 0) entries (${fetch_q_int})"
-echo "- fetch_queue_external: $(wc -l < "${fetch_q_ext}" 2>/dev/null || echo 0) entries (${fetch_q_ext})"
-echo "- process_queue: $(wc -l < "${process_q}" 2>/dev/null || echo 0) entries (${process_q})"
+queue_len() { python3 "$ROOT_DIR/scripts/agents/queue_store.py" len --file "$1" 2>/dev/null || echo 0; }
+echo "- fetch_queue_internal: $(queue_len "${fetch_q_int}") entries ($BACKLOG_DIR/queues.db, inbox ${fetch_q_int})"
+echo "- fetch_queue_external: $(queue_len "${fetch_q_ext}") entries ($BACKLOG_DIR/queues.db, inbox ${fetch_q_ext})"
+echo "- process_queue: $(queue_len "${process_q}") entries ($BACKLOG_DIR/queues.db, inbox ${process_q})"
 
 echo ""
 echo "Last detector run:"
@@ -104,6 +105,10 @@ echo ""
 echo "Last upserter log:"
 safe_tail "$LOG_DIR/upserter.log" 1
 
+section "Pipeline stage latency"
+# Written by scripts/agents/metrics.py (Prometheus textfiles live next to the state files).
+python3 "$ROOT_DIR/scripts/agents/metrics.py" --dir "$BACKLOG_DIR/metrics" summary 2>/dev/null || echo "(metrics unavailable)"
+
 section "Suggested extra KPIs"
 echo "- DB availability (psql select 1) and replication lag if any"
 echo "- API token TTL (from .oauth_state EXPIRES_AT)"
@@ -314,6 +314,7 @@ prepare_backlog() {
   mkdir -p "$BACKLOG_DIR"
   local backlog_file="$BACKLOG_DIR/pending_users.txt"
   : > "$backlog_file"
+  python3 "$SCRIPTS_DIR/agents/queue_store.py" clear --file "$backlog_file" >/dev/null 2>&1 || true
   log INFO "Backlog file prepared (cleared): $backlog_file"
 }
 
@@ -6,6 +6,13 @@
 #   scripts/pipeline/detector_manager.sh stop    # stop if running
 #   scripts/pipeline/detector_manager.sh status  # show status
 #   scripts/pipeline/detector_manager.sh restart # stop then start
+#   scripts/pipeline/detector_manager.sh reload  # SIGHUP the resident daemon (re-read config)
+#
+# With DETECTOR_DAEMON=1 (env or agents.config) start also launches
+# scripts/agents/detector_daemon.py; detector.sh then submits each window to it.
+# Its pid file is the daemon's own .backlog/detector_daemon.pid (also checked by
+# history_replay.py); stop waits up to DETECTOR_DAEMON_STOP_TIMEOUT seconds for
+# it to checkpoint and exit before SIGKILL.
 
 set -euo pipefail
 
@@ -14,8 +21,11 @@ LOG_DIR="$ROOT_DIR/logs"
 PID_FILE="$LOG_DIR/detector.pid"
 AGENTS_CONFIG="$ROOT_DIR/scripts/config/agents.config"
 DETECT_SCRIPT="$ROOT_DIR/scripts/agents/detector.sh"
+DAEMON_SCRIPT="$ROOT_DIR/scripts/agents/detector_daemon.py"
+DAEMON_PID_FILE="$ROOT_DIR/.backlog/detector_daemon.pid"
+DETECTOR_DAEMON_STOP_TIMEOUT="${DETECTOR_DAEMON_STOP_TIMEOUT:-30}"
 
-mkdir -p "$LOG_DIR"
+mkdir -p "$LOG_DIR" "$ROOT_DIR/.backlog"
 
 # Read interval from env or agents.config
 DETECTOR_INTERVAL="${DETECTOR_INTERVAL:-}"
@@ -23,16 +33,63 @@ if [[ -z "$DETECTOR_INTERVAL" && -f "$AGENTS_CONFIG" ]]; then
   DETECTOR_INTERVAL=$(grep -E '^\s*DETECTOR_INTERVAL=' "$AGENTS_CONFIG" | head -1 | cut -d= -f2 | tr -d '"')
 fi
 DETECTOR_INTERVAL="${DETECTOR_INTERVAL:-120}"
+DETECTOR_DAEMON="${DETECTOR_DAEMON:-}"
+if [[ -z "$DETECTOR_DAEMON" && -f "$AGENTS_CONFIG" ]]; then
+  DETECTOR_DAEMON=$(grep -E '^\s*DETECTOR_DAEMON=' "$AGENTS_CONFIG" | head -1 | cut -d= -f2 | tr -d '"')
+fi
+DETECTOR_DAEMON="${DETECTOR_DAEMON:-0}"
 
 is_running() {
-  local pid="$1"
-  [[ -n "$pid" ]] && ps -p "$pid" -o pid= >/dev/null 2>&1
+  # A zombie (exited, not yet reaped, e.g. under a container init) is not running
+  local pid="$1" state
+  [[ -n "$pid" ]] || return 1
+  state=$(ps -p "$pid" -o stat= 2>/dev/null) || return 1
+  [[ -n "$state" && "$state" != Z* ]]
 }
 
 read_pid() {
   [[ -f "$PID_FILE" ]] && cat "$PID_FILE"
 }
 
+read_daemon_pid() {
+  [[ -f "$DAEMON_PID_FILE" ]] && cat "$DAEMON_PID_FILE"
+}
+
+start_daemon() {
+  local pid
+  pid=$(read_daemon_pid || true)
+  if is_running "$pid"; then
+    return 0
+  fi
+  nohup python3 "$DAEMON_SCRIPT" serve >>"$LOG_DIR/detect_changes.log" 2>&1 &
+  pid=$!
+  echo "$pid" > "$DAEMON_PID_FILE"
+  echo "Detector daemon started (pid: $pid)"
+}
+
+stop_daemon() {
+  local pid
+  pid=$(read_daemon_pid || true)
+  if is_running "$pid"; then
+    # SIGTERM: the daemon checkpoints its hash state before exiting; wait for
+    # that so a restart never runs two daemons on the same state
+    kill -TERM "$pid"
+    local waited=0
+    while is_running "$pid" && (( waited < DETECTOR_DAEMON_STOP_TIMEOUT * 10 )); do
+      sleep 0.1
+      waited=$((waited + 1))
+    done
+    if is_running "$pid"; then
+      kill -KILL "$pid" 2>/dev/null || true
+      while is_running "$pid"; do sleep 0.1; done
+      echo "Detector daemon killed after ${DETECTOR_DAEMON_STOP_TIMEOUT}s without exiting (pid: $pid)"
+    else
+      echo "Detector daemon stopped (pid: $pid)"
+    fi
+  fi
+  rm -f "$DAEMON_PID_FILE"
+}
+
 start_detector() {
   local pid
   pid=$(read_pid || true)
@@ -46,6 +103,8 @@ start_detector() {
     exit 1
   fi
 
+  [[ "$DETECTOR_DAEMON" == "1" ]] && start_daemon
+
   # Run in background, looping every DETECTOR_INTERVAL seconds
   nohup bash -c "cd '$ROOT_DIR'; while true; do bash '$DETECT_SCRIPT'; sleep '$DETECTOR_INTERVAL'; done" \
     >>"$LOG_DIR/detect_changes.log" 2>&1 &
@@ -66,6 +125,7 @@ stop_detector() {
     rm -f "$PID_FILE"
     echo "Detector not running"
   fi
+  stop_daemon
 }
 
 status_detector() {
@@ -76,6 +136,22 @@ status_detector() {
   else
     echo "Detector not running"
   fi
+  pid=$(read_daemon_pid || true)
+  if is_running "$pid"; then
+    echo "Detector daemon running (pid: $pid)"
+    python3 "$DAEMON_SCRIPT" status 2>/dev/null | grep -E '"(cycles|cached_hashes|dirty_hashes|since_checkpoint)"' || true
+  fi
+}
+
+reload_daemon() {
+  local pid
+  pid=$(read_daemon_pid || true)
+  if is_running "$pid"; then
+    kill -HUP "$pid"
+    echo "Detector daemon reloading config (pid: $pid)"
+  else
+    echo "Detector daemon not running"
+  fi
 }
 
 case "${1:-}" in
@@ -83,8 +159,9 @@ case "${1:-}" in
   stop)    stop_detector ;;
   restart) stop_detector; start_detector ;;
   status|stat|st) status_detector ;;
+  reload)  reload_daemon ;;
   *)
-    echo "Usage: $0 {start|stop|status|stat|st|restart}"
+    echo "Usage: $0 {start|stop|status|stat|st|restart|reload}"
     exit 1
     ;;
 esac
@@ -131,16 +131,20 @@ read_pid() {
 	  echo ""
 	  
 	  # Queue status
-	  FETCH_QUEUE_INT=$(wc -l < "$ROOT_DIR/.backlog/fetch_queue_internal.txt" 2>/dev/null || echo "0")
-	  FETCH_QUEUE_EXT=$(wc -l < "$ROOT_DIR/.backlog/fetch_queue_external.txt" 2>/dev/null || echo "0")
-	  PROCESS_QUEUE_SIZE=$(wc -l < "$ROOT_DIR/.backlog/process_queue.txt" 2>/dev/null || echo "0")
-	  EVENTS_QUEUE_SIZE=$(wc -l < "$ROOT_DIR/.backlog/events_queue.jsonl" 2>/dev/null || echo "0")
+	  QUEUE_STORE="$ROOT_DIR/scripts/agents/queue_store.py"
+	  FETCH_QUEUE_INT=$(python3 "$QUEUE_STORE" len --file "$ROOT_DIR/.backlog/fetch_queue_internal.txt" 2>/dev/null || echo "0")
+	  FETCH_QUEUE_EXT=$(python3 "$QUEUE_STORE" len --file "$ROOT_DIR/.backlog/fetch_queue_external.txt" 2>/dev/null || echo "0")
+	  PROCESS_QUEUE_SIZE=$(python3 "$QUEUE_STORE" len --file "$ROOT_DIR/.backlog/process_queue.txt" 2>/dev/null || echo "0")
+	  # Live queue plus records already compacted into .backlog/events_archive
+	  EVENTS_COUNTS=$(ROOT_DIR="$ROOT_DIR" python3 "$ROOT_DIR/scripts/agents/events_archive.py" count 2>/dev/null || echo "{}")
+	  EVENTS_QUEUE_SIZE=$(echo "$EVENTS_COUNTS" | jq -r '.total // 0' 2>/dev/null || echo "0")
+	  EVENTS_ARCHIVED=$(echo "$EVENTS_COUNTS" | jq -r '.archived // 0' 2>/dev/null || echo "0")
 	  
 	  echo "Queues:"
 	  echo "  • fetch_queue_internal: $FETCH_QUEUE_INT users"
 	  echo "  • fetch_queue_external: $FETCH_QUEUE_EXT users"
 	  echo "  • process_queue: $PROCESS_QUEUE_SIZE users"
-	  echo "  • events_queue: $EVENTS_QUEUE_SIZE events"
+	  echo "  • events_queue: $EVENTS_QUEUE_SIZE events ($EVENTS_ARCHIVED archived)"
 	}
 
 case "${1:-}" in
@@ -51,10 +51,12 @@ bash "$BACKLOG_WORKER" stop || true
 
 if [[ $CLEAR_QUEUES -eq 1 ]]; then
   log "Clearing backlog queues..."
-  : > "$BACKLOG_DIR/events_queue.jsonl"
-  : > "$BACKLOG_DIR/fetch_queue_internal.txt"
-  : > "$BACKLOG_DIR/fetch_queue_external.txt"
-  : > "$BACKLOG_DIR/process_queue.txt"
+  # Live queue and its compacted archive (.backlog/events_archive) go together
+  ROOT_DIR="$ROOT_DIR" python3 "$ROOT_DIR/scripts/agents/events_archive.py" clear >/dev/null 2>&1 || : > "$BACKLOG_DIR/events_queue.jsonl"
+  for queue_file in fetch_queue_internal.txt fetch_queue_external.txt process_queue.txt; do
+    : > "$BACKLOG_DIR/$queue_file"
+    python3 "$ROOT_DIR/scripts/agents/queue_store.py" clear --file "$BACKLOG_DIR/$queue_file" >/dev/null 2>&1 || true
+  done
 fi
 
 if [[ $CLEAR_LOGS -eq 1 ]]; then
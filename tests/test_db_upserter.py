@@ -0,0 +1,114 @@
+"""
+db_upserter.py against a real Postgres: COPY into staging, ON CONFLICT upsert, reload.
+
+Needs psycopg and a libpq PG* environment (PGHOST / PGDATABASE / PGSERVICE,
+plus PGUSER / PGPASSWORD as required); skipped otherwise. data/schema.sql is
+loaded into a scratch schema that is dropped afterwards.
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(REPO, "scripts", "agents"))
+
+import db_upserter  # noqa: E402
+from metrics import Metrics  # noqa: E402
+
+PG_ENV = ("PGHOST", "PGDATABASE", "PGSERVICE")
+CAMPUS = 1
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(data, fh)
+
+
+def _user(uid, wallet):
+    return {
+        "id": uid, "login": f"user{uid}", "email": f"user{uid}@example.org", "wallet": wallet,
+        "correction_point": 3, "location": None, "updated_at": "2026-01-01T00:00:00Z",
+        "campus_users": [{"campus_id": CAMPUS, "is_primary": True}], "staff?": False, "active?": True,
+    }
+
+
+@pytest.fixture
+def root(tmp_path):
+    exports = tmp_path / "exports"
+    _write(str(exports / "09_users" / f"campus_{CAMPUS}" / "user_101.json"), _user(101, 10))
+    _write(str(exports / "09_users" / f"campus_{CAMPUS}" / "user_102.json"), _user(102, 20))
+    _write(str(exports / "10_projects_users" / f"campus_{CAMPUS}" / "user_101.json"), [
+        {"id": 9001, "project": {"id": 1}, "status": "finished", "final_mark": 100, "validated?": True},
+        {"id": 9002, "project": {"id": 2}, "status": "in_progress"},
+    ])
+    _write(str(exports / "11_achievements_users" / f"campus_{CAMPUS}" / "user_101.json"), [
+        {"id": 7001, "achievement": {"id": 5}, "created_at": "2026-01-01T00:00:00Z"},
+    ])
+    return tmp_path
+
+
+@pytest.fixture
+def schema(monkeypatch):
+    if db_upserter.psycopg is None:
+        pytest.skip("psycopg is not installed")
+    if not any(os.environ.get(key) for key in PG_ENV):
+        pytest.skip("no Postgres configured (set PGHOST/PGDATABASE/PGSERVICE)")
+    name = f"db_upserter_test_{os.getpid()}"
+    with db_upserter.psycopg.connect(autocommit=True) as conn:
+        conn.execute(f"CREATE SCHEMA {name}")
+        conn.execute(f"SET search_path TO {name}")
+        with open(os.path.join(REPO, "data", "schema.sql"), "r", encoding="utf-8") as fh:
+            conn.execute(fh.read())
+    # Upserter connections: libpq PG* environment, scratch schema first.
+    monkeypatch.setattr(db_upserter, "connect_kwargs", lambda: {"options": f"-c search_path={name}"})
+    monkeypatch.setenv("METRICS_DISABLE", "1")
+    yield name
+    with db_upserter.psycopg.connect(autocommit=True) as conn:
+        conn.execute(f"DROP SCHEMA {name} CASCADE")
+
+
+def _counts(name):
+    with db_upserter.psycopg.connect() as conn:
+        return {
+            table: conn.execute(f"SELECT COUNT(*) FROM {name}.{table}").fetchone()[0]
+            for table in db_upserter.TABLES
+        }
+
+
+def _wallet(name, uid):
+    with db_upserter.psycopg.connect() as conn:
+        return conn.execute(f"SELECT wallet FROM {name}.users WHERE id = %s", (uid,)).fetchone()[0]
+
+
+def test_load_then_reload_is_idempotent(root, schema):
+    metrics = Metrics("db_upserter_test", str(root))
+    reader = db_upserter.SnapshotReader(str(root))
+    upserter = db_upserter.Upserter(metrics)
+    try:
+        assert db_upserter.upsert_uids(["101", "102", "404"], reader, upserter, None, metrics) == (2, ["404"])
+        expected = {"users": 2, "project_users": 2, "achievements_users": 1}
+        assert _counts(schema) == expected
+        assert _wallet(schema, 101) == 10
+
+        # Same batch again over the same connection: rows are updated, not duplicated.
+        _write(str(root / "exports" / "09_users" / f"campus_{CAMPUS}" / "user_101.json"), _user(101, 42))
+        assert db_upserter.upsert_uids(["101", "102"], reader, upserter, None, metrics) == (2, [])
+        assert _counts(schema) == expected
+        assert _wallet(schema, 101) == 42
+        assert _wallet(schema, 102) == 20
+    finally:
+        upserter.close()
+
+
+def test_trim_log_keeps_the_tail_in_place(tmp_path):
+    path = tmp_path / "upserter.log"
+    path.write_text("".join(f"line {n}\n" for n in range(12)))
+    inode = os.stat(path).st_ino
+    assert not db_upserter.trim_log(str(path), max_lines=12, keep_lines=5)
+    assert db_upserter.trim_log(str(path), max_lines=11, keep_lines=5)
+    assert path.read_text().splitlines() == [f"line {n}" for n in range(7, 12)]
+    assert os.stat(path).st_ino == inode
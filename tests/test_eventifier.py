@@ -0,0 +1,70 @@
+"""
+scripts/cron/eventifier.sh with EVENTIFIER_FULL_DIFF=1, run in a scratch copy of the tree.
+
+Structural changes that classify_events.py skips or ignores (updated_at,
+created_at, coalitions...) must not turn into "structure" events on their own.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+UID = 4242
+
+
+@pytest.fixture
+def root(tmp_path):
+    shutil.copytree(os.path.join(REPO, "scripts"), str(tmp_path / "scripts"),
+                    ignore=shutil.ignore_patterns("__pycache__"))
+    (tmp_path / "exports" / "09_users" / "campus_1").mkdir(parents=True)
+    return tmp_path
+
+
+def _export(root, **overrides):
+    user = {
+        "id": UID, "login": "jdoe", "first_name": "J", "last_name": "Doe", "wallet": 5, "correction_point": 2,
+        "location": None, "updated_at": "2026-10-01T10:00:00.000Z", "campus": [{"id": 1}],
+        "projects_users": [{"id": 1, "status": "in_progress", "updated_at": "2026-10-01T10:00:00.000Z"}],
+    }
+    user.update(overrides)
+    with open(root / "exports" / "09_users" / "campus_1" / f"user_{UID}.json", "w") as fh:
+        json.dump(user, fh)
+
+
+def _eventify(root):
+    """Queue the user, run one eventifier pass, return the events it appended."""
+    queue = root / ".backlog" / "events_queue.jsonl"
+    before = queue.read_text().count("\n") if queue.exists() else 0
+    (root / ".backlog").mkdir(exist_ok=True)
+    with open(root / ".backlog" / "events_pending.txt", "a") as fh:
+        fh.write(f"{UID}\n")
+    env = dict(os.environ, EVENTIFIER_FULL_DIFF="1", METRICS_DISABLE="1")
+    env.pop("ROOT_DIR", None)
+    subprocess.run(["bash", str(root / "scripts" / "cron" / "eventifier.sh")], env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return [json.loads(line) for line in queue.read_text().splitlines()[before:]]
+
+
+def test_updated_at_alone_makes_no_event(root):
+    _export(root)
+    assert _eventify(root) == []  # first sight only seeds the baselines
+
+    _export(root, updated_at="2026-10-02T10:00:00.000Z",
+            projects_users=[{"id": 1, "status": "in_progress", "updated_at": "2026-10-02T10:00:00.000Z"}])
+    assert _eventify(root) == []
+
+
+def test_structural_change_still_makes_an_event(root):
+    _export(root)
+    _eventify(root)
+
+    _export(root, updated_at="2026-10-02T10:00:00.000Z",
+            projects_users=[{"id": 1, "status": "finished", "updated_at": "2026-10-02T10:00:00.000Z"}])
+    events = _eventify(root)
+    assert len(events) == 1
+    assert events[0]["types"] == ["structure"]
+    assert [c["path"] for c in events[0]["changes"]] == ["projects_users[0].status"]